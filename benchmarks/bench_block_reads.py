@@ -0,0 +1,59 @@
+"""Compare reading the patches of a slide one read_region call at a time against reading
+blocks of block_size x block_size tiles with one call and slicing the patches from them,
+as BlockSlideReader does, in patches per second.
+
+Patches are the tiles of a square of the tile grid at the top left of the slide, read block
+by block as TileGrid orders them. Each patch is also checked for background, so the time
+includes scoring patches one at a time against scoring each block once.
+
+Usage:
+    python benchmarks/bench_block_reads.py /path/to/mock.tiff --patch_size 256 \
+        --n_patches 1024 --block_size 1 2 4 8
+"""
+import math
+import time
+import argparse
+
+from openslide import OpenSlide
+
+from extract_annotated_patches.grid import TileGrid
+from extract_annotated_patches.reader import SlideReader, BlockSlideReader
+
+
+def read_patches(reader, coords):
+    start = time.perf_counter()
+    n_tissue = sum(reader.read(x, y)[1] for x, y in coords)
+    return time.perf_counter() - start, n_tissue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("slide_path", type=str, nargs='+')
+    parser.add_argument("--patch_size", type=int, default=256)
+    parser.add_argument("--patch_overlap", type=float, default=0.0)
+    parser.add_argument("--n_patches", type=int, default=1024)
+    parser.add_argument("--block_size", type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    side = int(math.ceil(math.sqrt(args.n_patches)))
+    for slide_path in args.slide_path:
+        print(slide_path)
+        for block_size in args.block_size:
+            os_slide = OpenSlide(slide_path)
+            grid = TileGrid.from_slide(os_slide, args.patch_size, args.patch_overlap,
+                    block_size=block_size)
+            grid = grid.select((grid.tiles[:, 0] < side) & (grid.tiles[:, 1] < side))
+            coords = grid.coords.tolist()
+            if block_size == 1:
+                reader = SlideReader(os_slide, args.patch_size)
+            else:
+                reader = BlockSlideReader(os_slide, args.patch_size, block_size, step=grid.step)
+            seconds, n_tissue = read_patches(reader, coords)
+            os_slide.close()
+            print(f"  block_size {block_size}: {len(coords) / seconds:.0f} patches/s, "
+                  f"{n_tissue} of {len(coords)} patches are tissue, {reader.summary()}")
+
+
+if __name__ == "__main__":
+    main()
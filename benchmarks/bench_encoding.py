@@ -0,0 +1,79 @@
+"""Compare the encodings of --patch_format on patches read from a slide.
+
+For each encoding, reports the encode time and size per patch on one thread. Then, for
+each number of --encode_threads, reports the time per patch of reading and saving
+patches with PatchFileWriter, which overlaps encoding with reading the next patch.
+
+Usage:
+    python benchmarks/bench_encoding.py extract_annotated_patches/tests/mock/slides/VOA-1932A.tiff \
+        --patch_size 512 --n_patches 200 --encode_threads 0 1 2 4
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from openslide import OpenSlide
+
+import submodule_utils.image.preprocess as preprocess
+from extract_annotated_patches.encoding import PatchEncoder, PatchFileWriter
+
+ENCODINGS = [
+    ('png, level 1', dict(patch_format='png', png_compress_level=1)),
+    ('png, level 6 (PIL default)', dict(patch_format='png', png_compress_level=6)),
+    ('png, level 9', dict(patch_format='png', png_compress_level=9)),
+    ('jpeg, quality 90', dict(patch_format='jpeg', jpeg_quality=90)),
+    ('webp, quality 90', dict(patch_format='webp', webp_quality=90)),
+    ('npy', dict(patch_format='npy')),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("slide_path", type=str)
+    parser.add_argument("--patch_size", type=int, default=512)
+    parser.add_argument("--n_patches", type=int, default=200)
+    parser.add_argument("--encode_threads", type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument("--patch_format", type=str, default='png',
+            help="Encoding used to compare numbers of threads.")
+    args = parser.parse_args()
+
+    os_slide = OpenSlide(args.slide_path)
+    width, height = os_slide.dimensions
+    coords = []
+    for y in range(0, height - args.patch_size + 1, args.patch_size):
+        for x in range(0, width - args.patch_size + 1, args.patch_size):
+            patch = preprocess.extract(os_slide, x, y, args.patch_size)
+            if preprocess.check_luminance(preprocess.pillow_image_to_ndarray(patch)):
+                coords.append((x, y))
+            if len(coords) >= args.n_patches:
+                break
+        if len(coords) >= args.n_patches:
+            break
+    patches = [preprocess.extract(os_slide, x, y, args.patch_size) for x, y in coords]
+    print(f"{len(patches)} tissue patches of {args.patch_size}px")
+
+    for name, kwargs in ENCODINGS:
+        encoder = PatchEncoder(**kwargs)
+        start = time.perf_counter()
+        n_bytes = sum(len(encoder.encode(patch)) for patch in patches)
+        encode_time = time.perf_counter() - start
+        print(f"{name}: {encode_time / len(patches) * 1e3:.1f}ms/patch, "
+              f"{n_bytes / len(patches) / 1024:.0f}KB/patch")
+
+    encoder = PatchEncoder(args.patch_format)
+    for n_threads in args.encode_threads:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            with PatchFileWriter(encoder, n_threads=n_threads) as writer:
+                for x, y in coords:
+                    patch = preprocess.extract(os_slide, x, y, args.patch_size)
+                    writer.save(patch, os.path.join(tmp_dir, f"{x}_{y}.{encoder.extension}"))
+            total_time = time.perf_counter() - start
+        print(f"read and save {args.patch_format}, {n_threads} encode threads: "
+              f"{total_time / len(coords) * 1e3:.1f}ms/patch")
+
+
+if __name__ == "__main__":
+    main()
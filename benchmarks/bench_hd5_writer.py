@@ -0,0 +1,76 @@
+"""Compare writing patches into one HDF5 file per patch (previous behaviour of
+--store_extracted_patches_as_hd5) against the buffered HD5PatchWriter.
+
+Usage:
+    python benchmarks/bench_hd5_writer.py --num_patches 2000 --patch_size 256
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import h5py
+import numpy as np
+
+from extract_annotated_patches.writers import HD5PatchWriter
+
+
+def make_patches(num_patches, patch_size, seed=256):
+    """Create smooth, tissue-like patches so compression ratios are realistic.
+    """
+    rng = np.random.RandomState(seed)
+    base = rng.randint(120, 230, size=(8, patch_size // 8 + 1, patch_size // 8 + 1, 3))
+    base = base.repeat(8, axis=1).repeat(8, axis=2)[:, :patch_size, :patch_size]
+    noise = rng.randint(0, 4, size=(8, patch_size, patch_size, 3))
+    patches = (base + noise).astype(np.uint8)
+    return [patches[i % len(patches)] for i in range(num_patches)]
+
+
+def write_per_patch(hd5_name, patches, label, patch_size):
+    for i, patch in enumerate(patches):
+        hf = h5py.File(hd5_name, 'a')
+        patch_path = os.path.join(label, 'slide', str(patch_size), f"{i}_{i}.png")
+        hf.create_dataset(patch_path, data=patch, chunks=True,
+                          compression="gzip", compression_opts=9)
+        hf.close()
+
+
+def write_batched(hd5_name, patches, label, patch_size, compression, compression_level):
+    with HD5PatchWriter(hd5_name, compression=compression,
+            compression_level=compression_level) as writer:
+        for i, patch in enumerate(patches):
+            writer.add(label, patch_size, patch, i, i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num_patches", type=int, default=2000)
+    parser.add_argument("--patch_size", type=int, default=256)
+    args = parser.parse_args()
+
+    patches = make_patches(args.num_patches, args.patch_size)
+    cases = [('per-patch gzip 9', None, None),
+             ('batched none', 'none', None),
+             ('batched lzf', 'lzf', None),
+             ('batched gzip 1', 'gzip', 1),
+             ('batched gzip 4', 'gzip', 4),
+             ('batched gzip 9', 'gzip', 9)]
+    print(f"{args.num_patches} patches of {args.patch_size}x{args.patch_size}")
+    print(f"{'writer':<20}{'seconds':>10}{'patches/s':>12}{'MB':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, compression, level in cases:
+            hd5_name = os.path.join(tmpdir, f"{name.replace(' ', '_')}.h5")
+            start = time.perf_counter()
+            if compression is None:
+                write_per_patch(hd5_name, patches, 'Tumor', args.patch_size)
+            else:
+                write_batched(hd5_name, patches, 'Tumor', args.patch_size,
+                        compression, level)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(hd5_name) / 2**20
+            print(f"{name:<20}{elapsed:>10.2f}{args.num_patches / elapsed:>12.1f}{size:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
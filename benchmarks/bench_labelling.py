@@ -0,0 +1,50 @@
+"""Compare labelling the tile grid of a slide one tile at a time with
+GroovyAnnotation.points_to_label against the vectorized annotation_to_labels.
+
+Usage:
+    python benchmarks/bench_labelling.py extract_annotated_patches/tests/mock/annotations/VOA-1932A.txt --patch_size 256
+"""
+import time
+import argparse
+
+import numpy as np
+
+from submodule_utils.metadata.annotation import GroovyAnnotation
+from extract_annotated_patches.labelling import (
+        get_tile_corners, annotation_to_labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("annotation_location", type=str)
+    parser.add_argument("--patch_size", type=int, default=256)
+    parser.add_argument("--max_per_tile", type=int, default=20000,
+            help="Number of tiles labelled one at a time; the rate is extrapolated to the whole grid.")
+    args = parser.parse_args()
+
+    annotation = GroovyAnnotation(args.annotation_location)
+    vertices = np.concatenate([path.vertices for paths in annotation.paths.values()
+            for path in paths])
+    x_max, y_max = vertices.max(axis=0).astype(int) + args.patch_size
+    xs, ys = np.meshgrid(np.arange(0, x_max, args.patch_size),
+            np.arange(0, y_max, args.patch_size))
+    coords = np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+    start = time.perf_counter()
+    labels = annotation_to_labels(annotation, coords, args.patch_size)
+    batch_time = time.perf_counter() - start
+
+    sample = get_tile_corners(coords[:args.max_per_tile], args.patch_size)
+    start = time.perf_counter()
+    for corners in sample:
+        annotation.points_to_label(corners)
+    per_tile_time = (time.perf_counter() - start) * len(coords) / len(sample)
+
+    print(f"{len(coords)} tiles, {sum(map(bool, labels))} labelled")
+    print(f"per tile   : {per_tile_time:.2f}s (extrapolated from {len(sample)} tiles)")
+    print(f"vectorized : {batch_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compare looking up the rows of slides in a manifest by scanning the slide_path column,
+as produce_args did, against ManifestIndex, on a synthetic manifest.
+
+Usage:
+    python benchmarks/bench_manifest_index.py --n_rows 100000 --n_lookups 10000
+"""
+import time
+import random
+import argparse
+
+from extract_annotated_patches.manifest import ManifestIndex
+
+
+def make_manifest(n_rows):
+    return {
+        'slide_path': [f"/slides/subtype_{i % 5}/VOA-{i}A.svs" for i in range(n_rows)],
+        'subtype': [f"subtype_{i % 5}" for i in range(n_rows)],
+        'annotation_path': [f"/annotations/VOA-{i}A.txt" for i in range(n_rows)],
+        'mask_path': [f"/masks/VOA-{i}A.png" for i in range(n_rows)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n_rows", type=int, default=100000)
+    parser.add_argument("--n_lookups", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = make_manifest(args.n_rows)
+    slide_paths = random.Random(args.seed).sample(manifest['slide_path'],
+            min(args.n_lookups, args.n_rows))
+
+    start = time.perf_counter()
+    expected = [manifest['subtype'][manifest['slide_path'].index(p)] for p in slide_paths]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = ManifestIndex(manifest)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    subtypes = [index.get_subtype(p) for p in slide_paths]
+    lookup_time = time.perf_counter() - start
+    assert subtypes == expected
+
+    print(f"{args.n_rows} rows, {len(slide_paths)} lookups")
+    print(f"list.index scan: {scan_time:.2f}s, "
+          f"{scan_time / len(slide_paths) * 1e6:.1f}us per lookup")
+    print(f"ManifestIndex  : build {build_time:.2f}s, lookups {lookup_time:.4f}s, "
+          f"{lookup_time / len(slide_paths) * 1e6:.2f}us per lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare time and peak memory of the use-mosaic clustering engines and features
+against the number of tissue tiles of a slide.
+
+Each case runs in a fresh process so its peak resident memory is measured on its own.
+Evaluation tiles are synthetic: a few stain colours with noise.
+
+Usage:
+    python benchmarks/bench_mosaic_clustering.py --n_tiles 10000 50000 200000
+"""
+import time
+import resource
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+from extract_annotated_patches.mosaic import MosaicClustering
+
+COLOURS = np.array([(230, 120, 180), (120, 60, 160), (200, 150, 190),
+        (240, 240, 240), (90, 40, 110)], dtype=np.int16)
+
+
+def run_case(n_tiles, clustering, features, args, queue):
+    random_state = np.random.RandomState(0)
+    start = time.perf_counter()
+    mosaic = MosaicClustering(n_tiles, args.n_clusters, args.percentage,
+            clustering=clustering, features=features, batch_size=args.batch_size)
+    for chunk_start in range(0, n_tiles, args.chunk_size):
+        n_chunk = min(args.chunk_size, n_tiles - chunk_start)
+        colours = COLOURS[random_state.randint(len(COLOURS), size=n_chunk)]
+        noise = random_state.randint(-20, 20,
+                size=(n_chunk, args.evaluation_size, args.evaluation_size, 3))
+        tiles = np.clip(colours[:, np.newaxis, np.newaxis, :] + noise, 0, 255).astype(np.uint8)
+        coords = random_state.randint(0, 1000, size=(n_chunk, 2)) * 1024
+        mosaic.add(tiles, coords)
+    selected = mosaic.select()
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((elapsed, peak_rss, len(selected)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n_tiles", type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument("--clustering", type=str, nargs='+', default=['kmeans', 'minibatch'])
+    parser.add_argument("--features", type=str, nargs='+', default=['rgb', 'hsv'])
+    parser.add_argument("--n_clusters", type=int, default=9)
+    parser.add_argument("--percentage", type=float, default=0.05)
+    parser.add_argument("--evaluation_size", type=int, default=32)
+    parser.add_argument("--chunk_size", type=int, default=1024)
+    parser.add_argument("--batch_size", type=int, default=1024)
+    args = parser.parse_args()
+
+    context = mp.get_context('spawn')
+    print(f"{'tiles':>8} {'clustering':>10} {'features':>8} {'time (s)':>9} {'peak RSS (MB)':>14} {'selected':>9}")
+    for n_tiles in args.n_tiles:
+        for clustering in args.clustering:
+            for features in args.features:
+                queue = context.Queue()
+                process = context.Process(target=run_case,
+                        args=(n_tiles, clustering, features, args, queue))
+                process.start()
+                elapsed, peak_rss, n_selected = queue.get()
+                process.join()
+                print(f"{n_tiles:>8} {clustering:>10} {features:>8} {elapsed:>9.2f} "
+                      f"{peak_rss:>14.0f} {n_selected:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare random single-patch reads from the HDF5 layouts of --store_extracted_patches_as_hd5,
+as a data loader shuffling patches would do.
+
+Patches are random noise so that compression does not make reads artificially cheap.
+
+Usage:
+    python benchmarks/bench_patch_tensor.py --n_patches 4096 --size 256 --n_reads 2000
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import h5py
+import numpy as np
+
+from extract_annotated_patches.writers import HD5PatchWriter, HD5TensorWriter, PatchTensor
+
+
+def time_reads(read, indices):
+    start = time.perf_counter()
+    for idx in indices:
+        np.asarray(read(idx)).sum()
+    return (time.perf_counter() - start) / len(indices) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n_patches", type=int, default=4096)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--n_reads", type=int, default=2000)
+    parser.add_argument("--compression", type=str, default='lzf')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    patch = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    labels = ['Tumor', 'Stroma']
+    indices = rng.integers(0, args.n_patches, args.n_reads)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        group_path = os.path.join(tmp_dir, 'group.h5')
+        with HD5PatchWriter(group_path, compression=args.compression, mode='w') as writer:
+            for i in range(args.n_patches):
+                writer.add(labels[i % 2], args.size, patch, i, i)
+        for memmap in [False, True]:
+            tensor_path = os.path.join(tmp_dir, f"tensor_{memmap}.h5")
+            with HD5TensorWriter(tensor_path, 'slide', compression=args.compression,
+                    memmap=memmap) as writer:
+                for i in range(args.n_patches):
+                    writer.add(labels[i % 2], args.size, patch, i, i)
+
+        with h5py.File(group_path, 'r') as hf:
+            group_time = time_reads(lambda i: hf[f"{labels[i % 2]}/{args.size}/patches"][i // 2],
+                    indices)
+        print(f"{args.n_patches} patches of {args.size}px, {args.n_reads} random reads")
+        print(f"group per label, {args.compression}: {group_time:.0f}us per patch")
+        for memmap in [False, True]:
+            tensor = PatchTensor(os.path.join(tmp_dir, f"tensor_{memmap}.h5"), args.size)
+            tensor_time = time_reads(tensor.__getitem__, indices)
+            tensor.close()
+            name = "tensor, memmap" if memmap else f"tensor, {args.compression}"
+            print(f"{name}: {tensor_time:.0f}us per patch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compare extracting the tiles of a slide one after the other against PatchPipeline.
+
+Every tissue tile is read, resized to --resize_sizes and saved as a PNG file, as with
+--store_extracted_patches. Reports the time per patch and the time of each pipeline stage.
+
+Usage:
+    python benchmarks/bench_pipeline.py /path/to/slide.tiff --patch_size 1024 \
+        --resize_sizes 1024 512 --n_tiles 500 --resize_threads 0 1 2
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from openslide import OpenSlide
+
+from extract_annotated_patches.reader import SlideReader
+from extract_annotated_patches.encoding import PatchEncoder, PatchFileWriter
+from extract_annotated_patches.pipeline import (PatchPipeline, default_read_queue_depth,
+        default_write_queue_depth)
+
+
+def extract(reader, coords, resize_sizes, store, tmp_dir):
+    n_patches = 0
+    for x, y in coords:
+        patch, check = reader.read(x, y)
+        if not check:
+            continue
+        patch_paths = {size: os.path.join(tmp_dir, f"{x}_{y}_{size}.png") for size in resize_sizes}
+        if isinstance(reader, PatchPipeline):
+            reader.submit('Tumor', patch, x, y, patch_paths)
+        else:
+            store('Tumor', reader.resizer.resize(patch, x, y, resize_sizes), x, y, patch_paths)
+        n_patches += 1
+    return n_patches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("slide_path", type=str)
+    parser.add_argument("--patch_size", type=int, default=1024)
+    parser.add_argument("--resize_sizes", type=int, nargs='+', default=[1024, 512])
+    parser.add_argument("--n_tiles", type=int, default=500)
+    parser.add_argument("--encode_threads", type=int, default=0)
+    parser.add_argument("--resize_threads", type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument("--read_queue_depth", type=int, default=default_read_queue_depth)
+    parser.add_argument("--write_queue_depth", type=int, default=default_write_queue_depth)
+    args = parser.parse_args()
+
+    os_slide = OpenSlide(args.slide_path)
+    width, height = os_slide.dimensions
+    coords = [(x, y) for y in range(0, height - args.patch_size + 1, args.patch_size)
+            for x in range(0, width - args.patch_size + 1, args.patch_size)][:args.n_tiles]
+    encoder = PatchEncoder('png')
+
+    for resize_threads in [None] + args.resize_threads:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            slide_reader = SlideReader(os_slide, args.patch_size)
+            writer = PatchFileWriter(encoder, n_threads=args.encode_threads)
+            store = lambda label, resized, x, y, patch_paths: [writer.save(resized[size], path)
+                    for size, path in patch_paths.items()]
+            start = time.perf_counter()
+            if resize_threads is None:
+                n_patches = extract(slide_reader, coords, args.resize_sizes, store, tmp_dir)
+                name = "serial"
+            else:
+                with PatchPipeline(slide_reader, store, args.resize_sizes,
+                        read_queue_depth=args.read_queue_depth,
+                        write_queue_depth=args.write_queue_depth,
+                        resize_threads=resize_threads) as pipeline:
+                    pipeline.start(coords)
+                    n_patches = extract(pipeline, coords, args.resize_sizes, store, tmp_dir)
+                name = f"pipeline, {resize_threads} resize threads"
+            writer.close()
+            total_time = time.perf_counter() - start
+        print(f"{name}: {n_patches} patches, {total_time / max(n_patches, 1) * 1e3:.1f}ms/patch")
+        if resize_threads is not None:
+            print(f"    {pipeline.summary()}")
+
+
+if __name__ == "__main__":
+    main()
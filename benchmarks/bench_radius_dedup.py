@@ -0,0 +1,82 @@
+"""Compare deduplicating the neighbours of seeds extracted with --use_radius using
+a list per label against CoordinateIndex, for increasing numbers of seeds, and against
+finding the unique neighbours of all seeds at once with expand_radius.
+
+Seeds fill a square of the tile grid, as on a dense annotation, so neighbourhoods overlap
+heavily. Neighbours come from get_circular_neighbours per seed. The list is only timed up
+to --max_list_seeds seeds since it is quadratic.
+
+Usage:
+    python benchmarks/bench_radius_dedup.py --radius 3 5 --n_seeds 5000 20000 80000
+"""
+import math
+import time
+import argparse
+
+from extract_annotated_patches.grid import (CoordinateIndex, get_circular_neighbours,
+        expand_radius)
+
+
+def dedup_list(seeds, neighbours):
+    extracted_coordinates = []
+    for seed in seeds:
+        for coord in neighbours[seed]:
+            if coord in extracted_coordinates:
+                continue
+            extracted_coordinates.append(coord)
+    return len(extracted_coordinates)
+
+
+def dedup_index(seeds, neighbours, slide_size, stride):
+    extracted_coordinates = CoordinateIndex(slide_size, stride)
+    count = 0
+    for seed in seeds:
+        for x, y in neighbours[seed]:
+            if extracted_coordinates.contains('Tumor', x, y):
+                continue
+            extracted_coordinates.add('Tumor', x, y)
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--radius", type=int, nargs='+', default=[3, 5])
+    parser.add_argument("--n_seeds", type=int, nargs='+', default=[5000, 20000, 80000])
+    parser.add_argument("--patch_size", type=int, default=256)
+    parser.add_argument("--max_list_seeds", type=int, default=5000)
+    args = parser.parse_args()
+
+    stride = args.patch_size
+    for radius in args.radius:
+        for n_seeds in args.n_seeds:
+            side = int(math.ceil(math.sqrt(n_seeds)))
+            slide_size = ((side + 2 * radius) * stride, (side + 2 * radius) * stride)
+            seeds = [((radius + i % side) * stride, (radius + i // side) * stride)
+                    for i in range(n_seeds)]
+            start = time.perf_counter()
+            neighbours = {(x, y): list(map(tuple, get_circular_neighbours(radius, x, y, stride,
+                    slide_size, args.patch_size).tolist())) for x, y in seeds}
+            neighbour_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            count = dedup_index(seeds, neighbours, slide_size, stride)
+            index_time = time.perf_counter() - start
+            if n_seeds <= args.max_list_seeds:
+                start = time.perf_counter()
+                assert dedup_list(seeds, neighbours) == count
+                list_time = f"{time.perf_counter() - start:.2f}s"
+            else:
+                list_time = "skipped"
+            start = time.perf_counter()
+            coords, _ = expand_radius(seeds, radius, stride, slide_size, args.patch_size)
+            expand_time = time.perf_counter() - start
+            assert len(coords) == count
+            print(f"radius {radius}, {n_seeds} seeds, {count} patches: "
+                  f"neighbours {neighbour_time:.2f}s, list {list_time}, "
+                  f"CoordinateIndex {index_time:.2f}s, expand_radius {expand_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare the resize methods on patches read from a slide.
+
+For each method, reports the throughput of each size and the mean absolute difference in pixel values from the 'independent' method. Exits with an error if a difference is above the tolerance.
+
+Usage:
+    python benchmarks/bench_resize.py /path/to/slide.tiff --patch_size 1024 --resize_sizes 512 256 128
+"""
+import sys
+import argparse
+
+from openslide import OpenSlide
+
+import submodule_utils.image.preprocess as preprocess
+from extract_annotated_patches.resizing import (RESIZE_METHODS, PatchResizer,
+        resize_difference, default_resize_tolerance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("slide_path", type=str)
+    parser.add_argument("--patch_size", type=int, default=1024)
+    parser.add_argument("--resize_sizes", type=int, nargs='+', default=[512, 256, 128])
+    parser.add_argument("--n_patches", type=int, default=100)
+    parser.add_argument("--tolerance", type=float, default=default_resize_tolerance,
+            help="Maximum mean absolute difference from 'independent' in pixel values.")
+    args = parser.parse_args()
+
+    os_slide = OpenSlide(args.slide_path)
+    width, height = os_slide.dimensions
+    coords = [(x, y) for y in range(0, height - args.patch_size + 1, args.patch_size)
+            for x in range(0, width - args.patch_size + 1, args.patch_size)][:args.n_patches]
+    patches = [preprocess.extract(os_slide, x, y, args.patch_size) for x, y in coords]
+
+    resizers = {method: PatchResizer(os_slide, args.patch_size, method=method)
+            for method in RESIZE_METHODS}
+    differences = {method: {size: 0. for size in args.resize_sizes} for method in RESIZE_METHODS}
+    for (x, y), patch in zip(coords, patches):
+        reference = resizers['independent'].resize(patch, x, y, args.resize_sizes)
+        for method in RESIZE_METHODS[1:]:
+            resized = resizers[method].resize(patch, x, y, args.resize_sizes)
+            for size in args.resize_sizes:
+                differences[method][size] = max(differences[method][size],
+                        resize_difference(reference[size], resized[size]))
+
+    failed = False
+    print(f"{len(coords)} patches of {args.patch_size}px")
+    for method, resizer in resizers.items():
+        print(f"{method:>12}: {resizer.summary()}")
+        for size in args.resize_sizes:
+            if differences[method][size] > args.tolerance:
+                failed = True
+        if method != 'independent':
+            print(" " * 14 + "max difference " + ", ".join(f"{size}px: {difference:.2f}"
+                    for size, difference in differences[method].items()))
+    if failed:
+        sys.exit(f"Difference above tolerance {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Compare reading the patches of slide coordinates one read_region call at a time against
+reading runs of adjacent patches with one call, as use-slide-coords does.
+
+Coordinates are the full tile grid of the slide, shuffled as in a slide coords JSON file.
+
+Usage:
+    python benchmarks/bench_row_runs.py /path/to/slide.tiff --patch_size 256 --n_patches 2000 \
+        --read_run_length 1 4 8 16
+"""
+import time
+import random
+import argparse
+
+from openslide import OpenSlide
+
+import submodule_utils.image.preprocess as preprocess
+from extract_annotated_patches.reader import group_row_runs, read_row_run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("slide_path", type=str)
+    parser.add_argument("--patch_size", type=int, default=256)
+    parser.add_argument("--n_patches", type=int, default=2000)
+    parser.add_argument("--read_run_length", type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os_slide = OpenSlide(args.slide_path)
+    width, height = os_slide.dimensions
+    coords = [(x, y) for y in range(0, height - args.patch_size + 1, args.patch_size)
+            for x in range(0, width - args.patch_size + 1, args.patch_size)][:args.n_patches]
+    random.Random(args.seed).shuffle(coords)
+
+    start = time.perf_counter()
+    for x, y in coords:
+        preprocess.extract(os_slide, x, y, args.patch_size)
+    unsorted_time = time.perf_counter() - start
+    print(f"{len(coords)} patches of {args.patch_size}px")
+    print(f"one call per patch, unsorted: {len(coords) / unsorted_time:.0f} patches/s")
+    for run_length in args.read_run_length:
+        start = time.perf_counter()
+        runs = group_row_runs(coords, args.patch_size, run_length)
+        for run in runs:
+            read_row_run(os_slide, run, args.patch_size)
+        run_time = time.perf_counter() - start
+        print(f"runs of up to {run_length} patches, {len(runs)} calls: "
+              f"{len(coords) / run_time:.0f} patches/s")
+
+
+if __name__ == "__main__":
+    main()
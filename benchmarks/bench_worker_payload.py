@@ -0,0 +1,76 @@
+"""Measure what is sent to worker processes for a run, and how long workers take to start.
+
+Compares sending the whole extractor with each slide against sending the worker context
+once per worker and a SlideTask per slide, and times starting the pool with each payload.
+The extractor is built from the arguments after --, as for extract_annotated_patches.
+
+Usage:
+    python benchmarks/bench_worker_payload.py --n_process 8 --start_method spawn -- \
+        --hd5_location ... use-manifest ... use-annotation ...
+"""
+import sys
+import time
+import pickle
+import argparse
+import multiprocessing as mp
+
+import extract_annotated_patches.parser
+from extract_annotated_patches import AnnotatedPatchesExtractor
+from extract_annotated_patches.scheduler import START_METHODS, SlideTask
+
+
+class FullExtractor(object):
+    """Pickles every attribute of an extractor, as when the extractor was sent with each slide.
+    """
+    def __init__(self, extractor):
+        self.state = extractor.__dict__
+
+
+def _init_worker(payload):
+    pass
+
+
+def _ready(i):
+    return i
+
+
+def start_latency(payload, n_process, start_method):
+    start = time.perf_counter()
+    with mp.get_context(start_method).Pool(n_process, initializer=_init_worker,
+            initargs=(payload,)) as pool:
+        pool.map(_ready, range(n_process), chunksize=1)
+    return time.perf_counter() - start
+
+
+def main():
+    argv = sys.argv[1:]
+    extractor_argv = argv[argv.index('--') + 1:] if '--' in argv else []
+    argv = argv[:argv.index('--')] if '--' in argv else argv
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n_process", type=int, default=8)
+    parser.add_argument("--start_method", type=str, default='spawn', choices=START_METHODS)
+    args = parser.parse_args(argv)
+
+    config = extract_annotated_patches.parser.create_parser().get_args(extractor_argv)
+    extractor = AnnotatedPatchesExtractor(config)
+    args_list = extractor.produce_args(extractor.slide_paths)
+    tasks = [SlideTask(idx, extractor.extract_method_name, arg) for idx, arg in enumerate(args_list)]
+    task_bytes = sum(len(pickle.dumps(task)) for task in tasks)
+    full_bytes = len(pickle.dumps(FullExtractor(extractor)))
+    context_bytes = len(pickle.dumps(extractor))
+    n_workers = min(args.n_process, len(tasks))
+
+    print(f"{len(tasks)} slides, {n_workers} workers, start method {args.start_method}")
+    print(f"before: {full_bytes + task_bytes / max(len(tasks), 1):.0f} bytes per slide, "
+          f"{(full_bytes * len(tasks) + task_bytes) / 2**20:.1f} MB in total")
+    print(f"after : {context_bytes} bytes per worker, {task_bytes / max(len(tasks), 1):.0f} bytes per slide, "
+          f"{(context_bytes * n_workers + task_bytes) / 2**20:.1f} MB in total")
+    print(f"pool start with the whole extractor: "
+          f"{start_latency(FullExtractor(extractor), n_workers, args.start_method):.2f}s")
+    print(f"pool start with the worker context : "
+          f"{start_latency(extractor, n_workers, args.start_method):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
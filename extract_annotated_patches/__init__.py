@@ -1,19 +1,17 @@
 # Built-ins
 import os
+import math
+import time
 import os.path
 import logging
 import json
-import multiprocessing as mp
+import functools
 from PIL import Image
-import math
 # Libraries
 import psutil
 from tqdm import tqdm
-import h5py
 import numpy as np
 from openslide import OpenSlide
-from sklearn.cluster import KMeans
-from collections import defaultdict
 
 
 # Modules
@@ -21,13 +19,32 @@ import submodule_utils as utils
 from submodule_utils.thumbnail import PlotThumbnail
 from submodule_utils.subtype_enum import BinaryEnum
 from submodule_utils.mixins import OutputMixin
-from submodule_utils.metadata.annotation import GroovyAnnotation
 from submodule_utils.metadata.tissue_mask import TissueMask
 from submodule_utils.metadata.slide_coords import (
         SlideCoordsMetadata, CoordsMetadata)
-from submodule_utils.image.extract import (
-        SlideCoordsExtractor, SlidePatchExtractor)
+from submodule_utils.image.extract import SlidePatchExtractor
 import submodule_utils.image.preprocess as preprocess
+from extract_annotated_patches.writers import (HD5PatchWriter, HD5TensorWriter, PatchCollector,
+        TarShardWriter, save_tensor_pointers, save_patch_scores)
+from extract_annotated_patches.encoding import PATCH_EXTENSIONS, PatchEncoder, PatchFileWriter
+from extract_annotated_patches.pipeline import PatchPipeline
+from extract_annotated_patches.reader import (SlideReader, PlanningReader, BlockSlideReader,
+        group_row_runs, group_blocks, read_block, iter_block_patches)
+from extract_annotated_patches.resizing import PatchResizer
+from extract_annotated_patches.grid import (CoordinateIndex, TileGrid, get_disk_offsets,
+        expand_radius)
+from extract_annotated_patches.manifest import ManifestIndex
+from extract_annotated_patches.scheduler import SlidePool, ShardPool
+from extract_annotated_patches.ledger import (
+        ExtractionLedger, make_fingerprint, file_mtime)
+from extract_annotated_patches.mosaic import (
+        get_evaluation_level, read_evaluation_tile, read_downsampled_slide,
+        cut_tiles, MosaicClustering)
+from extract_annotated_patches.labelling import (
+        TISSUE_THRESHOLD, annotation_to_labels, DetectedTissueMask, BackgroundScorer)
+from extract_annotated_patches.cache import (
+        LazyLookup, SlideDimensionsIndex, load_annotation, load_raster_tissue_mask,
+        read_annotation_labels)
 
 logger = logging.getLogger('extract_annotated_patches')
 
@@ -47,10 +64,32 @@ class AnnotatedPatchesExtractor(OutputMixin):
     ----------
     slide_coords : SlideCoordsMetadata
         Metadata object containing slide coords to use in extracting patches.
-        When 'use-annotation' is set, we DO NOT set slide_coords. Instead each child process creates a SlideCoordsMetadata and then uses multiprocess.Pipe to send them to the parent process to merge.
+        When 'use-annotation' is set, we DO NOT set slide_coords. Instead each worker process creates a CoordsMetadata for a slide and returns it to the parent process to merge.
     """
     FULL_MAGNIFICATION = 40
     MAX_N_PROCESS = 200
+    FINGERPRINT_ATTRIBUTES = ['load_method', 'extract_method', 'patch_size', 'stride',
+            'resize_sizes', 'patch_overlap', 'annotation_overlap', 'seed', 'is_tumor',
+            'is_TMA', 'max_slide_patches', 'use_radius', 'radius', 'evaluation_size',
+            'n_clusters', 'percentage', 'clustering', 'mosaic_features',
+            'resize', 'max_num_patches',
+            'store_extracted_patches', 'store_extracted_patches_as_hd5', 'hd5_layout', 'hd5_memmap',
+            'store_extracted_patches_as_tar', 'patch_format', 'jpeg_quality', 'webp_quality',
+            'resize_method', 'luminance_stride', 'block_size', 'tile_grid',
+            'plan', 'plan_downsample',
+            'tissue_detection', 'detection_downsample', 'detection_threshold']
+    """Attributes only used by the parent process, which are not sent to worker processes"""
+    PARENT_ATTRIBUTES = ['manifest', 'slide_paths', 'slide_coords_metadata']
+
+    def __getstate__(self):
+        """Get the worker context sent once to each worker process when it starts.
+
+        Workers get the coordinates of a slide with its task, so the attributes that describe the whole cohort are left out.
+        """
+        state = self.__dict__.copy()
+        for name in self.PARENT_ATTRIBUTES:
+            state.pop(name, None)
+        return state
 
     def get_magnification(self, resize_size):
         return int(float(resize_size) * float(self.FULL_MAGNIFICATION) \
@@ -64,6 +103,10 @@ class AnnotatedPatchesExtractor(OutputMixin):
     def should_use_directory(self):
         return self.load_method == 'use-directory'
 
+    @property
+    def patch_extension(self):
+        return PATCH_EXTENSIONS[self.patch_format]
+
     @property
     def should_use_hd5_files(self):
         return self.load_method == 'from-hd5-files'
@@ -84,11 +127,32 @@ class AnnotatedPatchesExtractor(OutputMixin):
     def should_use_mosaic(self):
         return self.extract_method == 'use-mosaic' if hasattr(self, 'extract_method') else False
 
+    @property
+    def should_plan(self):
+        return self.plan if hasattr(self, 'plan') else False
+
+    @property
+    def extract_method_name(self):
+        """Name of the method extracting patches from one slide.
+        """
+        if self.should_use_hd5_files:
+            return 'extract_patch_by_hd5_files'
+        elif self.should_use_annotation:
+            return 'extract_patch_by_annotation'
+        elif self.should_use_entire_slide:
+            return 'extract_patch_by_entire_slide'
+        elif self.should_use_mosaic:
+            return 'extract_patch_by_mosaic'
+        elif self.should_use_slide_coords:
+            return 'extract_patch_by_slide_coords'
+        else:
+            raise NotImplementedError(f"Extract method {self.extract_method} not implemented")
+
     def get_slide_paths(self):
         """Get paths of slides that should be extracted.
         """
         if self.should_use_manifest:
-            return self.manifest['slide_path']
+            return self.manifest.slide_paths
         elif self.should_use_directory or self.should_use_hd5_files:
             return utils.get_paths(self.slide_location, self.slide_pattern,
                     extensions=['tiff', 'tif', 'svs', 'scn'])
@@ -96,81 +160,114 @@ class AnnotatedPatchesExtractor(OutputMixin):
             raise NotImplementedError()
 
     def load_slide_tissue_mask(self):
-        """Load tissue masks from slide names.
+        """Set up the lookup of tissue masks from slide names.
+
+        Masks are only built when the slide is extracted, in the worker process extracting it. PNG masks are scaled down versions of the slide, so building a mask needs the slide dimensions, which are read from the slide path index at that time.
+
+        Returns
+        -------
+        LazyLookup
+            Lookup table of TissueMask from slide names.
         """
         if self.should_use_manifest:
-            generator = self.manifest['mask_path']
+            """The mask of a slide is in the row of the slide"""
+            files = self.manifest.get_column_files('mask_path')
         elif self.should_use_directory:
-            generator = os.listdir(self.mask_location)
+            files = {utils.path_to_filename(file): os.path.join(self.mask_location, file)
+                    for file in os.listdir(self.mask_location)}
         else:
             raise NotImplementedError()
-        # if it is .png, we need to know the true size of slide
-        # since the mask is scale down version of it
-        list_slides = self.get_slide_paths()
-        slide_tissue_mask = {}
-        for file in generator:
-            if file.endswith(".png") or file.endswith(".txt") or file.endswith(".svs"):
-                slide_name = utils.path_to_filename(file)
-                slide_path = utils.find_slide_path(list_slides, slide_name)
-                if slide_path is None: # the path to that slide was not found
+        self.slide_dimensions = SlideDimensionsIndex(self.get_slide_paths())
+        self.mask_files = {}
+        for slide_name, filepath in files.items():
+            if filepath.endswith(".png") or filepath.endswith(".txt") or filepath.endswith(".svs"):
+                if slide_name not in self.slide_dimensions: # the path to that slide was not found
                     continue
-                else:
-                    os_slide = OpenSlide(slide_path)
-                    slide_size = os_slide.dimensions
-                if self.should_use_manifest:
-                    filepath = file
-                else:
-                    filepath = os.path.join(self.mask_location, file)
-                slide_tissue_mask[slide_name] = TissueMask(filepath, 0.4, self.patch_size,
-                                                           slide_size)
-        return slide_tissue_mask
+                self.mask_files[slide_name] = filepath
+        return LazyLookup(self.mask_files, self.load_tissue_mask)
 
+    def load_tissue_mask(self, slide_name, filepath):
+        """Build the TissueMask of a slide.
+        """
+        return TissueMask(filepath, TISSUE_THRESHOLD, self.patch_size,
+                self.slide_dimensions.get_dimensions(slide_name))
 
     def load_slide_annotation_lookup(self):
-        """Load annotation TXT files from annotation_location and set up lookup table for slide region annotations from slide names.
+        """Locate annotation TXT files in annotation_location and set up lookup table for slide region annotations from slide names.
+
+        Annotations are only parsed when first accessed, so each worker process parses the annotations of the slides it extracts. Parsed annotations are cached in cache_location.
 
         Returns
         -------
-        dict of str: GroovyAnnotation
-            Lookup table for slide region annotations from slide names.
+        LazyLookup
+            Lookup table of GroovyAnnotation from slide names.
         """
         if self.should_use_manifest:
             if 'annotation_path' not in self.manifest:
                 raise ValueError("There is no column named annotation_path in the manifest file.")
-            generator = self.manifest['annotation_path']
+            """The annotation of a slide is in the row of the slide"""
+            files = self.manifest.get_column_files('annotation_path')
         elif self.should_use_directory:
-            generator = os.listdir(self.annotation_location)
+            files = {utils.path_to_filename(file): os.path.join(self.annotation_location, file)
+                    for file in os.listdir(self.annotation_location)}
         else:
             raise NotImplementedError()
 
-        slide_annotation = {}
-        for file in generator:
-            if file.endswith(".txt"):
-                slide_name = utils.path_to_filename(file)
-                if self.should_use_manifest:
-                    filepath = file
-                else:
-                    filepath = os.path.join(self.annotation_location, file)
-                slide_annotation[slide_name] = GroovyAnnotation(filepath, self.annotation_overlap,
-                                                                self.patch_size, self.is_TMA, logger)
-        return slide_annotation
+        self.annotation_files = {}
+        for slide_name, filepath in files.items():
+            if filepath.endswith(".txt"):
+                self.annotation_files[slide_name] = filepath
+        return LazyLookup(self.annotation_files, self.load_annotation)
+
+    def load_annotation(self, slide_name, filepath):
+        """Parse the GroovyAnnotation of a slide.
+        """
+        return load_annotation(filepath, self.annotation_overlap, self.patch_size,
+                self.is_TMA, logger, self.cache_location)
 
     def __init__(self, config):
         """
         TODO: fix import-annotations and export-annotations
         """
+        start_time = time.perf_counter()
         self.hd5_location = config.hd5_location
         self.seed = config.seed
         self.load_method = config.load_method
         self.store_thumbnail = config.store_thumbnail
+        self.shard_slides = config.shard_slides
+        self.resize_method = config.resize_method
+        self.luminance_stride = config.luminance_stride
+        self.block_size = config.block_size
+        self.tile_grid = config.tile_grid
+        self.start_method = config.start_method
+        self.patch_format = config.patch_format
+        self.png_compress_level = config.png_compress_level
+        self.jpeg_quality = config.jpeg_quality
+        self.webp_quality = config.webp_quality
+        self.encode_threads = config.encode_threads
+        self.pipeline = config.pipeline
+        self.read_queue_depth = config.read_queue_depth
+        self.write_queue_depth = config.write_queue_depth
+        self.resize_threads = config.resize_threads
+        self.resume = config.resume
+        if config.ledger_location:
+            self.ledger_location = config.ledger_location
+        else:
+            self.ledger_location = os.path.join(self.hd5_location, 'ledger.jsonl')
+        if config.cache_location:
+            self.cache_location = config.cache_location
+        else:
+            self.cache_location = os.path.join(self.hd5_location, 'cache')
         if self.should_use_manifest:
-            self.manifest = utils.read_manifest(config.manifest_location)
+            self.manifest = ManifestIndex.read(config.manifest_location)
             self.patch_location = config.patch_location
             self.slide_idx = config.slide_idx
             self.store_extracted_patches = config.store_extracted_patches
             self.slide_coords_location = config.slide_coords_location
             self.extract_method = config.extract_method
             self.slide_coords_location = config.slide_coords_location
+            self.store_extracted_patches_as_hd5 = False
+            self.store_extracted_patches_as_tar = False
         elif self.should_use_hd5_files:
             self.slide_location = config.slide_location
             self.slide_pattern = utils.create_patch_pattern(config.slide_pattern)
@@ -186,6 +283,13 @@ class AnnotatedPatchesExtractor(OutputMixin):
             self.slide_coords_location = config.slide_coords_location
             self.store_extracted_patches = config.store_extracted_patches
             self.store_extracted_patches_as_hd5 = config.store_extracted_patches_as_hd5
+            self.hd5_compression = config.hd5_compression
+            self.hd5_compression_level = config.hd5_compression_level
+            self.hd5_batch_size = config.hd5_batch_size
+            self.hd5_layout = config.hd5_layout
+            self.hd5_memmap = config.hd5_memmap
+            self.store_extracted_patches_as_tar = config.store_extracted_patches_as_tar
+            self.tar_shard_size = config.tar_shard_size
             self.mask_location = config.mask_location
         else:
             raise NotImplementedError(f"Load method {self.load_method} not implemented")
@@ -205,6 +309,11 @@ class AnnotatedPatchesExtractor(OutputMixin):
                 self.max_slide_patches = config.max_slide_patches
                 self.use_radius = config.use_radius
                 self.radius = config.radius
+                self.plan = config.plan
+                self.plan_downsample = config.plan_downsample
+                self.tissue_detection = config.tissue_detection
+                self.detection_downsample = config.detection_downsample
+                self.detection_threshold = config.detection_threshold
             elif self.should_use_entire_slide:
                 self.stride = config.stride
                 self.patch_size = config.patch_size
@@ -212,19 +321,39 @@ class AnnotatedPatchesExtractor(OutputMixin):
                 self.max_slide_patches = config.max_slide_patches
                 self.use_radius = config.use_radius
                 self.radius = config.radius
+                self.plan = config.plan
+                self.plan_downsample = config.plan_downsample
+                self.tissue_detection = config.tissue_detection
+                self.detection_downsample = config.detection_downsample
+                self.detection_threshold = config.detection_threshold
             elif self.should_use_mosaic:
                 self.stride = config.stride
                 self.patch_size = config.patch_size
                 self.evaluation_size = config.evaluation_size
+                self.evaluation_read = config.evaluation_read
+                self.clustering = config.clustering
+                self.mosaic_features = config.mosaic_features
+                self.clustering_batch_size = config.clustering_batch_size
                 self.resize_sizes = config.resize_sizes
                 self.n_clusters = config.n_clusters
                 self.percentage = config.percentage
                 self.use_radius = config.use_radius
                 self.radius = config.radius
+                self.plan = config.plan
+                self.plan_downsample = config.plan_downsample
+                self.tissue_detection = config.tissue_detection
+                self.detection_downsample = config.detection_downsample
+                self.detection_threshold = config.detection_threshold
             elif self.should_use_slide_coords:
                 self.slide_coords_metadata = SlideCoordsMetadata.load(self.slide_coords_location)
                 self.patch_size = self.slide_coords_metadata.patch_size
                 self.resize_sizes = self.slide_coords_metadata.resize_sizes
+                self.is_tumor = config.is_tumor
+                self.read_run_length = config.read_run_length
+                if not self.store_extracted_patches_as_hd5 \
+                        and not self.store_extracted_patches_as_tar:
+                    """Patches are saved as files unless another output is chosen"""
+                    self.store_extracted_patches = True
             else:
                 raise NotImplementedError(f"Extract method {self.extract_method} not implemented")
 
@@ -236,15 +365,57 @@ class AnnotatedPatchesExtractor(OutputMixin):
                 self.mask = self.load_slide_tissue_mask()
             else:
                 self.use_mask = False
+            """Tissue masks detected on thumbnails of the slides being extracted"""
+            self.detected_tissue = {}
 
             if not self.resize_sizes:
                 self.resize_sizes = [self.patch_size]
 
+            if self.should_plan:
+                """Planning only records coordinates, so no patches are stored"""
+                self.store_extracted_patches = False
+                self.store_extracted_patches_as_hd5 = False
+                self.store_extracted_patches_as_tar = False
+                if self.should_use_mosaic and self.evaluation_read == 'full':
+                    self.evaluation_read = 'level'
+
         self.slide_paths = self.get_slide_paths()
         if config.num_patch_workers:
             self.n_process = config.num_patch_workers
         else:
             self.n_process = psutil.cpu_count()
+        self.startup_time = time.perf_counter() - start_time
+
+    def get_slide_fingerprint(self, slide_path):
+        """Get the fingerprint of the parameters used to extract a slide, including the modification times of the slide, its annotation and its tissue mask.
+        """
+        slide_name = utils.path_to_filename(slide_path)
+        parameters = {name: getattr(self, name, None) for name in self.FINGERPRINT_ATTRIBUTES}
+        parameters['slide_mtime'] = file_mtime(slide_path)
+        if hasattr(self, 'annotation_files'):
+            parameters['annotation_mtime'] = file_mtime(self.annotation_files.get(slide_name))
+        if hasattr(self, 'mask_files') and slide_name in self.mask_files:
+            parameters['mask_mtime'] = file_mtime(self.mask_files[slide_name])
+        return make_fingerprint(parameters)
+
+    def get_slide_outputs(self, slide_name):
+        """Get the files that extracting a slide produces, used to check that a completed slide is still valid.
+        """
+        outputs = []
+        if self.should_use_annotation or self.should_plan:
+            """Slide coords are only merged into the slide coords file at the end of the run, so the slide coords file of each slide is checked"""
+            outputs.append(self.get_slide_coords_path(slide_name))
+        if self.should_plan:
+            outputs.append(self.get_plan_scores_path(slide_name))
+            return outputs
+        if self.should_use_annotation or self.should_use_entire_slide or self.should_use_mosaic \
+                or self.should_use_slide_coords:
+            outputs.append(os.path.join(self.hd5_location, f"{slide_name}.h5"))
+            if self.store_extracted_patches_as_hd5 and not self.store_extracted_patches:
+                outputs.append(os.path.join(self.patch_location, f"{slide_name}.h5"))
+            elif self.store_extracted_patches_as_tar and not self.store_extracted_patches:
+                outputs.append(os.path.join(self.patch_location, f"{slide_name}-index.jsonl"))
+        return outputs
 
     def print_parameters(self):
         """
@@ -259,82 +430,252 @@ class AnnotatedPatchesExtractor(OutputMixin):
             hd5_file_location = os.path.join(self.hd5_location, f"{slide_name}.h5")
             paths, patch_size = utils.open_hd5_file(hd5_file_location)
             os_slide = OpenSlide(slide_path)
-            counter = 0
+            resizer = PatchResizer(os_slide, patch_size, method=self.resize_method)
+            encoder = self.get_patch_encoder()
+            writer = PatchFileWriter(encoder, n_threads=self.encode_threads)
+            """Paths of the same coordinate are consecutive, so each patch is read once for all its sizes"""
+            coord_paths = {}
             for path in paths:
                 x, y = os.path.splitext(os.path.basename(path))[0].split('_')
                 resize_size = int(utils.get_patchsize_by_patch_path(path))
                 if self.resize is not None and resize_size not in self.resize:
                     continue
-                os.makedirs(os.path.dirname(path), exist_ok=True)
-                patch = preprocess.extract(os_slide, int(x), int(y), patch_size)
-                if counter >= self.max_num_patches: break
-                counter += 1
-                if patch_size==resize_size:
-                    patch.save(path)
-                else:
-                    resized_patch = preprocess.resize(patch, resize_size)
-                    resized_patch.save(path)
+                coord_paths.setdefault((int(x), int(y)), []).append((path, resize_size))
+            max_num_patches = self.max_num_patches if self.max_num_patches is not None \
+                    else float('inf')
+            counter = 0
+            for (x, y), size_paths in coord_paths.items():
+                if counter >= max_num_patches: break
+                if len(size_paths) > max_num_patches - counter:
+                    size_paths = size_paths[:int(max_num_patches - counter)]
+                counter += len(size_paths)
+                patch = preprocess.extract(os_slide, x, y, patch_size)
+                resized_patches = resizer.resize(patch, x, y,
+                        [resize_size for _, resize_size in size_paths])
+                for path, resize_size in size_paths:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer.save(resized_patches[resize_size], encoder.get_path(path))
+            writer.close()
+            logger.info(f"{slide_name}: {resizer.summary()}.")
             logger.info(f"{counter} patches are selected from {slide_name}.")
             if self.store_thumbnail:
                 PlotThumbnail(slide_name, os_slide, hd5_file_location, None)
         except Exception as e:
             logger.error(f"could not process f{hd5_file_location}\n{e}")
 
-    def extract_patch_by_slide_coords(self, slide_path, class_size_to_patch_path):
-        slide_name = utils.path_to_filename(slide_path)
-        os_slide = OpenSlide(slide_path)
+    def extract_patch_by_slide_coords(self, slide_path, class_size_to_patch_path,
+            slide_coords=None):
+        """Extract the patches of a slide at the coordinates of the slide in slide_coords_location.
 
-        for data in self.slide_coords_metadata.get_slide(slide_name):
-            label, coord = data
-            x, y = coord
+        Coordinates are sorted in tile order and adjacent coordinates of a row are read with one read_region call, then sliced into patches. Patches are stored with the same writers as the other extract methods, and their paths are saved to the HD5 file of the slide in hd5_location.
+
+        Parameters
+        ----------
+        slide_coords : CoordsMetadata
+            Coordinates of the slide, sent with the task instead of the whole SlideCoordsMetadata. If None, the coordinates are taken from slide_coords_metadata.
+        """
+        slide_name = utils.path_to_filename(slide_path)
+        if slide_coords is None:
+            slide_coords = self.slide_coords_metadata.get_slide(slide_name)
+        labels_by_coord = {}
+        for label, (x, y) in slide_coords:
             if self.is_tumor and label != BinaryEnum(1).name:
                 """Skip non-tumor patch if is_tumor is set.
                 """
                 continue
+            labels_by_coord.setdefault((int(x), int(y)), []).append(label)
 
-            patch = preprocess.extract(os_slide, x, y, self.patch_size)
-            save_location = os.path.join(patch_path, f"{x}_{y}.png")
-            for resize_size in self.resize_sizes:
-                patch_path = class_size_to_patch_path[label][resize_size]
-                if resize_size == self.patch_size:
-                    patch.save(save_location)
-                else:
-                    resized_patch = preprocess.resize(patch, resize_size)
-                    resized_patch.save(save_location)
+        os_slide = OpenSlide(slide_path)
+        resizer = PatchResizer(os_slide, self.patch_size, method=self.resize_method)
+        hd5_file_path = os.path.join(self.hd5_location, f"{slide_name}.h5")
+        writer = self.open_patch_writer(slide_name)
+        scorer = self.get_background_scorer()
+        paths = []
+        extracted = []
+        scores = []
+        if self.block_size > 1:
+            runs = group_blocks(labels_by_coord, self.patch_size, self.block_size)
+        else:
+            runs = group_row_runs(labels_by_coord, self.patch_size, self.read_run_length)
+        for run in runs:
+            region, origin = read_block(os_slide, run, self.patch_size)
+            """Patches are extracted whatever their score, which is only recorded"""
+            _, run_scores = scorer.score_region(region,
+                    np.array(run) - np.array(origin), self.patch_size)
+            for ((x, y), patch), score in zip(iter_block_patches(region, origin, run,
+                    self.patch_size), run_scores.tolist()):
+                patch = Image.fromarray(np.ascontiguousarray(patch))
+                resized_patches = resizer.resize(patch, x, y, self.resize_sizes)
+                for label in labels_by_coord[(x, y)]:
+                    extracted.append((label, x, y))
+                    scores.append(score)
+                    patch_paths = {resize_size: os.path.join(
+                            class_size_to_patch_path[label][resize_size],
+                            f"{x}_{y}.{self.patch_extension}") for resize_size in self.resize_sizes}
+                    paths.extend(patch_paths.values())
+                    self.store_patch(writer, label, resized_patches, x, y, patch_paths)
+        logger.info(f"{slide_name}: {len(labels_by_coord)} patches read with {len(runs)} "
+                f"read_region calls, resized {resizer.summary()}.")
+        self.save_patch_paths(hd5_file_path, paths, writer, extracted=extracted, scores=scores)
+        os_slide.close()
+
+    def build_tile_grid(self, os_slide, patch_overlap=0.0, shuffle=False, is_TMA=False):
+        """Build the tile grid of a slide. With tile_grid 'extractor' the grid has the tiles of SlideCoordsExtractor in its order and shuffle, with 'numpy' it is built in NumPy, see TileGrid.
+
+        Returns
+        -------
+        TileGrid
+            The grid.
+        """
+        build = TileGrid.from_extractor if self.tile_grid == 'extractor' else TileGrid.from_slide
+        return build(os_slide, self.patch_size, patch_overlap, stride=self.stride,
+                shuffle=shuffle, seed=self.seed, is_TMA=is_TMA, block_size=self.block_size)
 
-    def extract_(self, os_slide, slide_name, label, paths, x, y, class_size_to_patch_path,
-                 is_TMA=False, check_background=False):
+    def open_slide_reader(self, os_slide, is_TMA=False, step=None):
+        """Open the reader of a slide. When planning, patches are checked for background at a low resolution pyramid level and never read at full resolution. When block_size is more than 1 and the tiles are read block by block, patches are read from blocks of block_size x block_size tiles, except from TMAs.
+
+        Parameters
+        ----------
+        step : int
+            Distance in pixels between the top left corners of neighbouring tiles of the grid read block by block. If None, patches are read one at a time.
+
+        Returns
+        -------
+        SlideReader or BlockSlideReader or PlanningReader
+            Reader of the slide.
+        """
+        if self.should_plan:
+            return PlanningReader(os_slide, self.patch_size,
+                    downsample=self.plan_downsample, is_TMA=is_TMA,
+                    scorer=self.get_background_scorer())
+        if self.block_size > 1 and step is not None and not is_TMA:
+            return BlockSlideReader(os_slide, self.patch_size, self.block_size, step=step,
+                    resize_method=self.resize_method, scorer=self.get_background_scorer())
+        return SlideReader(os_slide, self.patch_size, is_TMA=is_TMA,
+                resize_method=self.resize_method, scorer=self.get_background_scorer())
+
+    def get_background_scorer(self):
+        return BackgroundScorer(stride=self.luminance_stride)
+
+    def open_patch_writer(self, slide_name):
+        """Open the writer storing patches of a slide in one file per patch if store_extracted_patches is set, in patch_location/<slide_name>.h5 if store_extracted_patches_as_hd5 is set, or in tar shards in patch_location if store_extracted_patches_as_tar is set.
+
+        Returns
+        -------
+        PatchFileWriter or HD5PatchWriter or HD5TensorWriter or TarShardWriter or None
+            Writer that should be closed once the slide is extracted. None if patches are not stored.
+        """
+        if self.store_extracted_patches:
+            return PatchFileWriter(self.get_patch_encoder(), n_threads=self.encode_threads)
+        if not self.store_extracted_patches_as_hd5:
+            if self.store_extracted_patches_as_tar:
+                return TarShardWriter(self.patch_location, slide_name, self.get_patch_encoder(),
+                        max_shard_size=self.tar_shard_size * 2**20)
+            return None
+        hd5_name = os.path.join(self.patch_location, f"{slide_name}.h5")
+        if self.hd5_layout == 'tensor':
+            return HD5TensorWriter(hd5_name, slide_name, compression=self.hd5_compression,
+                    compression_level=self.hd5_compression_level,
+                    batch_size=self.hd5_batch_size, memmap=self.hd5_memmap)
+        return HD5PatchWriter(hd5_name, compression=self.hd5_compression,
+                compression_level=self.hd5_compression_level,
+                batch_size=self.hd5_batch_size, mode='w')
+
+    def get_patch_encoder(self):
+        return PatchEncoder(self.patch_format, png_compress_level=self.png_compress_level,
+                jpeg_quality=self.jpeg_quality, webp_quality=self.webp_quality)
+
+    def save_patch_paths(self, hd5_file_path, paths, writer=None, extracted=None, scores=None):
+        """Close the patch writer of a slide and save the paths of its extracted patches into hd5_file_path.
+
+        When patches are stored with the tensor layout, the resize size and row of the patch of each path in the tensor file are saved with the paths. When the label, x, y of the extracted patches and their background scores are given, they are saved with the paths too. When planning, no paths are saved and the scores are saved in the scores directory next to the slide coords file instead.
+        """
+        if writer is not None:
+            writer.close()
+        if self.should_plan:
+            if extracted is not None and scores is not None:
+                scores_path = self.get_plan_scores_path(utils.path_to_filename(hd5_file_path))
+                os.makedirs(os.path.dirname(scores_path), exist_ok=True)
+                save_patch_scores(scores_path, extracted, scores)
+            return
+        utils.save_hdf5(hd5_file_path, paths, self.patch_size)
+        if isinstance(writer, HD5TensorWriter):
+            save_tensor_pointers(hd5_file_path, writer.hd5_path, writer.pointers)
+        if extracted is not None and scores is not None:
+            save_patch_scores(hd5_file_path, extracted, scores)
+
+    def get_slide_coords_path(self, slide_name):
+        """Get the path of the slide coords file of a slide, in a _slides directory next to the slide coords file. It is written as soon as the slide completes, so resumed runs can merge the coords of slides extracted by a run that was killed.
+        """
+        return os.path.join(f"{os.path.splitext(self.slide_coords_location)[0]}_slides",
+                f"{slide_name}.json")
+
+    def create_slide_coords(self, slide_coords_location):
+        """Create empty slide coords metadata saved to slide_coords_location.
+        """
+        resize_sizes = self.__resize_sizes if self.should_use_annotation else self.resize_sizes
+        return SlideCoordsMetadata(slide_coords_location,
+                patch_size=self.patch_size, resize_sizes=resize_sizes)
+
+    def get_plan_scores_path(self, slide_name):
+        """Get the path of the HDF5 file of the background scores of the planned patches of a slide, in a _scores directory next to the slide coords file.
+        """
+        return os.path.join(f"{os.path.splitext(self.slide_coords_location)[0]}_scores",
+                f"{slide_name}.h5")
+
+    def extract_(self, slide_reader, slide_name, label, paths, x, y, class_size_to_patch_path,
+                 check_background=False, writer=None):
         """ Had to ceate this function for radius patch extraction
+
+        slide_reader : SlideReader or PatchPipeline
+            Reader of the slide. A patch read with check_background is taken from its cache when it is extracted right after. A PatchPipeline resizes and stores the patch on its threads.
+
+        writer : PatchFileWriter or HD5PatchWriter or HD5TensorWriter or TarShardWriter
+            Writer opened by open_patch_writer to store patches. Required if store_extracted_patches is set.
         """
-        patch = preprocess.extract(os_slide, x, y, self.patch_size, is_TMA=is_TMA)
-        ndpatch = utils.image.preprocess.pillow_image_to_ndarray(patch)
-        check = utils.image.preprocess.check_luminance(ndpatch)
+        patch, check = slide_reader.read(x, y)
         if check_background:
             return check
         if check:
-            for resize_size in self.resize_sizes:
-                patch_path = os.path.join(class_size_to_patch_path[label][resize_size], f"{x}_{y}.png")
-                paths.append(patch_path)
-                # save as PNG
-                if self.store_extracted_patches:
-                    if resize_size == self.patch_size:
-                        patch.save(os.path.join(patch_path))
-                    else:
-                        resized_patch = preprocess.resize(patch, resize_size)
-                        resized_patch.save(os.path.join(patch_path))
-                # save as a HD5 whose name is same as the image
-                elif self.store_extracted_patches_as_hd5:
-                    hd5_name = os.path.join(self.patch_location, f"{slide_name}.h5")
-                    hf = h5py.File(hd5_name, 'a')
-                    patch_path = os.path.join(class_size_to_patch_path[label][resize_size], f"{x}_{y}.png")
-                    patch_path = patch_path[len(self.patch_location)+1:]
-                    if resize_size != self.patch_size:
-                        patch = preprocess.resize(patch, resize_size)
-                    hf.create_dataset(patch_path, data=patch, chunks=True,
-                                      compression="gzip", compression_opts=9)
-                    hf.close()
+            patch_paths = {resize_size: os.path.join(class_size_to_patch_path[label][resize_size],
+                    f"{x}_{y}.{self.patch_extension}") for resize_size in self.resize_sizes}
+            paths.extend(patch_paths.values())
+            """Patches are only resized when they are stored, with or without the pipeline"""
+            if self.store_extracted_patches or writer is not None:
+                if isinstance(slide_reader, PatchPipeline):
+                    slide_reader.submit(label, patch, x, y, patch_paths)
+                else:
+                    resized_patches = slide_reader.resizer.resize(patch, x, y, self.resize_sizes)
+                    self.store_patch(writer, label, resized_patches, x, y, patch_paths)
         return paths, check
 
+    def store_patch(self, writer, label, resized_patches, x, y, patch_paths):
+        """Store the resized patches of an extracted patch with writer.
+        """
+        for resize_size, patch_path in patch_paths.items():
+            # save as one file per patch
+            if self.store_extracted_patches:
+                writer.save(resized_patches[resize_size], patch_path)
+            # save into the HD5 or tar shards of the slide
+            elif writer is not None:
+                writer.add(label, resize_size, resized_patches[resize_size], x, y)
+
+    def open_pipeline(self, slide_reader, writer, coords):
+        """Open the pipeline reading the tiles of coords ahead and storing extracted patches on threads if pipeline is set.
+
+        Returns
+        -------
+        PatchPipeline or None
+            Pipeline that should be closed once the slide is extracted. None if the pipeline is not used, or when planning since no patches are read or stored.
+        """
+        if not self.pipeline or self.should_plan:
+            return None
+        pipeline = PatchPipeline(slide_reader, functools.partial(self.store_patch, writer),
+                self.resize_sizes, read_queue_depth=self.read_queue_depth,
+                write_queue_depth=self.write_queue_depth, resize_threads=self.resize_threads)
+        pipeline.start(coords)
+        return pipeline
+
     def check_label(self, slide_name, x, y):
         label = self.slide_annotation[slide_name].points_to_label(
                 np.array([[x, y],
@@ -351,7 +692,38 @@ class AnnotatedPatchesExtractor(OutputMixin):
             return label, False
         return label, True
 
+    def has_tissue_mask(self, slide_name):
+        """Check whether tiles of a slide are checked for tissue, by its tissue mask or the tissue detected on its thumbnail.
+        """
+        return (self.use_mask and slide_name in self.mask) or slide_name in self.detected_tissue
+
+    def detect_slide_tissue(self, slide_name, os_slide):
+        """Detect the tissue of a slide without a tissue mask on its thumbnail, so background tiles are skipped before they are read at full resolution.
+        """
+        if self.tissue_detection == 'none' or (self.use_mask and slide_name in self.mask):
+            return
+        self.detected_tissue[slide_name] = DetectedTissueMask.detect(os_slide,
+                method=self.tissue_detection, downsample=self.detection_downsample,
+                threshold=self.detection_threshold)
+
+    def report_slide_tissue(self, slide_name, slide_reader):
+        """Log the number of tiles skipped by the tissue detected on the thumbnail of a slide and forget the detected tissue.
+
+        The time saved is estimated from the mean time slide_reader took to read a tile.
+        """
+        detected_tissue = self.detected_tissue.pop(slide_name, None)
+        if detected_tissue is None:
+            return
+        if slide_reader.read_count > 0:
+            seconds_per_read = slide_reader.read_time / slide_reader.read_count
+        else:
+            seconds_per_read = None
+        logger.info(f"{slide_name}: {detected_tissue.summary(seconds_per_read)}.")
+
     def check_tissue(self, slide_name, x, y):
+        if slide_name in self.detected_tissue:
+            return bool(self.detected_tissue[slide_name].tiles_to_tissue(
+                    [(x, y)], self.patch_size)[0])
         label = self.mask[slide_name].points_to_label(
                 np.array([[x, y],
                     [x, y+self.patch_size],
@@ -361,8 +733,339 @@ class AnnotatedPatchesExtractor(OutputMixin):
             return False
         return True
 
+    def check_label_batch(self, slide_name, coords):
+        """Vectorized check_label for all tiles of a slide.
+
+        Falls back to calling check_label for each tile when the annotation overlap is below 1.0 or the slide is a TMA.
+
+        Parameters
+        ----------
+        slide_name : str
+            Name of slide.
+
+        coords : np.ndarray
+            Array of shape (N, 2) of the x, y coordinates of top left corner of each tile.
+
+        Returns
+        -------
+        list of list of str
+            The labels of each tile.
+
+        np.ndarray
+            Boolean array of shape (N,) of whether each tile should be extracted.
+        """
+        if self.annotation_overlap < 1.0 or self.is_TMA:
+            results = [self.check_label(slide_name, x, y) for x, y in coords]
+            labels = [label for label, _ in results]
+            is_label = np.array([is_label for _, is_label in results], dtype=bool)
+            return labels, is_label
+        labels = annotation_to_labels(self.slide_annotation[slide_name],
+                coords, self.patch_size)
+        if self.is_tumor:
+            is_label = np.array([BinaryEnum(1).name in label for label in labels], dtype=bool)
+        else:
+            is_label = np.array([len(label) > 0 for label in labels], dtype=bool)
+        return labels, is_label
+
+    def check_tissue_batch(self, slide_name, coords):
+        """Vectorized check_tissue for all tiles of a slide.
+
+        PNG masks are rasterized once into a RasterTissueMask, which is cached in cache_location. Other masks fall back to calling check_tissue for each tile. Slides without a mask use the tissue detected on their thumbnail, if any.
+
+        Parameters
+        ----------
+        slide_name : str
+            Name of slide.
+
+        coords : np.ndarray
+            Array of shape (N, 2) of the x, y coordinates of top left corner of each tile.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of shape (N,) of whether each tile contains tissue.
+        """
+        if slide_name in self.detected_tissue:
+            return self.detected_tissue[slide_name].tiles_to_tissue(coords, self.patch_size)
+        filepath = self.mask_files[slide_name]
+        if filepath.endswith(".png"):
+            raster_mask = load_raster_tissue_mask(filepath,
+                    self.slide_dimensions.get_dimensions(slide_name), self.cache_location)
+            return raster_mask.tiles_to_tissue(coords, self.patch_size)
+        return np.array([self.check_tissue(slide_name, x, y) for x, y in coords], dtype=bool)
+
+    def filter_grid(self, slide_name, grid, use_label=False):
+        """Filter the tile grid of a slide by tissue mask and annotation at once.
+
+        Parameters
+        ----------
+        slide_name : str
+            Name of slide.
+
+        grid : TileGrid
+            Tile grid of the slide.
+
+        use_label : bool
+            Whether to keep only tiles that pass check_label.
+
+        Returns
+        -------
+        TileGrid
+            The tiles that survive the filter, in the order of grid.
+
+        list
+            The labels of the surviving tiles if use_label is set, otherwise a list of None.
+        """
+        if self.has_tissue_mask(slide_name):
+            is_tissue = self.check_tissue_batch(slide_name, grid.coords)
+            if slide_name in self.detected_tissue:
+                self.detected_tissue[slide_name].count_grid(is_tissue)
+            grid = grid.select(is_tissue)
+        if not use_label:
+            return grid, [None] * len(grid)
+        labels, is_label = self.check_label_batch(slide_name, grid.coords)
+        labels = [label for label, keep in zip(labels, is_label) if keep]
+        return grid.select(is_label), labels
+
+    def expand_seeds(self, slide_name, seeds, slide_size, stride, use_label=False):
+        """Get the patches to extract around seed tiles that passed filter_grid and the background check.
+
+        When use_radius is set, the unique neighbours of all seeds are found at once by expand_radius, then checked for tissue and labelled at once. Each neighbour is extracted with the first seed reaching it, which gives the same patches in the same order as extracting the whole neighbourhood of each seed in turn.
+
+        Parameters
+        ----------
+        slide_name : str
+            Name of slide.
+
+        seeds : list of tuple
+            The (x, y) coordinate and list of labels of each seed tile in order.
+
+        slide_size : tuple of int
+            Width and height of the slide.
+
+        stride : int
+            Stride in pixels between neighbours when use_radius is set.
+
+        use_label : bool
+            Whether neighbours are labelled by check_label. Otherwise they take the labels of the first seed reaching them.
+
+        Returns
+        -------
+        list of list of tuple
+            The label, x, y of each patch to extract for each seed, in order.
+        """
+        if not self.use_radius:
+            return [[(label, x, y) for label in labels] for (x, y), labels in seeds]
+        coords, seed_index = expand_radius([coord for coord, _ in seeds], self.radius, stride,
+                slide_size, self.patch_size)
+        if self.has_tissue_mask(slide_name):
+            is_tissue = self.check_tissue_batch(slide_name, coords)
+            coords, seed_index = coords[is_tissue], seed_index[is_tissue]
+        if use_label:
+            labels, is_label = self.check_label_batch(slide_name, coords)
+        else:
+            labels = [seeds[idx][1] for idx in seed_index.tolist()]
+            is_label = np.ones(len(coords), dtype=bool)
+        candidates = [[] for _ in seeds]
+        for (x, y), idx, labels_, keep in zip(coords.tolist(), seed_index.tolist(),
+                labels, is_label):
+            if keep:
+                candidates[idx].extend((label, x, y) for label in labels_)
+        return candidates
+
+    def extract_seeds(self, slide_reader, slide_name, seeds, slide_size, stride,
+            class_size_to_patch_path, writer=None, use_label=False):
+        """Extract the patches of seed tiles and their neighbours one after the other.
+
+        When use_radius is set, seeds are checked for background in rounds, and the neighbours of the seeds of a round that are not background are found at once by expand_seeds. Otherwise each seed is extracted right after it is checked, so it is read once.
+
+        Parameters
+        ----------
+        slide_reader : SlideReader
+            Reader of the slide. If pipeline is set, tiles of seeds are read ahead and patches are stored on the threads of a PatchPipeline.
+
+        seeds : list of tuple
+            The (x, y) coordinate and list of labels of each seed tile in order.
+
+        Returns
+        -------
+        list of tuple
+            The label, x, y of each extracted patch in order.
+
+        list of str
+            Paths of extracted patches.
+
+        list of float
+            Background score of each extracted patch in order.
+        """
+        extracted_coordinates = CoordinateIndex(slide_size, stride)
+        extracted = []
+        paths = []
+        scores = []
+        pipeline = self.open_pipeline(slide_reader, writer, [coord for coord, _ in seeds])
+        reader = slide_reader if pipeline is None else pipeline
+        try:
+            start = 0
+            while start < len(seeds):
+                if self.max_slide_patches is not None and len(extracted) >= self.max_slide_patches:
+                    """Stop extracting patches once we have reach the max number of them for this slide.
+                    """
+                    break
+                if not self.use_radius:
+                    round_size = 1
+                elif self.max_slide_patches is None:
+                    round_size = len(seeds)
+                else:
+                    """Fewest seeds whose neighbourhoods could hold the remaining patches"""
+                    round_size = -(-(self.max_slide_patches - len(extracted))
+                            // len(get_disk_offsets(self.radius)))
+                round_seeds = seeds[start:start + round_size]
+                start += round_size
+                # check main image; if it is background, skip it
+                round_seeds = [((x, y), labels) for (x, y), labels in round_seeds
+                        if self.extract_(reader, slide_name, labels, paths, x, y,
+                                class_size_to_patch_path, check_background=True)]
+                for candidates in self.expand_seeds(slide_name, round_seeds, slide_size, stride,
+                        use_label=use_label):
+                    if self.max_slide_patches is not None and len(extracted) >= self.max_slide_patches:
+                        break
+                    for label, x_, y_ in candidates:
+                        if extracted_coordinates.contains(label, x_, y_): # it has been previously extracted (usefull for radius)
+                            continue
+                        paths, check = self.extract_(reader, slide_name, label, paths, x_, y_,
+                                                     class_size_to_patch_path, writer=writer)
+                        if check:
+                            extracted_coordinates.add(label, x_, y_)
+                            extracted.append((label, x_, y_))
+                            scores.append(slide_reader.scores[(x_, y_)])
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+        if pipeline is not None:
+            logger.info(f"{slide_name}: {pipeline.summary()}.")
+        return extracted, paths, scores
+
+    def check_background_shard(self, slide_path, coords):
+        """Check whether patches of a shard are background. Runs in a ShardPool worker.
+
+        Returns
+        -------
+        list of bool
+            Whether each patch passes the luminance check.
+        """
+        os_slide = OpenSlide(slide_path)
+        slide_reader = self.open_slide_reader(os_slide)
+        checks = [slide_reader.read(x, y)[1] for x, y in coords]
+        os_slide.close()
+        return checks
+
+    def extract_shard(self, slide_path, attempts, slide_name, class_size_to_patch_path):
+        """Extract the patches of a shard. Runs in a ShardPool worker.
+
+        Patches stored as HDF5 or tar shards are sent back to the parent, which owns the files of the slide.
+
+        Returns
+        -------
+        list of tuple
+            For each label, x, y in attempts, whether the patch was extracted, its paths, the arguments of HD5PatchWriter.add for it and its background score.
+        """
+        os_slide = OpenSlide(slide_path)
+        slide_reader = self.open_slide_reader(os_slide)
+        if self.store_extracted_patches:
+            """Patch files are independent, so shards write them directly"""
+            writer, collector = self.open_patch_writer(slide_name), None
+        elif self.store_extracted_patches_as_hd5 or self.store_extracted_patches_as_tar:
+            writer = collector = PatchCollector()
+        else:
+            writer = collector = None
+        results = []
+        for label, x, y in attempts:
+            paths, check = self.extract_(slide_reader, slide_name, label, [], x, y,
+                                         class_size_to_patch_path, writer=writer)
+            results.append((check, paths, collector.pop() if collector else [],
+                    slide_reader.scores[(x, y)]))
+        if writer is not None and collector is None:
+            writer.close()
+        os_slide.close()
+        return results
+
+    def update_background_checks(self, shard_pool, slide_path, coords, checks):
+        """Check the coordinates not yet in checks for background using shard_pool.
+        """
+        unknown = list(dict.fromkeys(coord for coord in coords if coord not in checks))
+        if unknown:
+            results = shard_pool.map_shards('check_background_shard', slide_path, unknown, unknown)
+            checks.update(zip(unknown, results))
+
+    def extract_seeds_by_shards(self, shard_pool, slide_path, slide_name, seeds, slide_size,
+            stride, class_size_to_patch_path, writer=None, use_label=False):
+        """Extract the same patches as extract_seeds, with reads split over the spatial shards of shard_pool.
+
+        If max_slide_patches or use_radius is set, which patches are extracted depends on the background of earlier seeds. Seeds are then checked for background by the shards in rounds, the selection is replayed in seed order, and the selected patches are read again to be saved. Otherwise every seed is extracted directly. Either way the result does not depend on the number of shards.
+
+        Returns
+        -------
+        list of tuple
+            The label, x, y of each extracted patch in order.
+
+        list of str
+            Paths of extracted patches.
+
+        list of float
+            Background score of each extracted patch in order.
+        """
+        if self.max_slide_patches is None and not self.use_radius:
+            attempts = [(label, x, y) for (x, y), labels in seeds for label in labels]
+        else:
+            checks = {}
+            attempts = []
+            extracted_coordinates = CoordinateIndex(slide_size, stride)
+            start = 0
+            while start < len(seeds):
+                if self.max_slide_patches is None:
+                    round_size = len(seeds)
+                else:
+                    remaining = self.max_slide_patches - len(attempts)
+                    if remaining <= 0:
+                        break
+                    round_size = max(2 * remaining, 16 * shard_pool.n_process)
+                round_seeds = seeds[start:start + round_size]
+                start += round_size
+                self.update_background_checks(shard_pool, slide_path,
+                        [coord for coord, _ in round_seeds], checks)
+                round_seeds = [(coord, labels) for coord, labels in round_seeds if checks[coord]]
+                round_candidates = self.expand_seeds(slide_name, round_seeds, slide_size, stride,
+                        use_label=use_label)
+                self.update_background_checks(shard_pool, slide_path,
+                        [(x_, y_) for candidates in round_candidates for _, x_, y_ in candidates],
+                        checks)
+                for candidates in round_candidates:
+                    if self.max_slide_patches is not None and len(attempts) >= self.max_slide_patches:
+                        break
+                    for label, x_, y_ in candidates:
+                        if extracted_coordinates.contains(label, x_, y_) or not checks[(x_, y_)]:
+                            continue
+                        extracted_coordinates.add(label, x_, y_)
+                        attempts.append((label, x_, y_))
+        results = shard_pool.map_shards('extract_shard', slide_path, attempts,
+                [(x, y) for _, x, y in attempts], slide_name, class_size_to_patch_path)
+        extracted = []
+        paths = []
+        scores = []
+        for attempt, (check, paths_, patches, score) in zip(attempts, results):
+            if not check:
+                continue
+            extracted.append(attempt)
+            paths.extend(paths_)
+            scores.append(score)
+            if writer is not None:
+                for patch_args in patches:
+                    writer.add(*patch_args)
+        logger.info(f"{slide_name}: extracted {len(extracted)} patches over {shard_pool.n_process} shard workers.")
+        return extracted, paths, scores
+
     def extract_patch_by_annotation(self, slide_path,
-            class_size_to_patch_path, send_end):
+            class_size_to_patch_path, send_end=None, shard_pool=None):
         """Extracts patches using the steps:
          1. Moves a sliding, non-overlaping window to extract each patch to Pillow patch.
          2. Converts patch to ndarray ndpatch and skips to next patch if background
@@ -376,7 +1079,15 @@ class AnnotatedPatchesExtractor(OutputMixin):
             To get the patch path a store evaluated patch using evaluated label name and patch size as keys
 
         send_end : multiprocessing.connection.Connection
-            Connection to send recorded coords metadata of a slide to parent.
+            Optional connection to send recorded coords metadata of a slide to parent.
+
+        shard_pool : ShardPool
+            Optional pool of worker processes to split the tile grid of the slide into spatial shards.
+
+        Returns
+        -------
+        CoordsMetadata
+            Recorded coords metadata of the slide.
         """
         slide_name = utils.path_to_filename(slide_path)
         if not self.is_TMA:
@@ -385,65 +1096,41 @@ class AnnotatedPatchesExtractor(OutputMixin):
             os_slide = Image.open(slide_path).convert('RGB')
             os_slide = preprocess.expand(os_slide, self.patch_size, self.annotation_overlap)
         coords = CoordsMetadata(slide_name, patch_size=self.patch_size)
-        num_extracted = 0
-        extracted_coordinates = defaultdict(list)
-        paths = []
         hd5_file_path = os.path.join(self.hd5_location, f"{slide_name}.h5")
+        writer = self.open_patch_writer(slide_name)
         shuffle_coordinate = True if self.max_slide_patches is not None else False
-        for data in SlideCoordsExtractor(os_slide, self.patch_size, self.patch_overlap,
-                                         shuffle=shuffle_coordinate, seed=self.seed,
-                                         is_TMA=self.is_TMA, stride=self.stride):
-            if self.max_slide_patches is not None and num_extracted >= self.max_slide_patches:
-                """Stop extracting patches once we have reach the max number of them for this slide.
-                """
-                break
-            tile_x, tile_y, x, y = data
-            if self.use_mask and slide_name in self.mask:
-                check_tissue = self.check_tissue(slide_name, x, y)
-                if not check_tissue:
-                    continue
-            label, is_label = self.check_label(slide_name, x, y)
-            if not is_label:
-                continue
-
-            if self.use_radius:
-                stride = int((1-self.patch_overlap)*self.patch_size)
-                size   = os_slide.dimensions if not self.is_TMA else os_slide.size
-                Coords = utils.get_circular_coordinates(self.radius, x, y, stride,
-                                            size, self.patch_size)
-            else:
-                Coords = [(x, y)]
-            # check main image; if it is background, skip it
-            check = self.extract_(os_slide, slide_name, label, paths, x, y, class_size_to_patch_path,
-                                  is_TMA=self.is_TMA, check_background=True)
-            if not check:
-                continue
-            for coord in Coords:
-                x_, y_ = coord
-                if self.use_mask and slide_name in self.mask:
-                    check_tissue = self.check_tissue(slide_name, x_, y_)
-                    if not check_tissue:
-                        continue
-                labels, is_label = self.check_label(slide_name, x_, y_)
-                if not is_label:
-                    continue
-                for label in labels:
-                    if (x_, y_) in extracted_coordinates[label]: # it has been previously extracted (usefull for radius)
-                        continue
-                    paths, check = self.extract_(os_slide, slide_name, label, paths, x_, y_,
-                                                 class_size_to_patch_path, is_TMA=self.is_TMA)
-                    if check:
-                        num_extracted += 1
-                        extracted_coordinates[label].append((x_, y_))
-                        coords.add_coord(label, x_, y_)
-        utils.save_hdf5(hd5_file_path, paths, self.patch_size)
-        if self.store_thumbnail:
+        if not self.is_TMA:
+            self.detect_slide_tissue(slide_name, os_slide)
+        grid = self.build_tile_grid(os_slide, self.patch_overlap, shuffle=shuffle_coordinate,
+                is_TMA=self.is_TMA)
+        slide_reader = self.open_slide_reader(os_slide, is_TMA=self.is_TMA,
+                step=None if shuffle_coordinate else grid.step)
+        seed_grid, seed_labels = self.filter_grid(slide_name, grid, use_label=True)
+        seeds = list(zip(map(tuple, seed_grid.coords.tolist()), seed_labels))
+        stride = int((1-self.patch_overlap)*self.patch_size)
+        slide_size = os_slide.dimensions if not self.is_TMA else os_slide.size
+        if shard_pool is not None and not self.is_TMA:
+            extracted, paths, scores = self.extract_seeds_by_shards(shard_pool, slide_path, slide_name,
+                    seeds, slide_size, stride, class_size_to_patch_path,
+                    writer=writer, use_label=True)
+        else:
+            extracted, paths, scores = self.extract_seeds(slide_reader, slide_name, seeds,
+                    slide_size, stride, class_size_to_patch_path,
+                    writer=writer, use_label=True)
+            logger.info(f"{slide_name}: {slide_reader.summary()}.")
+        self.report_slide_tissue(slide_name, slide_reader)
+        for label, x, y in extracted:
+            coords.add_coord(label, x, y)
+        self.save_patch_paths(hd5_file_path, paths, writer, extracted=extracted, scores=scores)
+        if self.store_thumbnail and not self.should_plan:
             mask = self.mask[slide_name] if self.use_mask and slide_name in self.mask else None
             PlotThumbnail(slide_name, os_slide, hd5_file_path, self.slide_annotation[slide_name], mask=mask)
-        send_end.send(coords)
+        if send_end is not None:
+            send_end.send(coords)
+        return coords
 
     def extract_patch_by_entire_slide(self, slide_path,
-            class_size_to_patch_path, send_end):
+            class_size_to_patch_path, send_end=None, shard_pool=None):
         """Extracts patches using the steps:
          1. Moves a sliding, non-overlaping window to extract each patch to Pillow patch.
          2. Converts patch to ndarray ndpatch and skips to next patch if background
@@ -457,63 +1144,118 @@ class AnnotatedPatchesExtractor(OutputMixin):
             To get the patch path a store evaluated patch using evaluated label name and patch size as keys
 
         send_end : multiprocessing.connection.Connection
-            Connection to send recorded coords metadata of a slide to parent.
+            Optional connection to send recorded coords metadata of a slide to parent.
+
+        shard_pool : ShardPool
+            Optional pool of worker processes to split the tile grid of the slide into spatial shards.
+
+        Returns
+        -------
+        CoordsMetadata
+            Recorded coords metadata of the slide.
         """
         slide_name = utils.path_to_filename(slide_path)
         os_slide = OpenSlide(slide_path)
         coords = CoordsMetadata(slide_name, patch_size=self.patch_size)
-        num_extracted = 0
-        extracted_coordinates = defaultdict(list)
-        paths = []
         label = 'Mix'
         hd5_file_path = os.path.join(self.hd5_location, f"{slide_name}.h5")
+        writer = self.open_patch_writer(slide_name)
         shuffle_coordinate = True if self.max_slide_patches is not None else False
-        for data in SlideCoordsExtractor(os_slide, self.patch_size, patch_overlap=0.0,
-                                         shuffle=shuffle_coordinate, seed=self.seed,
-                                         is_TMA=False, stride=self.stride):
-            if self.max_slide_patches is not None and num_extracted >= self.max_slide_patches:
-                """Stop extracting patches once we have reach the max number of them for this slide.
-                """
-                break
-            tile_x, tile_y, x, y = data
-            if self.use_mask and slide_name in self.mask:
-                check_tissue = self.check_tissue(slide_name, x, y)
-                if not check_tissue:
-                    continue
-            if self.use_radius:
-                # stride = int((1-self.patch_overlap)*self.patch_size)
-                stride = self.patch_size
-                Coords = utils.get_circular_coordinates(self.radius, x, y, stride,
-                                            os_slide.dimensions, self.patch_size)
-            else:
-                Coords = [(x, y)]
-            # check main image; if it is background, skip it
-            check = self.extract_(os_slide, slide_name, label, paths, x, y, class_size_to_patch_path,
-                                  check_background=True)
-            if not check:
-                continue
-            for coord in Coords:
-                x_, y_ = coord
-                if self.use_mask and slide_name in self.mask:
-                    check_tissue = self.check_tissue(slide_name, x_, y_)
-                    if not check_tissue:
-                        continue
-                if (x_, y_) in extracted_coordinates[label]: # it has been previously extracted (usefull for radius)
-                    continue
-                paths, check = self.extract_(os_slide, slide_name, label, paths, x_, y_,
-                                             class_size_to_patch_path)
-                if check:
-                    num_extracted += 1
-                    extracted_coordinates[label].append((x_, y_))
-                    coords.add_coord(label, x_, y_)
-        utils.save_hdf5(hd5_file_path, paths, self.patch_size)
-        if self.store_thumbnail:
+        self.detect_slide_tissue(slide_name, os_slide)
+        grid = self.build_tile_grid(os_slide, shuffle=shuffle_coordinate)
+        slide_reader = self.open_slide_reader(os_slide,
+                step=None if shuffle_coordinate else grid.step)
+        seed_grid, _ = self.filter_grid(slide_name, grid)
+        seeds = [(coord, [label]) for coord in map(tuple, seed_grid.coords.tolist())]
+        # stride = int((1-self.patch_overlap)*self.patch_size)
+        stride = self.patch_size
+        if shard_pool is not None:
+            extracted, paths, scores = self.extract_seeds_by_shards(shard_pool, slide_path, slide_name,
+                    seeds, os_slide.dimensions, stride, class_size_to_patch_path, writer=writer)
+        else:
+            extracted, paths, scores = self.extract_seeds(slide_reader, slide_name, seeds,
+                    os_slide.dimensions, stride, class_size_to_patch_path, writer=writer)
+            logger.info(f"{slide_name}: {slide_reader.summary()}.")
+        self.report_slide_tissue(slide_name, slide_reader)
+        for label, x, y in extracted:
+            coords.add_coord(label, x, y)
+        self.save_patch_paths(hd5_file_path, paths, writer, extracted=extracted, scores=scores)
+        if self.store_thumbnail and not self.should_plan:
             mask = self.mask[slide_name] if self.use_mask and slide_name in self.mask else None
             PlotThumbnail(slide_name, os_slide, hd5_file_path, None, mask=mask)
-        send_end.send(coords)
+        if send_end is not None:
+            send_end.send(coords)
+        return coords
+
+    def iter_evaluation_tiles(self, os_slide, slide_reader, tile_coords, chunk_size=1024):
+        """Get the evaluation tiles of the tissue tiles for use-mosaic, in chunks.
+
+        How evaluation tiles are read depends on evaluation_read:
+         - full: read each tile at level 0 and resize it to evaluation_size.
+         - level: read each tile from the closest pyramid level and resize it to evaluation_size.
+         - grid: read the whole slide once downsampled to evaluation_size per tile and cut it into tiles.
+        With level and grid, the luminance check is done on the evaluation tile and only the patches selected by the clustering are read at level 0.
+
+        Parameters
+        ----------
+        os_slide : OpenSlide
+            Slide to read from.
+
+        slide_reader : SlideReader
+            Reader of the slide at level 0.
+
+        tile_coords : np.ndarray
+            Array of shape (N, 2) of the x, y coordinates of the tiles.
+
+        chunk_size : int
+            Number of tiles evaluated per chunk.
+
+        Yields
+        ------
+        np.ndarray
+            Array of shape (M, evaluation_size, evaluation_size, 3) of evaluation tiles that are not background.
+
+        np.ndarray
+            Array of shape (M, 2) of the coordinates of these tiles.
+        """
+        downsample = self.patch_size / self.evaluation_size
+        scorer = self.get_background_scorer()
+        if self.evaluation_read == 'level':
+            level, _ = get_evaluation_level(os_slide, downsample)
+        elif self.evaluation_read == 'grid':
+            image = read_downsampled_slide(os_slide, downsample)
+        elif self.evaluation_read != 'full':
+            raise NotImplementedError(f"Evaluation read {self.evaluation_read} not implemented")
+        for start in range(0, len(tile_coords), chunk_size):
+            chunk_coords = tile_coords[start:start + chunk_size]
+            if self.evaluation_read == 'grid':
+                eval_patches = cut_tiles(image, chunk_coords, downsample, self.evaluation_size)
+                checks, _ = scorer.score(eval_patches)
+                eval_patches = eval_patches[checks]
+            else:
+                checks = np.zeros(len(chunk_coords), dtype=bool)
+                eval_patches = []
+                for i, (x, y) in enumerate(chunk_coords.tolist()):
+                    if self.evaluation_read == 'full':
+                        patch, check = slide_reader.read(x, y)
+                        if check:
+                            eval_patch = preprocess.resize(patch, self.evaluation_size)
+                    else:
+                        eval_patch = read_evaluation_tile(os_slide, x, y, self.patch_size,
+                                self.evaluation_size, level)
+                        check = bool(scorer.score(
+                                utils.image.preprocess.pillow_image_to_ndarray(eval_patch))[0][0])
+                    if check:
+                        checks[i] = True
+                        eval_patches.append(np.asarray(eval_patch.convert('RGB')))
+                if not eval_patches:
+                    continue
+                eval_patches = np.stack(eval_patches)
+            if checks.any():
+                yield eval_patches, chunk_coords[checks]
 
     def extract_patch_by_mosaic(self, slide_path,
-            class_size_to_patch_path, send_end):
+            class_size_to_patch_path, send_end=None):
         """Extracts patches using the steps:
          1. Moves a sliding, non-overlaping window to extract each patch to Pillow patch.
          2. Converts patch to ndarray ndpatch and skips to next patch if background
@@ -527,88 +1269,103 @@ class AnnotatedPatchesExtractor(OutputMixin):
             To get the patch path a store evaluated patch using evaluated label name and patch size as keys
 
         send_end : multiprocessing.connection.Connection
-            Connection to send recorded coords metadata of a slide to parent.
+            Optional connection to send recorded coords metadata of a slide to parent.
+
+        Returns
+        -------
+        CoordsMetadata
+            Recorded coords metadata of the slide.
         """
         slide_name = utils.path_to_filename(slide_path)
         os_slide = OpenSlide(slide_path)
         coords = CoordsMetadata(slide_name, patch_size=self.patch_size)
-        dict_hist_coord = {'hist': [], 'coords': []}
         dict_num_patch = {'total': 0, 'tissue': 0, 'selected': 0, 'radius': 0}
         label = "Mosaic"
-        extracted_coordinates = defaultdict(list)
+        """Seeds are on the grid of patch_size + stride and neighbours on the grid of patch_size"""
+        extracted_coordinates = CoordinateIndex(os_slide.dimensions,
+                math.gcd(self.patch_size, self.patch_size + self.stride))
         hd5_file_path = os.path.join(self.hd5_location, f"{slide_name}.h5")
-        for data in SlideCoordsExtractor(os_slide, self.patch_size, patch_overlap=0.0,
-                                         shuffle=False, seed=self.seed,
-                                         is_TMA=False, stride=self.stride):
-
-            tile_x, tile_y, x, y = data
-            if self.use_mask and slide_name in self.mask:
-                check_tissue = self.check_tissue(slide_name, x, y)
-                if not check_tissue:
-                    continue
-            dict_num_patch['total'] += 1
-            patch = preprocess.extract(os_slide, x, y, self.patch_size)
-            ndpatch = utils.image.preprocess.pillow_image_to_ndarray(patch)
-            check = utils.image.preprocess.check_luminance(ndpatch)
-            if check:
-                dict_num_patch['tissue'] += 1
-                eval_patch = preprocess.resize(patch, self.evaluation_size)
-                # Get the color histogram of the image
-                hist = np.array(eval_patch.histogram())
-                dict_hist_coord['hist'].append(hist)
-                dict_hist_coord['coords'].append(np.array([x, y]))
-        kmeans = KMeans(n_clusters=self.n_clusters, random_state=0)
-        if self.n_clusters > len(dict_hist_coord['hist']):
+        writer = self.open_patch_writer(slide_name)
+        self.detect_slide_tissue(slide_name, os_slide)
+        grid = self.build_tile_grid(os_slide)
+        slide_reader = self.open_slide_reader(os_slide, step=grid.step)
+        tile_grid, _ = self.filter_grid(slide_name, grid)
+        tile_coords = tile_grid.coords
+        dict_num_patch['total'] = len(tile_coords)
+        clustering = MosaicClustering(len(tile_coords), self.n_clusters, self.percentage,
+                clustering=self.clustering, features=self.mosaic_features,
+                batch_size=self.clustering_batch_size)
+        for eval_patches, chunk_coords in self.iter_evaluation_tiles(os_slide,
+                slide_reader, tile_coords):
+            clustering.add(eval_patches, chunk_coords)
+        dict_num_patch['tissue'] = clustering.n_tissue
+        if self.n_clusters > clustering.n_tissue:
             logger.info(f"No patches can be selected from {slide_name}.")
-            send_end.send(None)
-            return
-        clusters = kmeans.fit_predict(dict_hist_coord['hist'])
-        # Another Kmeans on location
+            self.report_slide_tissue(slide_name, slide_reader)
+            if writer is not None:
+                writer.close()
+            if send_end is not None:
+                send_end.send(None)
+            return None
         paths = []
-        for n_cluster in range(self.n_clusters):
-            idx = np.where(clusters==n_cluster)[0]
-            if len(idx)==0: continue
-            selected_coords = np.array(dict_hist_coord['coords'])[idx]
-            n_clusters = math.ceil(len(idx) * self.percentage)
-            if n_clusters > len(idx): continue
-            kmeans_ = KMeans(n_clusters=n_clusters, random_state=0)
-            kmeans_.fit(selected_coords)
-            # Find the nearest
-            final_idx = np.argmin(kmeans_.transform(selected_coords), axis=0)
-            for idx_ in final_idx:
-                dict_num_patch['selected'] += 1
-                x, y = selected_coords[idx_]
-                if self.use_radius:
-                    stride = self.patch_size
-                    Coords = utils.get_circular_coordinates(self.radius, x, y, stride,
-                                                os_slide.dimensions, self.patch_size)
-                else:
-                    Coords = [(x, y)]
-                for coord in Coords:
-                    x_, y_ = coord
-                    if self.use_mask and slide_name in self.mask:
-                        check_tissue = self.check_tissue(slide_name, x_, y_)
-                        if not check_tissue:
-                            continue
-                    if (x_, y_) in extracted_coordinates[label]: # it has been previously extracted (usefull for radius)
-                        continue
-                    paths, check = self.extract_(os_slide, label, paths, x_, y_,
-                                                 class_size_to_patch_path)
-                    if check:
-                        dict_num_patch['radius'] += 1
-                        extracted_coordinates[label].append((x_, y_))
-                        coords.add_coord(label, x_, y_)
+        extracted = []
+        scores = []
+        selected = [(coord, [label]) for coord in map(tuple, clustering.select().tolist())]
+        for candidates in self.expand_seeds(slide_name, selected, os_slide.dimensions,
+                self.patch_size):
+            dict_num_patch['selected'] += 1
+            for _, x_, y_ in candidates:
+                if extracted_coordinates.contains(label, x_, y_): # it has been previously extracted (usefull for radius)
+                    continue
+                paths, check = self.extract_(slide_reader, slide_name, label, paths, x_, y_,
+                                             class_size_to_patch_path, writer=writer)
+                if check:
+                    dict_num_patch['radius'] += 1
+                    extracted_coordinates.add(label, x_, y_)
+                    coords.add_coord(label, x_, y_)
+                    extracted.append((label, x_, y_))
+                    scores.append(slide_reader.scores[(x_, y_)])
         print(f"From {dict_num_patch['total']} total patches, {dict_num_patch['tissue']} "
               f" of them contains tissue, and {dict_num_patch['selected']} are selected"
               f" for representing {slide_name}.")
         if self.use_radius:
             print(f"In total, {dict_num_patch['radius']} are extracted because of "
                   "using radius option!")
-        utils.save_hdf5(hd5_file_path, paths, self.patch_size)
-        if self.store_thumbnail:
+        logger.info(f"{slide_name}: {slide_reader.summary()}.")
+        self.report_slide_tissue(slide_name, slide_reader)
+        self.save_patch_paths(hd5_file_path, paths, writer, extracted=extracted, scores=scores)
+        if self.store_thumbnail and not self.should_plan:
             mask = self.mask[slide_name] if self.use_mask and slide_name in self.mask else None
             PlotThumbnail(slide_name, os_slide, hd5_file_path, None, mask=mask)
-        send_end.send(coords)
+        if send_end is not None:
+            send_end.send(coords)
+        return coords
+
+    def save_plan_counts(self, coords_list):
+        """Save the number of planned patches of each slide and label next to the slide coords file.
+
+        Parameters
+        ----------
+        coords_list : list of CoordsMetadata
+            Planned coords metadata of each slide.
+
+        Returns
+        -------
+        str
+            Path of the JSON file of counts.
+        """
+        counts = {}
+        for coords in coords_list:
+            counts[coords.slide_name] = {label: len(list(coords.get_topleft_coords(label)))
+                    for label in coords.labels}
+            logger.info(f"{coords.slide_name}: {sum(counts[coords.slide_name].values())} "
+                        f"patches planned {counts[coords.slide_name]}.")
+        counts_location = f"{os.path.splitext(self.slide_coords_location)[0]}_counts.json"
+        with open(counts_location, 'w') as f:
+            json.dump(counts, f, indent=4)
+        logger.info(f"In total, {sum(sum(c.values()) for c in counts.values())} patches "
+                    f"are planned from {len(counts)} slides. Counts are saved in {counts_location}.")
+        return counts_location
 
     def produce_args(self, cur_slide_paths):
         """Produce arguments to send to patch extraction subprocess. Creates subdirectories for patches if necessary.
@@ -630,8 +1387,7 @@ class AnnotatedPatchesExtractor(OutputMixin):
             slide_name = utils.path_to_filename(slide_path)
             if self.should_use_manifest:
                 if 'subtype' in self.manifest:
-                    idx = self.manifest['slide_path'].index(slide_path)
-                    subtype_ = self.manifest['subtype'][idx]
+                    subtype_ = self.manifest.get_subtype(slide_path)
                     slide_id = f"{subtype_}/{slide_name}"
                 else:
                     slide_id = slide_name
@@ -655,12 +1411,14 @@ class AnnotatedPatchesExtractor(OutputMixin):
                     """Skip slide as there are no annotations for it.
                     """
                     continue
+                """Labels are scanned from the TXT file, so the annotation is only parsed by the worker extracting the slide"""
+                labels = read_annotation_labels(self.annotation_files[slide_name])
                 if self.is_tumor:
                     tumor_label = BinaryEnum(1).name
-                    if tumor_label in self.slide_annotation[slide_name].labels:
+                    if tumor_label in labels:
                         class_size_to_patch_path[tumor_label] = make_patch_path(tumor_label)
                 else:
-                    for label in self.slide_annotation[slide_name].labels:
+                    for label in labels:
                         class_size_to_patch_path[label] = make_patch_path(label)
             elif self.should_use_entire_slide:
                 label = "Mix"
@@ -688,6 +1446,8 @@ class AnnotatedPatchesExtractor(OutputMixin):
             else:
                 raise NotImplementedError(f"Extract method {self.extract_method} not implemented")
             arg = (slide_path, class_size_to_patch_path)
+            if self.should_use_slide_coords:
+                arg += (self.slide_coords_metadata.get_slide(slide_name),)
             args.append(arg)
         return args
 
@@ -699,50 +1459,87 @@ class AnnotatedPatchesExtractor(OutputMixin):
             logger.info(f"Number of CPU processes of {self.n_process} is too high. Setting to {self.MAX_N_PROCESS}")
             self.n_process = self.MAX_N_PROCESS
         logger.info(f"Number of CPU processes: {self.n_process}")
+        logger.info(f"Startup took {self.startup_time:.2f}s.")
         if hasattr(self, 'slide_idx') and self.slide_idx is not None:
             self.slide_paths = utils.select_slides(self.slide_paths, self.slide_idx, self.n_process)
         n_slides = len(self.slide_paths)
         if n_slides==1:
             logger.info(f"Extracting patches from {self.slide_paths}")
-        coords_to_merge = []
+        slide_paths = self.slide_paths
+        ledger = ExtractionLedger(self.ledger_location)
+        fingerprints = {slide_path: self.get_slide_fingerprint(slide_path)
+                for slide_path in slide_paths}
+        merge_coords = self.should_use_annotation or self.should_plan
+        if self.resume:
+            """Skip slides extracted with the same parameters by a previous run
+            """
+            slide_paths = [slide_path for slide_path in slide_paths
+                    if not ledger.is_complete(utils.path_to_filename(slide_path),
+                        fingerprints[slide_path])]
+            logger.info(f"Resuming: {n_slides - len(slide_paths)} of {n_slides} slides are "
+                        f"already extracted, extracting {len(slide_paths)} slides.")
+        args_list = self.produce_args(slide_paths)
+        slide_coords_lookup = {}
         prefix = "Extracting from slides: "
-        for idx in tqdm(range(0, n_slides, self.n_process),
-                desc=prefix, dynamic_ncols=True):
-            cur_slide_paths = self.slide_paths[idx:idx + self.n_process]
-            processes = []
-            recv_end_list = []
-            for args in self.produce_args(cur_slide_paths):
-                if self.should_use_hd5_files:
-                    p = mp.Process(target=self.extract_patch_by_hd5_files, args=args)
-                elif self.should_use_annotation:
-                    recv_end, send_end = mp.Pipe(False)
-                    recv_end_list.append(recv_end)
-                    args = (*args, send_end,)
-                    p = mp.Process(target=self.extract_patch_by_annotation, args=args)
-                elif self.should_use_entire_slide:
-                    recv_end, send_end = mp.Pipe(False)
-                    recv_end_list.append(recv_end)
-                    args = (*args, send_end,)
-                    p = mp.Process(target=self.extract_patch_by_entire_slide, args=args)
-                elif self.should_use_mosaic:
-                    recv_end, send_end = mp.Pipe(False)
-                    recv_end_list.append(recv_end)
-                    args = (*args, send_end,)
-                    p = mp.Process(target=self.extract_patch_by_mosaic, args=args)
-                elif self.should_use_slide_coords:
-                    p = mp.Process(target=self.extract_patch_by_slide_coords, args=args)
-                p.start()
-                processes.append(p)
-            coords_to_merge.extend(map(lambda x: x.recv(), recv_end_list))
-            for p in processes:
-                p.join()
-
-        if self.should_use_annotation:
+
+        def complete_slide(idx, coords):
+            slide_path = args_list[idx][0]
+            slide_name = utils.path_to_filename(slide_path)
+            if coords is not None:
+                slide_coords_lookup[idx] = coords
+                if merge_coords:
+                    """Save the coords of the slide before it is recorded in the ledger, so they survive a killed run"""
+                    slide_coords_location = self.get_slide_coords_path(slide_name)
+                    os.makedirs(os.path.dirname(slide_coords_location), exist_ok=True)
+                    slide_coords = self.create_slide_coords(slide_coords_location)
+                    slide_coords.consume_coords([coords])
+                    slide_coords.save()
+            """Only outputs that were written are validated on resume, e.g. use-mosaic writes no HDF5 file for a slide it selects no patches from"""
+            ledger.record(slide_name, fingerprints[slide_path],
+                    [output for output in self.get_slide_outputs(slide_name)
+                        if os.path.isfile(output)])
+
+        if self.shard_slides and (self.should_use_annotation or self.should_use_entire_slide):
+            """Extract slides one after the other, splitting each slide over the workers.
+            """
+            extract_method = getattr(self, self.extract_method_name)
+            with ShardPool(self, self.n_process,
+                    start_method=self.start_method) as shard_pool:
+                for idx, args in enumerate(tqdm(args_list, desc=prefix, dynamic_ncols=True)):
+                    try:
+                        coords = extract_method(*args, shard_pool=shard_pool)
+                    except Exception:
+                        """Failed slides are not recorded in the ledger, as in SlidePool"""
+                        logger.exception(f"Could not extract patches from {args[0]}")
+                        continue
+                    complete_slide(idx, coords)
+        else:
+            pool = SlidePool(self, self.n_process, start_method=self.start_method)
+            for idx, coords, success in tqdm(pool.imap_unordered(self.extract_method_name, args_list),
+                    total=len(args_list), desc=prefix, dynamic_ncols=True):
+                if success:
+                    complete_slide(idx, coords)
+        coords_to_merge = [slide_coords_lookup[idx] for idx in sorted(slide_coords_lookup)]
+        if self.resume and merge_coords:
+            """Keep the coords of the slides skipped as extracted by a previous run, from the slide coords file each of them saved when it completed. Slides attempted again that failed are left out, since their outputs may be partial or missing
+            """
+            attempted_slide_names = set(utils.path_to_filename(slide_path)
+                    for slide_path in slide_paths)
+            for slide_path in self.slide_paths:
+                slide_name = utils.path_to_filename(slide_path)
+                slide_coords_location = self.get_slide_coords_path(slide_name)
+                if slide_name not in attempted_slide_names \
+                        and os.path.isfile(slide_coords_location):
+                    previous_coords = SlideCoordsMetadata.load(slide_coords_location)
+                    coords_to_merge.append(previous_coords.get_slide(slide_name))
+
+        if merge_coords:
             """Merge slide coords
             """
             logger.info("Done loop. Saving slide coordinate metadata.")
-            slide_coords = SlideCoordsMetadata(self.slide_coords_location,
-                    patch_size=self.patch_size, resize_sizes=self.__resize_sizes)
+            slide_coords = self.create_slide_coords(self.slide_coords_location)
             slide_coords.consume_coords(coords_to_merge)
             slide_coords.save()
+        if self.should_plan:
+            self.save_plan_counts(coords_to_merge)
         logger.info("Done.")
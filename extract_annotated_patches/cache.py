@@ -0,0 +1,200 @@
+"""Load per-slide resources lazily, and cache what is expensive to rebuild on disk.
+"""
+import os
+import pickle
+import hashlib
+from collections.abc import Mapping
+
+import numpy as np
+from PIL import Image
+from openslide import OpenSlide
+
+import submodule_utils as utils
+from submodule_utils.metadata.annotation import GroovyAnnotation
+from extract_annotated_patches.labelling import TISSUE_THRESHOLD, RasterTissueMask
+
+
+class LazyLookup(Mapping):
+    """Read-only lookup from slide names to objects that are loaded from their file the first time they are accessed.
+
+    Only the file of each slide is known up front, so creating the lookup is cheap, and a worker process only loads the slides it extracts. Loaded objects are not pickled, so sending the lookup to worker processes stays cheap too. Workers extract one slide at a time and outlive many slides, so only the object of the slide accessed last is kept and memory does not grow with the cohort.
+
+    Attributes
+    ----------
+    files : dict of str: str
+        Path of the file of each slide name.
+
+    loader : callable
+        Called with the slide name and file path to load the object of a slide.
+    """
+    def __init__(self, files, loader):
+        self.files = files
+        self.loader = loader
+        self.cache = {}
+
+    def __getitem__(self, slide_name):
+        if slide_name not in self.cache:
+            self.cache.clear()
+            self.cache[slide_name] = self.loader(slide_name, self.files[slide_name])
+        return self.cache[slide_name]
+
+    def __contains__(self, slide_name):
+        return slide_name in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cache'] = {}
+        return state
+
+
+class SlideDimensionsIndex(object):
+    """Index of slide paths by slide name, which reads the dimensions of a slide when they are first needed.
+
+    Attributes
+    ----------
+    slide_paths : dict of str: str
+        Path of each slide by slide name.
+    """
+    def __init__(self, slide_paths):
+        self.slide_paths = {}
+        for slide_path in slide_paths:
+            self.slide_paths.setdefault(utils.path_to_filename(slide_path), slide_path)
+        self.dimensions = {}
+
+    def __contains__(self, slide_name):
+        return slide_name in self.slide_paths
+
+    def get_dimensions(self, slide_name):
+        """Get the width and height of a slide at level 0.
+        """
+        if slide_name not in self.dimensions:
+            os_slide = OpenSlide(self.slide_paths[slide_name])
+            try:
+                self.dimensions[slide_name] = os_slide.dimensions
+            finally:
+                os_slide.close()
+        return self.dimensions[slide_name]
+
+
+def get_cache_name(path, extension):
+    """Get the name of the cache file of a file, unique to its absolute path.
+    """
+    path_hash = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:10]
+    return f"{utils.path_to_filename(path)}-{path_hash}.{extension}"
+
+
+def atomic_save_npz(path, **arrays):
+    """Save arrays to an npz file so that concurrent readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def atomic_save_pickle(path, obj):
+    """Pickle an object to a file so that concurrent readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_annotation(annotation_path, annotation_overlap, patch_size, is_TMA, logger,
+        cache_location=None):
+    """Load the GroovyAnnotation of a slide, from the cache if the annotation file has not changed since it was cached.
+
+    The parsed annotation is cached as a pickle with the parameters it was parsed with, so array jobs extracting one slide each do not parse the annotation again.
+
+    Parameters
+    ----------
+    annotation_path : str
+        Path of the annotation TXT file.
+
+    cache_location : str
+        Directory of cached annotations. If None, annotations are not cached.
+
+    Returns
+    -------
+    GroovyAnnotation
+        The annotation.
+    """
+    if cache_location is None:
+        return GroovyAnnotation(annotation_path, annotation_overlap, patch_size, is_TMA, logger)
+    cache_path = os.path.join(cache_location, 'annotations',
+            get_cache_name(annotation_path, 'pickle'))
+    key = (os.path.getmtime(annotation_path), annotation_overlap, patch_size, is_TMA)
+    if os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_key, annotation = pickle.load(f)
+            if cached_key == key:
+                return annotation
+        except (EOFError, pickle.UnpicklingError):
+            pass
+    annotation = GroovyAnnotation(annotation_path, annotation_overlap, patch_size, is_TMA, logger)
+    atomic_save_pickle(cache_path, (key, annotation))
+    return annotation
+
+
+def read_annotation_labels(annotation_path):
+    """Read the labels of the regions of an annotation TXT file without parsing their points.
+
+    Each line of the file is a label followed by the points of a region in brackets, so only the text before the first bracket of each line is kept.
+
+    Returns
+    -------
+    list of str
+        The labels of the annotation, in order of first appearance.
+    """
+    labels = {}
+    with open(annotation_path) as f:
+        for line in f:
+            label, bracket, _ = line.partition('[')
+            if bracket and label.strip():
+                labels.setdefault(label.strip(), None)
+    return list(labels)
+
+
+def load_raster_tissue_mask(mask_path, slide_size, cache_location=None,
+        threshold=TISSUE_THRESHOLD):
+    """Load the RasterTissueMask of a PNG mask, from the cache if the PNG has not changed since it was cached.
+
+    Parameters
+    ----------
+    mask_path : str
+        Path of the scaled down PNG mask of the slide.
+
+    slide_size : tuple of int
+        Width and height of the slide.
+
+    cache_location : str
+        Directory of cached masks. If None, masks are not cached.
+
+    Returns
+    -------
+    RasterTissueMask
+        The tissue mask.
+    """
+    if cache_location is None:
+        return RasterTissueMask.from_png(mask_path, slide_size, threshold=threshold)
+    cache_path = os.path.join(cache_location, 'masks', get_cache_name(mask_path, 'npz'))
+    mtime = os.path.getmtime(mask_path)
+    if os.path.isfile(cache_path):
+        cached = np.load(cache_path)
+        if cached['mtime'] == mtime:
+            mask = np.unpackbits(cached['mask'], count=int(np.prod(cached['shape'])))
+            return RasterTissueMask(mask.reshape(cached['shape']), slide_size,
+                    threshold=threshold)
+    mask = np.array(Image.open(mask_path).convert('L')) > 0
+    atomic_save_npz(cache_path, mask=np.packbits(mask), shape=np.array(mask.shape),
+            mtime=np.float64(mtime))
+    return RasterTissueMask(mask, slide_size, threshold=threshold)
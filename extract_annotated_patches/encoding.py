@@ -0,0 +1,171 @@
+"""Encode extracted patches into bytes to store them.
+"""
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+PATCH_FORMATS = ['png', 'jpeg', 'webp', 'npy', 'raw']
+default_patch_format = 'png'
+"""Default compress level of PIL, used by Image.save"""
+default_png_compress_level = 6
+default_jpeg_quality = 90
+default_webp_quality = 90
+default_encode_threads = 2
+PATCH_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp', 'npy': 'npy', 'raw': 'raw'}
+
+
+class PatchEncoder(object):
+    """Encodes patches with the same settings.
+
+    Attributes
+    ----------
+    patch_format : str
+        One of 'png', 'jpeg', 'webp', 'npy' or 'raw'. npy patches are uint8 arrays of shape (H, W, 3) saved by np.save. Raw patches are the same pixels in C order with no header.
+
+    png_compress_level : int
+        zlib compression level of PNG from 0 to 9. Lower levels are faster and larger.
+
+    jpeg_quality : int
+        Quality of JPEG from 1 to 95.
+
+    webp_quality : int
+        Quality of lossy WebP from 1 to 100.
+    """
+    def __init__(self, patch_format=default_patch_format,
+            png_compress_level=default_png_compress_level,
+            jpeg_quality=default_jpeg_quality, webp_quality=default_webp_quality):
+        if patch_format not in PATCH_FORMATS:
+            raise ValueError(f"Unknown patch format {patch_format}. Choose from {PATCH_FORMATS}")
+        self.patch_format = patch_format
+        self.png_compress_level = png_compress_level
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+
+    @property
+    def extension(self):
+        return PATCH_EXTENSIONS[self.patch_format]
+
+    def encode(self, patch):
+        """Encode a patch.
+
+        Parameters
+        ----------
+        patch : np.ndarray or PIL.Image
+            RGB patch of shape (H, W, 3). An alpha channel is dropped.
+
+        Returns
+        -------
+        bytes
+            The encoded patch.
+        """
+        if self.patch_format in ['npy', 'raw']:
+            patch = np.asarray(patch, dtype=np.uint8)
+            if patch.ndim == 3 and patch.shape[2] == 4:
+                patch = patch[:, :, :3]
+            patch = np.ascontiguousarray(patch)
+            if self.patch_format == 'raw':
+                return patch.tobytes()
+            buffer = io.BytesIO()
+            np.save(buffer, patch)
+            return buffer.getvalue()
+        if not isinstance(patch, Image.Image):
+            patch = Image.fromarray(np.asarray(patch, dtype=np.uint8))
+        if patch.mode != 'RGB':
+            patch = patch.convert('RGB')
+        buffer = io.BytesIO()
+        if self.patch_format == 'png':
+            patch.save(buffer, format='PNG', compress_level=self.png_compress_level)
+        elif self.patch_format == 'jpeg':
+            patch.save(buffer, format='JPEG', quality=self.jpeg_quality)
+        else:
+            patch.save(buffer, format='WEBP', quality=self.webp_quality)
+        return buffer.getvalue()
+
+    def get_path(self, path):
+        """Get a patch path with the extension of the format of the encoder.
+        """
+        return f"{os.path.splitext(path)[0]}.{self.extension}"
+
+
+class PatchFileWriter(object):
+    """Encodes patches and writes each one to its own file on a pool of threads.
+
+    PIL encoders and file writes release the GIL, so encoding overlaps with reading the next patches from the slide. At most max_pending patches wait to be written, so memory stays bounded when reading is faster than encoding.
+
+    Attributes
+    ----------
+    encoder : PatchEncoder
+        Encoder of the patches.
+
+    n_threads : int
+        Number of encoding threads. If 0, patches are encoded and written by the calling thread.
+
+    max_pending : int
+        Maximum number of patches waiting to be written.
+
+    n_patches : int
+        Number of written patches.
+
+    n_bytes : int
+        Number of written bytes.
+    """
+    def __init__(self, encoder, n_threads=default_encode_threads, max_pending=None):
+        self.encoder = encoder
+        self.n_threads = n_threads
+        self.max_pending = max_pending if max_pending is not None else 4 * max(n_threads, 1)
+        self.executor = ThreadPoolExecutor(n_threads) if n_threads > 0 else None
+        self.pending = deque()
+        self.n_patches = 0
+        self.n_bytes = 0
+
+    def write(self, patch, path):
+        data = self.encoder.encode(patch)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    def wait(self):
+        """Wait for the oldest pending patch to be written. Errors raised while writing it are raised here.
+        """
+        self.n_bytes += self.pending.popleft().result()
+        self.n_patches += 1
+
+    def save(self, patch, path):
+        """Encode a patch and write it to path.
+
+        Parameters
+        ----------
+        patch : np.ndarray or PIL.Image
+            RGB patch of shape (H, W, 3). It should not be modified after it is saved.
+
+        path : str
+            Path of the file to write.
+        """
+        if self.executor is None:
+            self.n_bytes += self.write(patch, path)
+            self.n_patches += 1
+            return
+        while len(self.pending) >= self.max_pending:
+            self.wait()
+        self.pending.append(self.executor.submit(self.write, patch, path))
+
+    def close(self):
+        """Wait for all pending patches to be written and stop the threads.
+        """
+        try:
+            while self.pending:
+                self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
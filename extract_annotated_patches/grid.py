@@ -0,0 +1,308 @@
+"""Index coordinates of patches on the tile grid of a slide.
+"""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from submodule_utils.image.extract import SlideCoordsExtractor
+
+"""Ways to build the tile grid of a slide, see TileGrid"""
+TILE_GRIDS = ['extractor', 'numpy']
+default_tile_grid = 'extractor'
+
+
+class CoordinateIndex(object):
+    """Set of the x, y coordinates of the patches extracted for each label.
+
+    Coordinates that are multiples of cell_size are kept in a boolean bitmap over the grid of cells of the slide, other coordinates in a set. Adding and looking up a coordinate takes constant time in both cases.
+
+    Attributes
+    ----------
+    slide_size : tuple of int
+        Width and height of the slide. If None, all coordinates are kept in sets.
+
+    cell_size : int
+        Size of the cells of the bitmap in pixels, usually the stride between patches.
+    """
+    def __init__(self, slide_size=None, cell_size=None):
+        self.slide_size = slide_size
+        self.cell_size = cell_size
+        self.bitmaps = {}
+        self.sets = defaultdict(set)
+        if slide_size is not None and cell_size:
+            width, height = slide_size
+            self.shape = (int(math.ceil(height / cell_size)) + 1,
+                    int(math.ceil(width / cell_size)) + 1)
+        else:
+            self.shape = None
+
+    def get_cell(self, x, y):
+        """Get the row and column of the bitmap cell of a coordinate, or None if it is not on the bitmap.
+        """
+        if self.shape is None or x < 0 or y < 0 \
+                or x % self.cell_size != 0 or y % self.cell_size != 0:
+            return None
+        row, col = y // self.cell_size, x // self.cell_size
+        if row >= self.shape[0] or col >= self.shape[1]:
+            return None
+        return row, col
+
+    def contains(self, label, x, y):
+        """Check whether a coordinate was added for a label.
+        """
+        cell = self.get_cell(x, y)
+        if cell is None:
+            return (x, y) in self.sets[label]
+        bitmap = self.bitmaps.get(label)
+        return bitmap is not None and bool(bitmap[cell])
+
+    def add(self, label, x, y):
+        """Add the coordinate of a patch of a label.
+        """
+        cell = self.get_cell(x, y)
+        if cell is None:
+            self.sets[label].add((x, y))
+        else:
+            if label not in self.bitmaps:
+                self.bitmaps[label] = np.zeros(self.shape, dtype=bool)
+            self.bitmaps[label][cell] = True
+
+
+def get_disk_offsets(radius):
+    """Get the offsets in steps of the tiles within radius steps of a tile, i.e. with dx^2 + dy^2 <= radius^2, row by row.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (M, 2) of the x, y offsets.
+    """
+    steps = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(steps, steps, indexing='ij')
+    inside = dx ** 2 + dy ** 2 <= radius ** 2
+    return np.stack([dx[inside], dy[inside]], axis=1).astype(np.int64)
+
+
+def get_circular_neighbours(radius, x, y, stride, slide_size, patch_size):
+    """Get the coordinates of the patches within radius strides of a patch that lie inside the slide.
+
+    Parameters
+    ----------
+    radius : int
+        Radius in strides.
+
+    x, y : int
+        Coordinate of top left corner of the patch.
+
+    stride : int
+        Stride in pixels between neighbours.
+
+    slide_size : tuple of int
+        Width and height of the slide.
+
+    patch_size : int
+        Width and height of patches in pixels.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (M, 2) of the x, y coordinates of the neighbours, including the patch itself, row by row.
+    """
+    coords = get_disk_offsets(radius) * stride + np.array([x, y], dtype=np.int64)
+    inside = (coords >= 0).all(axis=1) \
+            & (coords[:, 0] <= slide_size[0] - patch_size) \
+            & (coords[:, 1] <= slide_size[1] - patch_size)
+    return coords[inside]
+
+
+def expand_radius(seeds, radius, stride, slide_size, patch_size):
+    """Get the unique neighbours within radius strides of seeds that lie inside the slide, each with the first seed whose neighbourhood reaches it.
+
+    The seeds are dilated with the disk of get_disk_offsets on the grid of the stride, so the cost does not depend on how much the neighbourhoods overlap. Neighbourhoods only overlap between seeds whose coordinates differ by a multiple of stride, so seeds are dilated on one grid per such group.
+
+    Parameters
+    ----------
+    seeds : np.ndarray
+        Array of shape (S, 2) of the x, y coordinates of the seeds, in order.
+
+    radius : int
+        Radius in strides.
+
+    stride : int
+        Stride in pixels between neighbours.
+
+    slide_size : tuple of int
+        Width and height of the slide.
+
+    patch_size : int
+        Width and height of patches in pixels.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (M, 2) of the x, y coordinates of the neighbours, in the order they are first reached by iterating get_circular_neighbours of each seed in order.
+
+    np.ndarray
+        Array of shape (M,) of the index of the first seed reaching each neighbour.
+    """
+    seeds = np.asarray(seeds, dtype=np.int64).reshape(-1, 2)
+    offsets = get_disk_offsets(radius)
+    n_seeds, n_offsets = len(seeds), len(offsets)
+    if n_seeds == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    """Order of a neighbour reached by seed i through offset j is i * n_offsets + j"""
+    unreached = n_seeds * n_offsets
+    phases = seeds % stride
+    _, phase_ids = np.unique(phases, axis=0, return_inverse=True)
+    phase_ids = phase_ids.ravel()
+    coords, orders = [], []
+    for phase_id in range(phase_ids.max() + 1):
+        idx = np.flatnonzero(phase_ids == phase_id)
+        phase = phases[idx[0]]
+        cells = (seeds[idx] - phase) // stride
+        origin = cells.min(axis=0) - radius
+        width, height = cells.max(axis=0) - origin + radius + 1
+        seed_order = np.full((height, width), n_seeds, dtype=np.int64)
+        """Seeds are assigned in reverse so the first of duplicate seeds is kept"""
+        seed_order[cells[::-1, 1] - origin[1], cells[::-1, 0] - origin[0]] = idx[::-1]
+        seed_order *= n_offsets
+        order = np.full((height, width), unreached, dtype=np.int64)
+        for j, (dx, dy) in enumerate(offsets.tolist()):
+            src = (slice(max(0, -dy), height - max(0, dy)), slice(max(0, -dx), width - max(0, dx)))
+            dst = (slice(max(0, dy), height - max(0, -dy)), slice(max(0, dx), width - max(0, -dx)))
+            np.minimum(order[dst], seed_order[src] + j, out=order[dst])
+        rows, cols = np.nonzero(order < unreached)
+        phase_coords = np.stack([(cols + origin[0]) * stride + phase[0],
+                (rows + origin[1]) * stride + phase[1]], axis=1)
+        inside = (phase_coords >= 0).all(axis=1) \
+                & (phase_coords[:, 0] <= slide_size[0] - patch_size) \
+                & (phase_coords[:, 1] <= slide_size[1] - patch_size)
+        coords.append(phase_coords[inside])
+        orders.append(order[rows, cols][inside])
+    coords, orders = np.concatenate(coords), np.concatenate(orders)
+    sort = np.argsort(orders, kind='stable')
+    return coords[sort], orders[sort] // n_offsets
+
+
+class TileGrid(object):
+    """Tile grid of a slide, with the tile indices and coordinates of all tiles kept in one NumPy array.
+
+    The grid is built once per slide and filtered with boolean arrays, such as the tissue, label or luminance checks of all tiles, so no Python object is created per tile.
+
+    Attributes
+    ----------
+    tiles : np.ndarray
+        Array of shape (N, 4) of the tile_x, tile_y, x, y of each tile, in the order tiles are extracted.
+
+    slide_size : tuple of int
+        Width and height of the slide.
+
+    patch_size : int
+        Width and height of tiles in pixels.
+
+    step : int
+        Distance in pixels between the top left corners of neighbouring tiles.
+    """
+    def __init__(self, tiles, slide_size, patch_size, step):
+        self.tiles = np.asarray(tiles, dtype=np.int64).reshape(-1, 4)
+        self.slide_size = tuple(slide_size)
+        self.patch_size = patch_size
+        self.step = step
+
+    @classmethod
+    def from_extractor(cls, os_slide, patch_size, patch_overlap=0.0, stride=0, shuffle=False,
+            seed=None, is_TMA=False, block_size=1):
+        """Build the grid of the tiles of a slide from the tiles of SlideCoordsExtractor.
+
+        The grid has the same tiles, in the same order, as iterating SlideCoordsExtractor, including its shuffle with seed, so max_slide_patches selects the same patches for the same seed. The tiles are only iterated once per slide. See from_slide for the parameters.
+
+        Returns
+        -------
+        TileGrid
+            The grid.
+        """
+        slide_size = os_slide.size if is_TMA else os_slide.dimensions
+        tiles = np.array(list(SlideCoordsExtractor(os_slide, patch_size,
+                patch_overlap=patch_overlap, shuffle=shuffle, seed=seed, is_TMA=is_TMA,
+                stride=stride)), dtype=np.int64).reshape(-1, 4)
+        step = max(int((1 - patch_overlap) * patch_size) + stride, 1)
+        steps = np.diff(np.unique(tiles[:, 2]))
+        if len(steps) > 0:
+            step = int(steps.min())
+        if not shuffle and block_size > 1:
+            tiles = tiles[np.lexsort((tiles[:, 0], tiles[:, 1], tiles[:, 0] // block_size,
+                    tiles[:, 1] // block_size))]
+        return cls(tiles, slide_size, patch_size, step)
+
+    @classmethod
+    def from_slide(cls, os_slide, patch_size, patch_overlap=0.0, stride=0, shuffle=False,
+            seed=None, is_TMA=False, block_size=1):
+        """Build the grid of the tiles of a slide that lie fully inside the slide.
+
+        Unlike from_extractor, tiles at the right and bottom edges that do not fit in the slide are left out and tiles are shuffled with np.random.default_rng, so shuffled grids select other patches than SlideCoordsExtractor for the same seed.
+
+        Parameters
+        ----------
+        os_slide : OpenSlide or PIL.Image
+            Slide to build the grid of.
+
+        patch_size : int
+            Width and height of tiles in pixels.
+
+        patch_overlap : float
+            Overlap between neighbouring tiles, as a fraction of patch_size.
+
+        stride : int
+            Gap in pixels added between neighbouring tiles.
+
+        shuffle : bool
+            Whether to shuffle the order of the tiles. Otherwise tiles are ordered row by row, or block by block if block_size is more than 1.
+
+        seed : int
+            Seed of the shuffle.
+
+        is_TMA : bool
+            Whether the slide is a TMA core image instead of a slide.
+
+        block_size : int
+            Width and height in tiles of the blocks read at once by BlockSlideReader. Unshuffled tiles are ordered row by row within each block, and blocks row by row.
+
+        Returns
+        -------
+        TileGrid
+            The grid.
+        """
+        slide_size = os_slide.size if is_TMA else os_slide.dimensions
+        step = max(int((1 - patch_overlap) * patch_size) + stride, 1)
+        n_cols = max((slide_size[0] - patch_size) // step + 1, 0)
+        n_rows = max((slide_size[1] - patch_size) // step + 1, 0)
+        tile_y, tile_x = np.meshgrid(np.arange(n_rows), np.arange(n_cols), indexing='ij')
+        tiles = np.stack([tile_x.ravel(), tile_y.ravel(),
+                tile_x.ravel() * step, tile_y.ravel() * step], axis=1)
+        if shuffle:
+            tiles = tiles[np.random.default_rng(seed).permutation(len(tiles))]
+        elif block_size > 1:
+            tiles = tiles[np.lexsort((tiles[:, 0], tiles[:, 1], tiles[:, 0] // block_size,
+                    tiles[:, 1] // block_size))]
+        return cls(tiles, slide_size, patch_size, step)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def coords(self):
+        """Array of shape (N, 2) of the x, y coordinates of the tiles."""
+        return self.tiles[:, 2:]
+
+    def select(self, keep):
+        """Get the grid of the tiles selected by a boolean array or array of indices, in order.
+        """
+        return TileGrid(self.tiles[keep], self.slide_size, self.patch_size, self.step)
+
+    def get_neighbours(self, radius, x, y, stride=None):
+        """Get the coordinates of the patches within radius strides of a patch that lie inside the slide.
+
+        stride defaults to the step of the grid. See get_circular_neighbours.
+        """
+        return get_circular_neighbours(radius, x, y, self.step if stride is None else stride,
+                self.slide_size, self.patch_size)
@@ -0,0 +1,369 @@
+"""Label every tile of a slide at once instead of one tile at a time.
+"""
+import time
+
+import numpy as np
+from PIL import Image
+
+from extract_annotated_patches.mosaic import read_downsampled_slide
+
+TISSUE_THRESHOLD = 0.4
+TISSUE_DETECTIONS = ['none', 'otsu', 'luminance']
+default_tissue_detection = 'none'
+default_detection_downsample = 32
+default_detection_threshold = 0.1
+"""Pixels brighter than this luminance are blank, as in check_luminance"""
+BLANK_LUMINANCE = 210
+"""Patches with more than this fraction of blank pixels are background, as in check_luminance"""
+BLANK_FRACTION = 0.75
+LUMINANCE_WEIGHTS = np.array([0.2125, 0.7154, 0.0721], dtype=np.float32)
+default_luminance_stride = 1
+"""Pixels less saturated than this are never tissue, so Otsu does not split the noise of blank slides"""
+MIN_TISSUE_SATURATION = 20
+
+
+def get_tile_corners(coords, patch_size):
+    """Get the corners of tiles in the same order used by AnnotatedPatchesExtractor.check_label.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        Array of shape (N, 2) of the x, y coordinates of top left corner of each tile.
+
+    patch_size : int
+        Width and height of tiles in pixels.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N, 4, 2) with the corners of each tile.
+    """
+    coords = np.asarray(coords).reshape(-1, 2)
+    offsets = np.array([[0, 0], [0, patch_size],
+            [patch_size, patch_size], [patch_size, 0]])
+    return coords[:, np.newaxis, :] + offsets[np.newaxis, :, :]
+
+
+def annotation_to_labels(annotation, coords, patch_size):
+    """Get the labels of the polygons fully containing each tile.
+
+    A tile has a label if all four of its corners fall inside a polygon of that label.
+    This gives the same labels as GroovyAnnotation.points_to_label when the annotation overlap is 1.0.
+
+    Parameters
+    ----------
+    annotation : GroovyAnnotation
+        Annotation of the slide.
+
+    coords : np.ndarray
+        Array of shape (N, 2) of the x, y coordinates of top left corner of each tile.
+
+    patch_size : int
+        Width and height of tiles in pixels.
+
+    Returns
+    -------
+    list of list of str
+        The labels of each tile. Unlabeled tiles have an empty list.
+    """
+    corners = get_tile_corners(coords, patch_size)
+    n_tiles = len(corners)
+    labels = [[] for _ in range(n_tiles)]
+    if n_tiles == 0:
+        return labels
+    tile_min = corners.min(axis=1)
+    tile_max = corners.max(axis=1)
+    for label, paths in annotation.paths.items():
+        has_label = np.zeros(n_tiles, dtype=bool)
+        for path in paths:
+            extents = path.get_extents()
+            """Only test tiles whose bounding box lies within the bounding box of the polygon"""
+            candidates = np.flatnonzero(~has_label
+                    & (tile_min[:, 0] >= extents.x0) & (tile_min[:, 1] >= extents.y0)
+                    & (tile_max[:, 0] <= extents.x1) & (tile_max[:, 1] <= extents.y1))
+            if len(candidates) == 0:
+                continue
+            inside = path.contains_points(corners[candidates].reshape(-1, 2))
+            has_label[candidates] = inside.reshape(-1, 4).all(axis=1)
+        for idx in np.flatnonzero(has_label):
+            labels[idx].append(label)
+    return labels
+
+
+class RasterTissueMask(object):
+    """Tissue mask rasterized from a scaled down PNG mask of a slide.
+
+    The fraction of tissue pixels of any number of tiles is computed in constant time per tile using an integral image of the mask.
+
+    Attributes
+    ----------
+    slide_size : tuple of int
+        Width and height of the slide at full resolution.
+
+    threshold : float
+        Minimum fraction of tissue pixels for a tile to contain tissue.
+
+    integral : np.ndarray
+        Integral image of shape (mask height + 1, mask width + 1) of the binary mask.
+    """
+    def __init__(self, mask, slide_size, threshold=TISSUE_THRESHOLD):
+        self.slide_size = tuple(slide_size)
+        self.threshold = threshold
+        mask = np.asarray(mask) > 0
+        self.integral = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=np.int64)
+        self.integral[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+
+    @classmethod
+    def from_png(cls, mask_path, slide_size, threshold=TISSUE_THRESHOLD):
+        mask = np.array(Image.open(mask_path).convert('L'))
+        return cls(mask, slide_size, threshold=threshold)
+
+    @property
+    def mask_size(self):
+        return self.integral.shape[1] - 1, self.integral.shape[0] - 1
+
+    def tissue_fraction(self, coords, patch_size):
+        """Get the fraction of tissue pixels in each tile.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            Array of shape (N, 2) of the x, y coordinates of top left corner of each tile.
+
+        patch_size : int
+            Width and height of tiles in pixels.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (N,) of tissue fractions.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        mask_w, mask_h = self.mask_size
+        scale = np.array([mask_w / self.slide_size[0], mask_h / self.slide_size[1]])
+        start = np.floor(coords * scale).astype(np.int64)
+        end = np.ceil((coords + patch_size) * scale).astype(np.int64)
+        start = np.clip(start, 0, [mask_w, mask_h])
+        end = np.clip(end, 0, [mask_w, mask_h])
+        x0, y0 = start[:, 0], start[:, 1]
+        x1, y1 = end[:, 0], end[:, 1]
+        total = self.integral[y1, x1] - self.integral[y0, x1] \
+                - self.integral[y1, x0] + self.integral[y0, x0]
+        area = (x1 - x0) * (y1 - y0)
+        return np.divide(total, area, out=np.zeros(len(coords)), where=area > 0)
+
+    def tiles_to_tissue(self, coords, patch_size):
+        """Get whether each tile contains tissue.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of shape (N,).
+        """
+        return self.tissue_fraction(coords, patch_size) >= self.threshold
+
+
+def otsu_threshold(values):
+    """Get the Otsu threshold of uint8 values, which maximizes the variance between the values at or below it and the values above it.
+    """
+    histogram = np.bincount(np.asarray(values, dtype=np.uint8).ravel(), minlength=256)
+    histogram = histogram.astype(np.float64)
+    weight_low = np.cumsum(histogram)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(histogram * np.arange(256))
+    sum_high = sum_low[-1] - sum_low
+    mean_low = np.divide(sum_low, weight_low, out=np.zeros(256), where=weight_low > 0)
+    mean_high = np.divide(sum_high, weight_high, out=np.zeros(256), where=weight_high > 0)
+    variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.argmax(variance))
+
+
+def get_luminance(image):
+    """Get the luminance of each pixel of RGB images of any shape (..., 3).
+    """
+    return np.asarray(image)[..., :3].astype(np.float32) @ LUMINANCE_WEIGHTS
+
+
+def detect_tissue(image, method='otsu'):
+    """Detect the tissue pixels of a low resolution RGB image of a slide.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        RGB image of shape (H, W, 3).
+
+    method : str
+        How tissue is detected:
+         - otsu: pixels with a saturation above the Otsu threshold of the saturation of the image.
+         - luminance: pixels that are not blank by the luminance criterion of check_luminance.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array of shape (H, W) of whether each pixel is tissue.
+    """
+    image = np.asarray(image)[..., :3]
+    if method == 'otsu':
+        rgb_max = image.max(axis=2).astype(np.int32)
+        rgb_min = image.min(axis=2).astype(np.int32)
+        saturation = np.divide(255 * (rgb_max - rgb_min), rgb_max,
+                out=np.zeros(rgb_max.shape), where=rgb_max > 0).astype(np.uint8)
+        threshold = max(otsu_threshold(saturation), MIN_TISSUE_SATURATION)
+        return saturation > threshold
+    elif method == 'luminance':
+        return get_luminance(image) <= BLANK_LUMINANCE
+    raise NotImplementedError(f"Tissue detection {method} not implemented")
+
+
+class DetectedTissueMask(RasterTissueMask):
+    """Tissue mask detected on a thumbnail of a slide, used to skip background tiles before they are read at full resolution.
+
+    Attributes
+    ----------
+    method : str
+        How tissue was detected. See detect_tissue.
+
+    seconds : float
+        Seconds spent reading the thumbnail and detecting tissue.
+
+    n_tiles : int
+        Number of tiles of the tile grid counted by count_grid.
+
+    n_skipped : int
+        Number of tiles of the tile grid without tissue.
+    """
+    def __init__(self, mask, slide_size, threshold=default_detection_threshold,
+            method='otsu', seconds=0.):
+        super().__init__(mask, slide_size, threshold=threshold)
+        self.method = method
+        self.seconds = seconds
+        self.n_tiles = 0
+        self.n_skipped = 0
+
+    @classmethod
+    def detect(cls, os_slide, method='otsu', downsample=default_detection_downsample,
+            threshold=default_detection_threshold):
+        """Read the slide downsampled by downsample and detect its tissue.
+        """
+        start = time.perf_counter()
+        mask = detect_tissue(read_downsampled_slide(os_slide, downsample), method)
+        return cls(mask, os_slide.dimensions, threshold=threshold, method=method,
+                seconds=time.perf_counter() - start)
+
+    def count_grid(self, is_tissue):
+        """Count the tiles of the tile grid that are skipped, from whether each tile contains tissue.
+        """
+        self.n_tiles += len(is_tissue)
+        self.n_skipped += int(np.count_nonzero(~np.asarray(is_tissue)))
+
+    def summary(self, seconds_per_read=None):
+        summary = (f"{self.method} tissue detection skipped {self.n_skipped} of {self.n_tiles} "
+                f"tiles in {self.seconds:.1f}s")
+        if seconds_per_read is not None:
+            saved = self.n_skipped * seconds_per_read - self.seconds
+            summary += f", saving about {saved:.1f}s of full resolution reads"
+        return summary
+
+
+class BackgroundScorer(object):
+    """Scores stacks of patches by the fraction of their pixels that are not blank, and keeps the patches that are not background by the luminance criterion of check_luminance.
+
+    Attributes
+    ----------
+    stride : int
+        Only every stride-th pixel along each axis of a patch is scored. 1 scores every pixel, larger strides are faster and approximate.
+
+    blank_luminance : float
+        Pixels brighter than this luminance are blank.
+
+    blank_fraction : float
+        Patches with more than this fraction of blank pixels are background.
+
+    chunk_pixels : int
+        Maximum number of pixels converted to luminance at once, to bound memory.
+    """
+    def __init__(self, stride=default_luminance_stride, blank_luminance=BLANK_LUMINANCE,
+            blank_fraction=BLANK_FRACTION, chunk_pixels=2**22):
+        self.stride = max(int(stride), 1)
+        self.blank_luminance = blank_luminance
+        self.blank_fraction = blank_fraction
+        self.chunk_pixels = chunk_pixels
+
+    def score(self, patches):
+        """Score patches and check whether they are background.
+
+        Parameters
+        ----------
+        patches : np.ndarray
+            Array of shape (B, H, W, C) of RGB or RGBA patches, or (H, W, C) of one patch.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of shape (B,) of whether each patch passes the luminance check i.e. it is not background.
+
+        np.ndarray
+            Array of shape (B,) of the fraction of pixels of each patch that are not blank.
+        """
+        patches = np.asarray(patches)
+        if patches.ndim == 3:
+            patches = patches[np.newaxis]
+        sampled = patches[:, ::self.stride, ::self.stride]
+        scores = np.zeros(len(sampled))
+        n_pixels = sampled.shape[1] * sampled.shape[2]
+        chunk_size = max(self.chunk_pixels // max(n_pixels, 1), 1)
+        for start in range(0, len(sampled), chunk_size):
+            luminance = get_luminance(sampled[start:start + chunk_size])
+            scores[start:start + chunk_size] = (luminance <= self.blank_luminance).mean(axis=(1, 2))
+        return scores > 1 - self.blank_fraction, scores
+
+    def get_tissue_mask(self, region):
+        """Get whether the pixels of a region, sampled every stride-th pixel, are not blank.
+
+        Parameters
+        ----------
+        region : np.ndarray
+            Array of shape (H, W, C) of an RGB or RGBA region of a slide.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of the sampled height and width of the region.
+        """
+        sampled = np.asarray(region)[::self.stride, ::self.stride]
+        return get_luminance(sampled) <= self.blank_luminance
+
+    def score_mask(self, mask, offsets, patch_size):
+        """Score the patches of a region from the tissue mask of the region from get_tissue_mask.
+
+        Parameters
+        ----------
+        offsets : np.ndarray
+            Array of shape (B, 2) of the x, y offsets of the top left corner of each patch in the region.
+
+        patch_size : int
+            Width and height of patches in pixels.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array of shape (B,) of whether each patch passes the luminance check i.e. it is not background.
+
+        np.ndarray
+            Array of shape (B,) of the fraction of pixels of each patch that are not blank.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+        """Sampled pixels of a patch are the multiples of stride in [offset, offset + patch_size)"""
+        starts = -(-offsets // self.stride)
+        ends = -(-(offsets + patch_size) // self.stride)
+        scores = np.zeros(len(offsets))
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(starts.tolist(), ends.tolist())):
+            scores[i] = np.count_nonzero(mask[y0:y1, x0:x1]) / max((x1 - x0) * (y1 - y0), 1)
+        return scores > 1 - self.blank_fraction, scores
+
+    def score_region(self, region, offsets, patch_size):
+        """Score the patches of a region read at once, converting the region to luminance once even where patches overlap.
+
+        With stride 1 the scores are the same as those of score on each patch. See score_mask.
+        """
+        return self.score_mask(self.get_tissue_mask(region), offsets, patch_size)
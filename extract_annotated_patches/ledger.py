@@ -0,0 +1,96 @@
+"""Ledger of slides whose extraction completed, used to resume interrupted runs.
+"""
+import os
+import json
+import hashlib
+
+
+def make_fingerprint(parameters):
+    """Hash the parameters a slide was extracted with.
+
+    Parameters
+    ----------
+    parameters : dict
+        JSON serializable parameters.
+
+    Returns
+    -------
+    str
+        Hex digest that changes whenever any parameter changes.
+    """
+    payload = json.dumps(parameters, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def file_mtime(path):
+    """Get the modification time of a file, or None if it does not exist.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    return os.path.getmtime(path)
+
+
+class ExtractionLedger(object):
+    """Append-only JSON lines file recording the slides whose extraction completed.
+
+    Each line records the slide name, the fingerprint of the parameters it was extracted with and its output files. Lines are appended with a single write, so processes of an array job can share one ledger. The last line of a slide wins.
+
+    Attributes
+    ----------
+    ledger_location : str
+        Path of the ledger file.
+
+    entries : dict of str: dict
+        Last recorded entry of each slide.
+    """
+    def __init__(self, ledger_location):
+        self.ledger_location = ledger_location
+        self.entries = {}
+        if os.path.isfile(ledger_location):
+            with open(ledger_location, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        """Skip a line partially written by a killed job"""
+                        continue
+                    self.entries[entry['slide_name']] = entry
+
+    def is_complete(self, slide_name, fingerprint):
+        """Check whether a slide was extracted with the same parameters and its outputs still exist.
+        """
+        entry = self.entries.get(slide_name)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return all(os.path.isfile(path) for path in entry['outputs'])
+
+    def record(self, slide_name, fingerprint, outputs):
+        """Record that the extraction of a slide completed.
+
+        Parameters
+        ----------
+        slide_name : str
+            Name of slide.
+
+        fingerprint : str
+            Fingerprint of the parameters the slide was extracted with.
+
+        outputs : list of str
+            Paths of the files the extraction of the slide produced.
+        """
+        entry = {'slide_name': slide_name, 'fingerprint': fingerprint,
+                'outputs': list(outputs)}
+        self.entries[slide_name] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(self.ledger_location)), exist_ok=True)
+        line = json.dumps(entry) + '\n'
+        if os.path.isfile(self.ledger_location) and os.path.getsize(self.ledger_location) > 0:
+            with open(self.ledger_location, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    """Do not append to a line partially written by a killed job"""
+                    line = '\n' + line
+        with open(self.ledger_location, 'a') as f:
+            f.write(line)
@@ -0,0 +1,83 @@
+"""Index the rows of a manifest by slide.
+"""
+import submodule_utils as utils
+
+
+class ManifestIndex(object):
+    """Manifest with its rows indexed by slide path and slide name.
+
+    The index is built once, so looking up the subtype, annotation path or mask path of a slide takes constant time.
+
+    Attributes
+    ----------
+    manifest : dict of str: list
+        Values of each column of the manifest, as read by utils.read_manifest.
+
+    rows_by_path : dict of str: int
+        Row of each slide path.
+
+    rows_by_name : dict of str: int
+        Row of each slide name. If two slides have the same name, the first row is kept.
+    """
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.rows_by_path = {}
+        self.rows_by_name = {}
+        for row, slide_path in enumerate(manifest['slide_path']):
+            self.rows_by_path.setdefault(slide_path, row)
+            self.rows_by_name.setdefault(utils.path_to_filename(slide_path), row)
+
+    @classmethod
+    def read(cls, manifest_location):
+        return cls(utils.read_manifest(manifest_location))
+
+    def __contains__(self, column):
+        return column in self.manifest
+
+    def __len__(self):
+        return len(self.manifest['slide_path'])
+
+    @property
+    def slide_paths(self):
+        return self.manifest['slide_path']
+
+    def get_row(self, slide):
+        """Get the row of a slide from its path or name, or None if the slide is not in the manifest.
+        """
+        if slide in self.rows_by_path:
+            return self.rows_by_path[slide]
+        return self.rows_by_name.get(slide)
+
+    def get(self, slide, column):
+        """Get the value of a column for a slide from its path or name, or None if the slide or the column is not in the manifest.
+        """
+        row = self.get_row(slide)
+        if row is None or column not in self.manifest:
+            return None
+        return self.manifest[column][row]
+
+    def get_subtype(self, slide):
+        return self.get(slide, 'subtype')
+
+    def get_annotation_path(self, slide):
+        return self.get(slide, 'annotation_path')
+
+    def get_mask_path(self, slide):
+        return self.get(slide, 'mask_path')
+
+    def get_column_files(self, column):
+        """Get the file in a column for each slide name that has one.
+
+        Returns
+        -------
+        dict of str: str
+            Path in the column for each slide name.
+        """
+        files = {}
+        if column not in self.manifest:
+            return files
+        for slide_name, row in self.rows_by_name.items():
+            filepath = self.manifest[column][row]
+            if isinstance(filepath, str) and filepath:
+                files[slide_name] = filepath
+        return files
@@ -0,0 +1,314 @@
+"""Read low resolution evaluation tiles, compute their colour histograms and cluster them for use-mosaic.
+"""
+import math
+
+import numpy as np
+from PIL import Image
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+EVALUATION_READS = ['full', 'level', 'grid']
+default_evaluation_read = 'full'
+MOSAIC_FEATURES = ['rgb', 'hsv']
+default_mosaic_features = 'rgb'
+CLUSTERING_ENGINES = ['kmeans', 'minibatch']
+default_clustering = 'kmeans'
+default_clustering_batch_size = 1024
+HSV_BINS = (8, 4, 4)
+
+
+def get_evaluation_level(os_slide, downsample):
+    """Get the pyramid level of the slide closest to, and not coarser than, downsample.
+
+    Returns
+    -------
+    int
+        The level.
+
+    float
+        Downsample of the level.
+    """
+    level = os_slide.get_best_level_for_downsample(downsample)
+    return level, os_slide.level_downsamples[level]
+
+
+def read_evaluation_tile(os_slide, x, y, patch_size, evaluation_size, level):
+    """Read the patch_size * patch_size region at x, y from a pyramid level and resize it to evaluation_size.
+
+    Parameters
+    ----------
+    os_slide : OpenSlide
+        Slide to read from.
+
+    x, y : int
+        Coordinate of top left corner of the tile at level 0.
+
+    patch_size : int
+        Size of the tile at level 0.
+
+    evaluation_size : int
+        Size of the returned tile.
+
+    level : int
+        Pyramid level to read from.
+
+    Returns
+    -------
+    PIL.Image
+        RGB tile of size evaluation_size.
+    """
+    level_size = int(math.ceil(patch_size / os_slide.level_downsamples[level]))
+    tile = os_slide.read_region((x, y), level, (level_size, level_size)).convert('RGB')
+    if level_size != evaluation_size:
+        tile = tile.resize((evaluation_size, evaluation_size), Image.BILINEAR)
+    return tile
+
+
+def read_downsampled_slide(os_slide, downsample, max_strip_pixels=2**26):
+    """Read the whole slide downsampled by downsample.
+
+    The slide is read from the closest pyramid level in horizontal strips, each resized before the next one is read, so memory stays bounded for large slides.
+
+    Parameters
+    ----------
+    os_slide : OpenSlide
+        Slide to read from.
+
+    downsample : float
+        Downsample of the returned image relative to level 0.
+
+    max_strip_pixels : int
+        Maximum number of level pixels read at once.
+
+    Returns
+    -------
+    np.ndarray
+        RGB image of shape (ceil(height / downsample), ceil(width / downsample), 3).
+    """
+    level, level_downsample = get_evaluation_level(os_slide, downsample)
+    level_width, level_height = os_slide.level_dimensions[level]
+    width, height = os_slide.dimensions
+    out_width = int(math.ceil(width / downsample))
+    out_height = int(math.ceil(height / downsample))
+    """Number of level rows per output row"""
+    factor = downsample / level_downsample
+    strip_height = max(1, int(max_strip_pixels / (level_width * factor)))
+    image = np.zeros((out_height, out_width, 3), dtype=np.uint8)
+    for out_y in range(0, out_height, strip_height):
+        out_y_end = min(out_y + strip_height, out_height)
+        level_y = int(round(out_y * factor))
+        level_y_end = min(int(round(out_y_end * factor)), level_height)
+        if level_y_end <= level_y:
+            continue
+        strip = os_slide.read_region((0, int(level_y * level_downsample)), level,
+                (level_width, level_y_end - level_y)).convert('RGB')
+        strip = strip.resize((out_width, out_y_end - out_y), Image.BILINEAR)
+        image[out_y:out_y_end] = np.asarray(strip)
+    return image
+
+
+def cut_tiles(image, coords, downsample, evaluation_size):
+    """Cut evaluation tiles out of a downsampled slide image.
+
+    Tiles that go past the edge of the image are padded with white.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Downsampled RGB image of shape (H, W, 3) from read_downsampled_slide.
+
+    coords : np.ndarray
+        Array of shape (N, 2) of the x, y coordinates at level 0 of the top left corner of each tile.
+
+    downsample : float
+        Downsample of image relative to level 0.
+
+    evaluation_size : int
+        Size of tiles in the downsampled image.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N, evaluation_size, evaluation_size, 3).
+    """
+    coords = np.asarray(coords).reshape(-1, 2)
+    padded = np.pad(image, ((0, evaluation_size), (0, evaluation_size), (0, 0)),
+            constant_values=255)
+    start = np.floor(coords / downsample).astype(np.int64)
+    offsets = np.arange(evaluation_size)
+    rows = start[:, 1, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+    cols = start[:, 0, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+    return padded[rows, cols]
+
+
+def rgb_histograms(tiles):
+    """Compute the colour histogram of a stack of RGB tiles.
+
+    The layout is the same as PIL.Image.histogram for RGB images: 256 bins for red, then green, then blue.
+
+    Parameters
+    ----------
+    tiles : np.ndarray
+        Array of shape (N, H, W, 3) of uint8 tiles.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N, 768) of pixel counts.
+    """
+    n_tiles = len(tiles)
+    values = tiles.reshape(n_tiles, -1, 3).astype(np.int64)
+    values += np.arange(3) * 256
+    values += np.arange(n_tiles)[:, np.newaxis, np.newaxis] * 768
+    return np.bincount(values.ravel(), minlength=n_tiles * 768).reshape(n_tiles, 768)
+
+
+def hsv_histograms(tiles, bins=HSV_BINS):
+    """Compute the joint HSV histogram of a stack of RGB tiles.
+
+    With the default 8 hue, 4 saturation and 4 value bins each tile is described by 128 values instead of the 768 of rgb_histograms.
+
+    Parameters
+    ----------
+    tiles : np.ndarray
+        Array of shape (N, H, W, 3) of uint8 tiles.
+
+    bins : tuple of int
+        Number of hue, saturation and value bins. Each should be a power of 2 up to 256.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (N, prod(bins)) of pixel counts.
+    """
+    n_tiles, height, width, _ = tiles.shape
+    """Convert all tiles at once as one tall image"""
+    stacked = Image.fromarray(np.ascontiguousarray(tiles).reshape(n_tiles * height, width, 3))
+    hsv = np.asarray(stacked.convert('HSV')).reshape(n_tiles, -1, 3).astype(np.int64)
+    shifts = [8 - int(n_bins).bit_length() + 1 for n_bins in bins]
+    n_bins = int(np.prod(bins))
+    values = ((hsv[..., 0] >> shifts[0]) * bins[1] + (hsv[..., 1] >> shifts[1])) * bins[2] \
+            + (hsv[..., 2] >> shifts[2])
+    values += np.arange(n_tiles)[:, np.newaxis] * n_bins
+    return np.bincount(values.ravel(), minlength=n_tiles * n_bins).reshape(n_tiles, n_bins)
+
+
+def make_clusterer(clustering, n_clusters, batch_size=default_clustering_batch_size):
+    """Create the clustering estimator for a clustering engine.
+    """
+    if clustering == 'kmeans':
+        return KMeans(n_clusters=n_clusters, random_state=0)
+    elif clustering == 'minibatch':
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=0,
+                batch_size=batch_size)
+    else:
+        raise NotImplementedError(f"Clustering {clustering} not implemented")
+
+
+class MosaicClustering(object):
+    """Select representative tiles of a slide by clustering their colour and then their position.
+
+    Features and coordinates of tissue tiles are kept in arrays preallocated for every tile of the slide.
+    With the minibatch engine, the colour clusters are fit with partial_fit as tiles are added, so tiles are clustered while the slide is being read.
+
+    Attributes
+    ----------
+    n_clusters : int
+        Number of colour clusters.
+
+    percentage : float
+        Fraction of the tiles of each colour cluster to select.
+
+    clustering : str
+        Clustering engine, one of 'kmeans' or 'minibatch'.
+
+    features : str
+        Tile features, one of 'rgb' (768 bin RGB histogram) or 'hsv' (binned joint HSV histogram).
+
+    n_tissue : int
+        Number of tiles added.
+    """
+    def __init__(self, n_tiles, n_clusters, percentage, clustering=default_clustering,
+            features=default_mosaic_features, batch_size=default_clustering_batch_size):
+        self.n_clusters = n_clusters
+        self.percentage = percentage
+        self.clustering = clustering
+        self.features = features
+        self.batch_size = batch_size
+        n_features = 768 if features == 'rgb' else int(np.prod(HSV_BINS))
+        """KMeans keeps float64 features to give the same clusters as before"""
+        dtype = np.float64 if clustering == 'kmeans' else np.float32
+        self.tile_features = np.empty((n_tiles, n_features), dtype=dtype)
+        self.tile_coords = np.empty((n_tiles, 2), dtype=np.int64)
+        self.n_tissue = 0
+        self.n_fit = 0
+        self.clusterer = make_clusterer(clustering, n_clusters, batch_size)
+
+    def get_features(self, eval_tiles):
+        if self.features == 'rgb':
+            return rgb_histograms(eval_tiles)
+        elif self.features == 'hsv':
+            return hsv_histograms(eval_tiles)
+        else:
+            raise NotImplementedError(f"Mosaic features {self.features} not implemented")
+
+    def add(self, eval_tiles, coords):
+        """Add tissue tiles.
+
+        Parameters
+        ----------
+        eval_tiles : np.ndarray
+            Array of shape (N, H, W, 3) of evaluation tiles.
+
+        coords : np.ndarray
+            Array of shape (N, 2) of the coordinates of the tiles.
+        """
+        start, end = self.n_tissue, self.n_tissue + len(eval_tiles)
+        self.tile_features[start:end] = self.get_features(eval_tiles)
+        self.tile_coords[start:end] = coords
+        self.n_tissue = end
+        if self.clustering == 'minibatch':
+            self.partial_fit()
+
+    def partial_fit(self, final=False):
+        """Fit the colour clusters on the tiles added since the last fit once there are enough of them.
+        """
+        n_pending = self.n_tissue - self.n_fit
+        if n_pending >= max(self.batch_size, self.n_clusters) \
+                or (final and n_pending > 0 and self.n_tissue >= self.n_clusters):
+            """The first fit needs at least n_clusters tiles"""
+            self.clusterer.partial_fit(self.tile_features[self.n_fit:self.n_tissue])
+            self.n_fit = self.n_tissue
+
+    def select(self):
+        """Select the tiles representing the slide.
+
+        For each colour cluster, the tiles are clustered again by position into percentage of its tiles, and the tile closest to each position cluster is selected.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (M, 2) of the coordinates of the selected tiles.
+        """
+        features = self.tile_features[:self.n_tissue]
+        coords = self.tile_coords[:self.n_tissue]
+        if self.clustering == 'minibatch':
+            self.partial_fit(final=True)
+            clusters = self.clusterer.predict(features)
+        else:
+            clusters = self.clusterer.fit_predict(features)
+        selected = []
+        for n_cluster in range(self.n_clusters):
+            idx = np.where(clusters==n_cluster)[0]
+            if len(idx)==0: continue
+            selected_coords = coords[idx]
+            n_clusters = math.ceil(len(idx) * self.percentage)
+            if n_clusters > len(idx): continue
+            # Another Kmeans on location
+            kmeans_ = make_clusterer(self.clustering, n_clusters, self.batch_size)
+            kmeans_.fit(selected_coords)
+            # Find the nearest
+            final_idx = np.argmin(kmeans_.transform(selected_coords), axis=0)
+            selected.append(selected_coords[final_idx])
+        if not selected:
+            return np.empty((0, 2), dtype=np.int64)
+        return np.concatenate(selected)
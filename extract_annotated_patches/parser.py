@@ -9,6 +9,24 @@ from submodule_utils.arguments import (
         str_kv, int_kv, subtype_kv, make_dict, positive_int, float_less_one,
         ParseKVToDictAction, CustomHelpFormatter)
 from extract_annotated_patches import *
+from extract_annotated_patches.mosaic import (EVALUATION_READS, default_evaluation_read,
+        MOSAIC_FEATURES, default_mosaic_features, CLUSTERING_ENGINES, default_clustering,
+        default_clustering_batch_size)
+from extract_annotated_patches.reader import (default_plan_downsample, default_read_run_length,
+        default_block_size)
+from extract_annotated_patches.labelling import (TISSUE_DETECTIONS, default_tissue_detection,
+        default_detection_downsample, default_detection_threshold, default_luminance_stride)
+from extract_annotated_patches.pipeline import (default_read_queue_depth,
+        default_write_queue_depth, default_resize_threads)
+from extract_annotated_patches.scheduler import START_METHODS
+from extract_annotated_patches.grid import TILE_GRIDS, default_tile_grid
+from extract_annotated_patches.resizing import RESIZE_METHODS, default_resize_method
+from extract_annotated_patches.writers import (HD5_COMPRESSIONS, HD5_LAYOUTS,
+        default_hd5_compression, default_hd5_compression_level, default_hd5_batch_size,
+        default_hd5_layout, default_tar_shard_size)
+from extract_annotated_patches.encoding import (PATCH_FORMATS, default_patch_format,
+        default_png_compress_level, default_jpeg_quality, default_webp_quality,
+        default_encode_threads)
 
 description="""Extract annotated patches.
 """
@@ -31,6 +49,103 @@ def create_parser(parser):
             help="Whether or not save thumbnail with showing the position "
             "of extracted patches. If yes, it will be stored at a folder called "
             "Thumbnails in HD5 folder.")
+    parser.add_argument("--shard_slides", action='store_true',
+            help="Extract slides one after the other and split the tiles of each slide "
+            "into spatial shards processed by num_patch_workers processes, instead of "
+            "extracting one slide per process. Useful for array jobs with few, very large "
+            "slides. Only used by use-annotation and use-entire-slide, and ignored for TMAs. "
+            "The extracted patches do not depend on the number of workers.")
+    parser.add_argument("--resize_method", type=str,
+            default=default_resize_method, choices=RESIZE_METHODS,
+            help="How patches are resized to the sizes smaller than patch_size. "
+            "'independent' resizes the extracted patch to each size. 'cascade' resizes "
+            "each size from the next larger one. 'pyramid' reads sizes whose downsample "
+            "matches a pyramid level of the slide directly from that level and cascades "
+            "the others. 'cascade' and 'pyramid' are faster with several sizes and differ "
+            "from 'independent' by resampling error only "
+            "(see benchmarks/bench_resize.py).")
+    parser.add_argument("--luminance_stride", type=positive_int,
+            default=default_luminance_stride,
+            help="Check patches for background on every n-th pixel along each axis. "
+            "1 checks every pixel exactly like check_luminance, and 4 is about 16 times "
+            "faster with an approximate check. The fraction of pixels of each extracted "
+            "patch that are not blank is saved in the scores group of the slide HDF5 file.")
+    parser.add_argument("--block_size", type=positive_int, default=default_block_size,
+            help="Read patches from blocks of block_size x block_size tiles, each read with one "
+            "read_region call and sliced into patches, instead of one read_region call per "
+            "patch. Tiles that are not shuffled are extracted block by block, so the order of "
+            "the extracted patches changes. Which patches are extracted only changes with "
+            "use-mosaic, whose clustering sees the tiles in another order. use-slide-coords "
+            "reads the coordinates of each block together in place of runs of read_run_length. "
+            "Patches are read one at a time when tiles are shuffled by max_slide_patches, "
+            "from TMAs and by shard workers. Default 1 reads patches one at a time "
+            "(see benchmarks/bench_block_reads.py).")
+    parser.add_argument("--tile_grid", type=str, choices=TILE_GRIDS, default=default_tile_grid,
+            help="How to build the tile grid of each slide. 'extractor' has the tiles of "
+            "SlideCoordsExtractor in its order and shuffle, so the same seed and "
+            "max_slide_patches select the same patches as previous versions. 'numpy' builds "
+            "the grid in NumPy without iterating tiles in Python. It leaves out tiles that do "
+            "not fit fully in the slide and shuffles them with NumPy, so the same seed and "
+            "max_slide_patches select different patches. Default is 'extractor'.")
+    parser.add_argument("--start_method", type=str, choices=START_METHODS,
+            help="Method used to start worker processes. Use 'spawn' or 'forkserver' where "
+            "forking a process that has opened slides is not safe. Each worker is sent the "
+            "extractor once and then one small task per slide. Default is the default of "
+            "the platform.")
+    parser.add_argument("--resume", action='store_true',
+            help="Skip slides that a previous run extracted with the same parameters, "
+            "as recorded in the ledger, and whose outputs still exist. Each completed slide "
+            "saves its slide coordinates in a _slides directory next to slide_coords_location, "
+            "from which the coordinates of skipped slides are merged, so runs that were killed "
+            "can be resumed.")
+    parser.add_argument("--ledger_location", type=str,
+            help="Path to the ledger file recording which slides completed and with which "
+            "parameters. The ledger is written on every run so that an interrupted run can be "
+            "resumed. Default is ledger.jsonl in hd5_location.")
+
+    parser.add_argument("--cache_location", type=str,
+            help="Path to the directory caching parsed annotations and rasterized tissue masks "
+            "between runs. "
+            "Default is cache in hd5_location.")
+    parser.add_argument("--patch_format", type=str,
+            default=default_patch_format, choices=PATCH_FORMATS,
+            help="Encoding of the patches saved by --store_extracted_patches, "
+            "--store_extracted_patches_as_tar and from-hd5-files. The extension of patch "
+            "paths follows the format. 'npy' saves uint8 arrays with np.save and 'raw' saves "
+            "the uint8 RGB pixels with no header. PNG encoding is often the largest CPU cost "
+            "of extraction (see benchmarks/bench_encoding.py).")
+    parser.add_argument("--png_compress_level", type=int,
+            default=default_png_compress_level, choices=range(0, 10), metavar="[0-9]",
+            help="zlib compression level of PNG patches. Lower levels encode faster and "
+            "produce larger files.")
+    parser.add_argument("--jpeg_quality", type=int,
+            default=default_jpeg_quality, choices=range(1, 96), metavar="[1-95]",
+            help="Quality of JPEG patches.")
+    parser.add_argument("--webp_quality", type=int,
+            default=default_webp_quality, choices=range(1, 101), metavar="[1-100]",
+            help="Quality of lossy WebP patches.")
+    parser.add_argument("--encode_threads", type=int,
+            default=default_encode_threads, choices=range(0, 65), metavar="[0-64]",
+            help="Number of threads per worker process encoding and writing patch files, "
+            "so that encoding overlaps with reading the next patches. 0 encodes in the "
+            "worker thread.")
+    parser.add_argument("--pipeline", action='store_true',
+            help="Whether to read tiles ahead on a reader thread, and resize and store "
+            "extracted patches on other threads, inside each worker process, so that reading "
+            "from the slide overlaps with resizing and writing. Extracted patches are the "
+            "same. Only used by use-annotation and use-entire-slide without --shard_slides. "
+            "The time of each stage is logged per slide.")
+    parser.add_argument("--read_queue_depth", type=positive_int,
+            default=default_read_queue_depth,
+            help="Maximum number of tiles read ahead by --pipeline.")
+    parser.add_argument("--write_queue_depth", type=positive_int,
+            default=default_write_queue_depth,
+            help="Maximum number of extracted patches waiting to be resized and stored "
+            "by --pipeline.")
+    parser.add_argument("--resize_threads", type=int,
+            default=default_resize_threads, choices=range(0, 65), metavar="[0-64]",
+            help="Number of threads resizing patches in --pipeline. 0 resizes on the "
+            "thread storing patches.")
 
     help_subparsers_load = """Specify how to load slides to extract.
     There are 3 ways of extracting slides: from hd5 files, by manifest and by directory."""
@@ -92,6 +207,35 @@ def create_parser(parser):
             help="Whether or not save extracted patches as png files on the disk.")
     parser_directory.add_argument("--store_extracted_patches_as_hd5", action='store_true',
             help="Whether or not save extracted patches as hd5 files on the disk.")
+    parser_directory.add_argument("--hd5_compression", type=str,
+            default=default_hd5_compression, choices=HD5_COMPRESSIONS,
+            help="Compression codec of the patches saved by --store_extracted_patches_as_hd5.")
+    parser_directory.add_argument("--hd5_compression_level", type=int,
+            default=default_hd5_compression_level, choices=range(1, 10),
+            metavar="[1-9]",
+            help="Level of gzip compression. Only used when --hd5_compression is gzip.")
+    parser_directory.add_argument("--hd5_batch_size", type=positive_int,
+            default=default_hd5_batch_size,
+            help="Number of patches buffered in memory before they are written to the HD5 file "
+            "of the slide when --store_extracted_patches_as_hd5 is set.")
+    parser_directory.add_argument("--hd5_layout", type=str,
+            default=default_hd5_layout, choices=HD5_LAYOUTS,
+            help="Layout of the patches saved by --store_extracted_patches_as_hd5. 'group' saves "
+            "one group per label and patch size. 'tensor' saves one (N, S, S, 3) dataset per "
+            "patch size with coords, label and slide arrays, for data loaders to slice, and "
+            "the HD5 file in hd5_location points to the row of each patch.")
+    parser_directory.add_argument("--hd5_memmap", action='store_true',
+            help="Whether to store the patches of --hd5_layout tensor uncompressed and "
+            "contiguously so that they can be memory-mapped. Ignores --hd5_compression.")
+    parser_directory.add_argument("--store_extracted_patches_as_tar", action='store_true',
+            help="Whether or not save extracted patches into tar shards in patch_location, "
+            "named <slide_name>-<shard>.tar, with a sidecar index <slide_name>-index.jsonl "
+            "giving the shard, offset, label and coordinate of each patch. Patches are "
+            "encoded with --patch_format. Ignored if --store_extracted_patches or "
+            "--store_extracted_patches_as_hd5 is set.")
+    parser_directory.add_argument("--tar_shard_size", type=positive_int,
+            default=default_tar_shard_size,
+            help="Size in MB above which a new tar shard is started.")
     parser_directory.add_argument("--slide_idx", type=positive_int,
             help="Positive Index for selecting part of slides instead of all of it. "
             "(useful for array jobs)")
@@ -122,6 +266,7 @@ def create_parser(parser):
         Coordinates are a list of size 2 lists of numbers representing the x, y pixel coordinates.
         The [x, y] list represents the coordinates of the top left corner of the patch_size * patch_size extracted patch.
         Coordinates are indexed by slide name for the slide the patches are from, and annotation the patches are labeled with.
+        Patches are saved as files unless --store_extracted_patches_as_hd5 or --store_extracted_patches_as_tar is set.
 
         {
             patch_size: int,
@@ -141,6 +286,12 @@ def create_parser(parser):
         parser_coords_grp = parser_coords.add_argument_group("required arguments")
         parser_coords_grp.add_argument("--slide_coords_location", type=file_path, required=True,
                 help="Path to slide coords JSON file.")
+        parser_coords.add_argument("--is_tumor", action='store_true',
+                help="Only extract tumor patches. Default extracts patches of every label.")
+        parser_coords.add_argument("--read_run_length", type=positive_int,
+                default=default_read_run_length,
+                help="Maximum number of adjacent patches on a row of the slide that are read "
+                "with one read_region call and sliced into patches.")
 
         help_annotation = """Specify patches to extract by annotation.
         If a slide is named 'VOA-1823A' then the annotation file for that slide is a text file named 'VOA-1823A.txt' with each line containing (i.e.):
@@ -222,6 +373,14 @@ def create_parser(parser):
                 help="Patch size in pixels to calculate clusters based on that. "
                 "This should be at lower resolution (e.g. 5x) since it has more "
                 "contexual information.")
+        parser_mosaic.add_argument("--evaluation_read", type=str,
+                default=default_evaluation_read, choices=EVALUATION_READS,
+                help="How to read the tiles used to compute the colour clusters. "
+                "'full' reads each tile at full resolution and resizes it to evaluation_size. "
+                "'level' reads each tile from the closest pyramid level of the slide. "
+                "'grid' reads the whole slide once at the evaluation resolution and cuts it into tiles. "
+                "With 'level' and 'grid', background is detected on the evaluation tiles and only "
+                "the selected patches are read at full resolution.")
         parser_mosaic.add_argument("--n_clusters", type=positive_int,
                 default=9,
                 help="Number of color clusters. This value should "
@@ -229,6 +388,20 @@ def create_parser(parser):
         parser_mosaic.add_argument("--percentage", type=float_less_one,
                 default=0.05,
                 help="Percentage of patches to build the mosaic.")
+        parser_mosaic.add_argument("--clustering", type=str,
+                default=default_clustering, choices=CLUSTERING_ENGINES,
+                help="Clustering engine. 'kmeans' clusters all tiles of a slide at once. "
+                "'minibatch' uses MiniBatchKMeans, fitting the colour clusters on batches "
+                "of tiles while the slide is being read, which is faster and uses less "
+                "memory on large slides.")
+        parser_mosaic.add_argument("--mosaic_features", type=str,
+                default=default_mosaic_features, choices=MOSAIC_FEATURES,
+                help="Features of the evaluation tiles that are clustered. 'rgb' is the "
+                "768 bin RGB histogram. 'hsv' is a 128 bin joint HSV histogram "
+                "(8 hue, 4 saturation and 4 value bins).")
+        parser_mosaic.add_argument("--clustering_batch_size", type=positive_int,
+                default=default_clustering_batch_size,
+                help="Number of tiles per batch used by the 'minibatch' clustering engine.")
         parser_mosaic.add_argument("--stride", type=int,
                 default=0,
                 help="Stride in pixels which determines the gap between each two extracted patches."
@@ -251,3 +424,28 @@ def create_parser(parser):
                 help="From each selected coordinate, all its neighbours will be extracted. "
                 "This number will be multiplied by the patch size."
                 "Note: In use-annotation, the number will be multiplied*stride.")
+            subparser.add_argument("--plan", action='store_true',
+                help="Only plan which patches to extract. Patches are checked for background "
+                "at a low resolution pyramid level and no patches are saved. The selected "
+                "coordinates are saved to slide_coords_location, and the number of patches "
+                "of each slide and label to a _counts.json file next to it. The background score "
+                "of each planned patch is saved in the scores group of a file per slide in a "
+                "_scores directory next to it. Patches can then "
+                "be extracted with use-slide-coords.")
+            subparser.add_argument("--plan_downsample", type=float,
+                default=default_plan_downsample,
+                help="Downsample of the pyramid level used to check for background when "
+                "--plan is set.")
+            subparser.add_argument("--tissue_detection", type=str,
+                default=default_tissue_detection, choices=TISSUE_DETECTIONS,
+                help="Detect tissue on a thumbnail of each slide without a tissue mask, and "
+                "only read tiles that contain tissue at full resolution. otsu thresholds the "
+                "saturation of the thumbnail with Otsu's method, luminance keeps the pixels "
+                "that are not blank by the luminance check. none reads every tile.")
+            subparser.add_argument("--detection_downsample", type=float,
+                default=default_detection_downsample,
+                help="Downsample of the thumbnail tissue is detected on.")
+            subparser.add_argument("--detection_threshold", type=float,
+                default=default_detection_threshold,
+                help="Minimum fraction of tissue pixels of the thumbnail for a tile to be read. "
+                "Kept low so that tiles at the edge of tissue are still read.")
@@ -0,0 +1,205 @@
+"""Overlap reading, resizing and writing the patches of one slide inside a worker process.
+"""
+import time
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+default_read_queue_depth = 16
+default_write_queue_depth = 32
+default_resize_threads = 1
+PIPELINE_STAGES = ['read', 'read_wait', 'resize', 'write', 'write_wait']
+
+
+class PatchPipeline(object):
+    """Reads, resizes and writes the patches of one slide on threads connected by bounded queues.
+
+    The stages are:
+     1. read: a reader thread reads the tiles of coords in order and checks their luminance, at most read_queue_depth tiles ahead of the calling thread.
+     2. select: the calling thread takes the tiles in order through read, which is used in place of SlideReader.read, and decides which patches to extract exactly as without the pipeline.
+     3. resize: resize_threads threads resize the submitted patches.
+     4. write: a writer thread stores the resized patches in the order they were submitted, at most write_queue_depth patches behind the calling thread.
+
+    OpenSlide decoding, PIL resizing and file writes release the GIL, so the stages overlap. The patches that are extracted and the order they are written in are the same as without the pipeline.
+
+    Attributes
+    ----------
+    slide_reader : SlideReader
+        Reader of the slide. Tiles read through the pipeline are added to its cache and counted as its reads.
+
+    store : callable
+        Called by the writer thread with the label, dict of resized patches by size, x, y and dict of patch paths by size of each submitted patch.
+
+    resize_sizes : list of int
+        Sizes to resize patches to.
+
+    times : dict of str: float
+        Seconds spent in each stage. read_wait and write_wait are the seconds the calling thread waited for the reader thread and for room in the write queue.
+
+    counts : dict of str: int
+        Number of tiles read ahead, tiles taken by the calling thread, and patches resized and written.
+    """
+    def __init__(self, slide_reader, store, resize_sizes,
+            read_queue_depth=default_read_queue_depth,
+            write_queue_depth=default_write_queue_depth,
+            resize_threads=default_resize_threads):
+        self.slide_reader = slide_reader
+        self.store = store
+        self.resize_sizes = resize_sizes
+        self.read_queue = queue.Queue(maxsize=max(read_queue_depth, 1))
+        self.write_queue = queue.Queue(maxsize=max(write_queue_depth, 1))
+        self.resize_executor = ThreadPoolExecutor(resize_threads) if resize_threads > 0 else None
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.next_tile = None
+        self.reader_done = False
+        self.error = None
+        self.reader_thread = None
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    @property
+    def resizer(self):
+        return self.slide_reader.resizer
+
+    def start(self, coords):
+        """Start reading the tiles of coords in order.
+        """
+        self.reader_thread = threading.Thread(target=self.read_loop, args=(list(coords),),
+                daemon=True)
+        self.reader_thread.start()
+
+    def put(self, q, item):
+        """Put an item on a queue, unless the pipeline is stopped while waiting for room.
+        """
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_loop(self, coords):
+        try:
+            for x, y in coords:
+                if self.stop.is_set():
+                    break
+                start = time.perf_counter()
+                tile = self.slide_reader.read_tile(x, y)
+                self.times['read'] += time.perf_counter() - start
+                self.counts['read'] += 1
+                if not self.put(self.read_queue, ((x, y), tile)):
+                    break
+        except Exception:
+            """Tiles that could not be read ahead are read by the calling thread, which raises the error"""
+            pass
+        self.put(self.read_queue, None)
+
+    def read(self, x, y):
+        """Read a patch and check its luminance, like SlideReader.read.
+
+        The tile read ahead is used if it is the tile at x, y. Otherwise the tile is read by the slide reader.
+        """
+        key = (x, y)
+        if key in self.slide_reader.cache:
+            return self.slide_reader.read(x, y)
+        if self.next_tile is None and not self.reader_done and self.reader_thread is not None:
+            start = time.perf_counter()
+            self.next_tile = self.read_queue.get()
+            self.times['read_wait'] += time.perf_counter() - start
+            if self.next_tile is None:
+                self.reader_done = True
+        if self.next_tile is not None and self.next_tile[0] == key:
+            patch, check = self.next_tile[1]
+            self.next_tile = None
+            self.counts['taken'] += 1
+            self.slide_reader.read_count += 1
+            self.slide_reader.add_to_cache(key, patch, check)
+            return patch, check
+        return self.slide_reader.read(x, y)
+
+    def resize(self, patch, x, y):
+        start = time.perf_counter()
+        resized_patches = self.resizer.resize(patch, x, y, self.resize_sizes)
+        with self.lock:
+            self.times['resize'] += time.perf_counter() - start
+            self.counts['resize'] += 1
+        return resized_patches
+
+    def submit(self, label, patch, x, y, patch_paths):
+        """Resize and store an extracted patch on the pipeline threads.
+
+        Parameters
+        ----------
+        label : str
+            Label of the patch.
+
+        patch : PIL.Image
+            The extracted patch.
+
+        x, y : int
+            Coordinate of top left corner of the patch.
+
+        patch_paths : dict of int: str
+            Path of the patch at each resize size.
+        """
+        if self.error is not None:
+            raise self.error
+        if self.resize_executor is None:
+            resized_patches = None
+        else:
+            resized_patches = self.resize_executor.submit(self.resize, patch, x, y)
+        start = time.perf_counter()
+        self.put(self.write_queue, (label, patch, resized_patches, x, y, patch_paths))
+        self.times['write_wait'] += time.perf_counter() - start
+
+    def write_loop(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                """Drain the queue so the calling thread does not block"""
+                continue
+            label, patch, resized_patches, x, y, patch_paths = item
+            try:
+                if resized_patches is None:
+                    resized_patches = self.resize(patch, x, y)
+                else:
+                    resized_patches = resized_patches.result()
+                start = time.perf_counter()
+                self.store(label, resized_patches, x, y, patch_paths)
+                self.times['write'] += time.perf_counter() - start
+                self.counts['write'] += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Stop reading ahead, wait for submitted patches to be stored and stop the threads.
+
+        Errors raised while storing patches are raised here.
+        """
+        self.stop.set()
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+        self.write_queue.put(None)
+        self.writer_thread.join()
+        if self.resize_executor is not None:
+            self.resize_executor.shutdown()
+        if self.error is not None:
+            raise self.error
+
+    def summary(self):
+        stages = ", ".join(f"{stage} {self.times[stage]:.1f}s" for stage in PIPELINE_STAGES)
+        return (f"{self.slide_reader.summary()}; pipeline {stages}, "
+                f"{self.counts['taken']}/{self.counts['read']} tiles read ahead were used")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
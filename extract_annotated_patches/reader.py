@@ -0,0 +1,409 @@
+"""Read patches from a slide.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import submodule_utils as utils
+import submodule_utils.image.preprocess as preprocess
+
+from extract_annotated_patches.resizing import PatchResizer, default_resize_method
+from extract_annotated_patches.mosaic import get_evaluation_level, read_evaluation_tile
+from extract_annotated_patches.labelling import BackgroundScorer
+
+default_plan_downsample = 16
+default_read_run_length = 8
+default_block_size = 1
+default_cache_blocks = 4
+
+
+def group_row_runs(coords, patch_size, max_run_length=default_read_run_length):
+    """Sort coordinates in tile order, row by row, and group the coordinates of each row that are at most patch_size apart into runs read with one read_region call.
+
+    Parameters
+    ----------
+    coords : iterable of tuple
+        The x, y coordinates of patches.
+
+    patch_size : int
+        Width and height of patches in pixels.
+
+    max_run_length : int
+        Maximum number of patches in a run.
+
+    Returns
+    -------
+    list of list of tuple
+        The coordinates of each run, in tile order.
+    """
+    runs = []
+    for x, y in sorted(set(coords), key=lambda coord: (coord[1], coord[0])):
+        run = runs[-1] if runs else None
+        if run and run[-1][1] == y and x - run[-1][0] <= patch_size \
+                and len(run) < max_run_length:
+            run.append((x, y))
+        else:
+            runs.append([(x, y)])
+    return runs
+
+
+def group_blocks(coords, patch_size, block_size=default_block_size):
+    """Sort coordinates in tile order, block by block, and group the coordinates of each block of block_size x block_size patches into a group read with one read_region call.
+
+    Blocks are the squares of block_size * patch_size pixels that tile the slide from its top left corner, in row order. Coordinates of each block are in tile order.
+
+    Returns
+    -------
+    list of list of tuple
+        The coordinates of each block, in block order.
+    """
+    span = block_size * patch_size
+    groups = []
+    previous_key = None
+    for x, y in sorted(set(coords), key=lambda coord: (coord[1] // span, coord[0] // span,
+            coord[1], coord[0])):
+        key = (y // span, x // span)
+        if key != previous_key:
+            groups.append([])
+            previous_key = key
+        groups[-1].append((x, y))
+    return groups
+
+
+def read_block(os_slide, coords, patch_size):
+    """Read the region covering the patches of a run or block with one read_region call at level 0.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (H, W, 3) of the RGB region.
+
+    tuple of int
+        The x, y coordinate of the top left corner of the region.
+    """
+    xs = [x for x, _ in coords]
+    ys = [y for _, y in coords]
+    x0, y0 = min(xs), min(ys)
+    size = (max(xs) - x0 + patch_size, max(ys) - y0 + patch_size)
+    return np.asarray(os_slide.read_region((x0, y0), 0, size).convert('RGB')), (x0, y0)
+
+
+def iter_block_patches(region, origin, coords, patch_size):
+    """Slice the patches of coords from a region read by read_block.
+
+    Yields
+    ------
+    tuple of int
+        The x, y coordinate of the patch.
+
+    np.ndarray
+        View of shape (patch_size, patch_size, 3) of the RGB patch in the region. No pixels are copied.
+    """
+    x0, y0 = origin
+    for x, y in coords:
+        yield (x, y), region[y - y0:y - y0 + patch_size, x - x0:x - x0 + patch_size]
+
+
+def read_row_run(os_slide, run, patch_size):
+    """Read the patches of a run from group_row_runs with one read_region call at level 0.
+
+    Returns
+    -------
+    list of tuple
+        The x, y coordinate and the RGB PIL.Image of each patch of the run.
+    """
+    region, origin = read_block(os_slide, run, patch_size)
+    return [(coord, Image.fromarray(np.ascontiguousarray(patch)))
+            for coord, patch in iter_block_patches(region, origin, run, patch_size)]
+
+
+class SlideReader(object):
+    """Reads patches of one slide and checks whether they are background.
+
+    The most recently read patches are kept in a small cache so that a patch read to check for background is not read again from the slide when it is saved.
+
+    Attributes
+    ----------
+    os_slide : OpenSlide or PIL.Image
+        Slide to read patches from.
+
+    patch_size : int
+        Width and height of patches in pixels.
+
+    is_TMA : bool
+        Whether the slide is a TMA core image instead of a slide.
+
+    cache_size : int
+        Number of patches to keep in the cache.
+
+    resizer : PatchResizer
+        Resizes patches read by the reader to the output sizes.
+
+    scorer : BackgroundScorer
+        Checks whether patches are background.
+
+    scores : dict of tuple: float
+        Fraction of pixels that are not blank of each patch read, by x, y coordinate.
+
+    read_count : int
+        Number of patches read from the slide.
+
+    cache_hits : int
+        Number of patches taken from the cache instead of read from the slide.
+
+    read_time : float
+        Seconds spent reading patches from the slide and checking their luminance.
+
+    lock : threading.Lock
+        Guards the cache, scores and read_time, which the reader thread of a PatchPipeline updates too.
+    """
+    def __init__(self, os_slide, patch_size, is_TMA=False, cache_size=1,
+            resize_method=default_resize_method, scorer=None):
+        self.os_slide = os_slide
+        self.patch_size = patch_size
+        self.is_TMA = is_TMA
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.scorer = BackgroundScorer() if scorer is None else scorer
+        self.scores = {}
+        self.read_count = 0
+        self.cache_hits = 0
+        self.read_time = 0.
+        self.lock = threading.Lock()
+        self.resizer = PatchResizer(os_slide, patch_size,
+                method='cascade' if is_TMA and resize_method == 'pyramid' else resize_method)
+
+    def read(self, x, y):
+        """Read a patch and check its luminance.
+
+        Parameters
+        ----------
+        x, y : int
+            Coordinate of top left corner of the patch.
+
+        Returns
+        -------
+        PIL.Image
+            The patch.
+
+        bool
+            Whether the patch passes the luminance check i.e. it is not background.
+        """
+        key = (x, y)
+        with self.lock:
+            if key in self.cache:
+                self.cache_hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        patch, check = self.read_tile(x, y)
+        self.read_count += 1
+        self.add_to_cache(key, patch, check)
+        return patch, check
+
+    def read_tile(self, x, y):
+        """Read a patch from the slide and check its luminance, without using the cache or counting the read.
+
+        Safe to call from another thread than the one calling read.
+        """
+        start = time.perf_counter()
+        patch = preprocess.extract(self.os_slide, x, y, self.patch_size, is_TMA=self.is_TMA)
+        ndpatch = utils.image.preprocess.pillow_image_to_ndarray(patch)
+        check, score = self.scorer.score(ndpatch)
+        self.record_read(x, y, float(score[0]), time.perf_counter() - start)
+        return patch, bool(check[0])
+
+    def record_read(self, x, y, score, seconds):
+        """Record the score of a patch read by read_tile and the seconds it took.
+        """
+        with self.lock:
+            self.scores[(x, y)] = score
+            self.read_time += seconds
+
+    def add_to_cache(self, key, patch, check):
+        if self.cache_size > 0:
+            with self.lock:
+                self.cache[key] = (patch, check)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def summary(self):
+        summary = f"{self.read_count} read_region calls, {self.cache_hits} cache hits"
+        if self.resizer.counts:
+            summary += f", resized {self.resizer.summary()}"
+        return summary
+
+
+class BlockSlideReader(SlideReader):
+    """Reads patches of one slide from blocks of block_size x block_size tiles, each read with one read_region call.
+
+    Blocks tile the grid of tiles spaced step pixels apart from the top left corner of the slide, and are cut at the right and bottom edges of the slide. When a patch is read, the block containing it is read and kept as an RGB array, and its luminance is converted once into a tissue mask from which every patch of the block is scored. Patches are sliced from the array without decoding the slide again, and only copied to be returned as PIL images. Patches that do not lie fully inside their block, such as patches off the grid or beyond the edge of the slide, are read on their own as by SlideReader.
+
+    Blocks pay off when patches are read block by block, see TileGrid.from_slide. The most recently used blocks are kept, so radius neighbours and patches read again are taken from blocks too.
+
+    Attributes
+    ----------
+    block_size : int
+        Width and height of blocks in tiles.
+
+    step : int
+        Distance in pixels between the top left corners of neighbouring tiles.
+
+    cache_blocks : int
+        Number of blocks to keep.
+
+    block_reads : int
+        Number of blocks read from the slide.
+
+    direct_reads : int
+        Number of patches read on their own.
+    """
+    def __init__(self, os_slide, patch_size, block_size, step=None, cache_blocks=default_cache_blocks,
+            cache_size=1, resize_method=default_resize_method, scorer=None):
+        super().__init__(os_slide, patch_size, cache_size=cache_size,
+                resize_method=resize_method, scorer=scorer)
+        self.block_size = block_size
+        self.step = patch_size if step is None else step
+        self.cache_blocks = max(cache_blocks, 1)
+        self.blocks = OrderedDict()
+        self.block_reads = 0
+        self.direct_reads = 0
+
+    def get_block(self, x, y):
+        """Get the block containing the patch at x, y, reading it if it is not kept.
+
+        Returns
+        -------
+        tuple
+            The RGB array of the block, the x, y of its top left corner and its tissue mask from BackgroundScorer.get_tissue_mask, or None if the patch does not lie fully inside the block.
+        """
+        span = self.block_size * self.step
+        x0, y0 = x // span * span, y // span * span
+        width, height = self.os_slide.dimensions
+        size = (min((self.block_size - 1) * self.step + self.patch_size, width - x0),
+                min((self.block_size - 1) * self.step + self.patch_size, height - y0))
+        if x < 0 or y < 0 or x + self.patch_size > x0 + size[0] \
+                or y + self.patch_size > y0 + size[1]:
+            return None
+        key = (x0, y0)
+        with self.lock:
+            if key in self.blocks:
+                self.blocks.move_to_end(key)
+                return self.blocks[key]
+        """Read the block without holding the lock, so the pipeline reading ahead and the thread extracting patches read blocks at the same time"""
+        region = np.asarray(self.os_slide.read_region((x0, y0), 0, size).convert('RGB'))
+        block = (region, (x0, y0), self.scorer.get_tissue_mask(region))
+        with self.lock:
+            if key in self.blocks:
+                """Another thread read the same block meanwhile"""
+                self.blocks.move_to_end(key)
+                return self.blocks[key]
+            self.blocks[key] = block
+            self.block_reads += 1
+            if len(self.blocks) > self.cache_blocks:
+                self.blocks.popitem(last=False)
+            return block
+
+    def read_tile(self, x, y):
+        """Read a patch from its block and check its luminance, without using the patch cache or counting the read.
+
+        Safe to call from another thread than the one calling read.
+        """
+        start = time.perf_counter()
+        block = self.get_block(x, y)
+        if block is None:
+            with self.lock:
+                self.direct_reads += 1
+            return super().read_tile(x, y)
+        region, origin, mask = block
+        check, score = self.scorer.score_mask(mask, [(x - origin[0], y - origin[1])],
+                self.patch_size)
+        (_, patch), = iter_block_patches(region, origin, [(x, y)], self.patch_size)
+        patch = Image.fromarray(np.ascontiguousarray(patch))
+        self.record_read(x, y, float(score[0]), time.perf_counter() - start)
+        return patch, bool(check[0])
+
+    def summary(self):
+        summary = (f"{self.read_count} patches read from {self.block_reads} blocks of "
+                f"{self.block_size}x{self.block_size} tiles and {self.direct_reads} read_region "
+                f"calls, {self.cache_hits} cache hits")
+        if self.resizer.counts:
+            summary += f", resized {self.resizer.summary()}"
+        return summary
+
+
+class PlanningReader(object):
+    """Checks whether patches of one slide are background at a low resolution pyramid level.
+
+    Patches are never read at full resolution, so planning which patches to extract takes seconds per slide. The luminance check is done on the low resolution tile, so it can differ from the full resolution check for tiles at the edge of tissue.
+
+    Attributes
+    ----------
+    os_slide : OpenSlide or PIL.Image
+        Slide to read patches from.
+
+    patch_size : int
+        Width and height of patches in pixels at level 0.
+
+    downsample : float
+        Downsample of the level to check tiles at. The closest level that is not coarser is used.
+
+    is_TMA : bool
+        Whether the slide is a TMA core image instead of a slide. TMA images are not pyramids so tiles are checked at full resolution.
+
+    scorer : BackgroundScorer
+        Checks whether tiles are background.
+
+    scores : dict of tuple: float
+        Fraction of pixels that are not blank of each tile checked, by x, y coordinate.
+
+    read_count : int
+        Number of tiles read from the slide.
+
+    read_time : float
+        Seconds spent reading tiles and checking their luminance.
+    """
+    def __init__(self, os_slide, patch_size, downsample=default_plan_downsample, is_TMA=False,
+            scorer=None):
+        self.os_slide = os_slide
+        self.patch_size = patch_size
+        self.is_TMA = is_TMA
+        self.scorer = BackgroundScorer() if scorer is None else scorer
+        self.scores = {}
+        self.read_count = 0
+        self.read_time = 0.
+        if not is_TMA:
+            self.level, level_downsample = get_evaluation_level(os_slide, downsample)
+            self.level_size = int(math.ceil(patch_size / level_downsample))
+
+    def read(self, x, y):
+        """Check the luminance of a patch.
+
+        Returns
+        -------
+        None
+            Patches are not read.
+
+        bool
+            Whether the patch passes the luminance check i.e. it is not background.
+        """
+        start = time.perf_counter()
+        if self.is_TMA:
+            tile = preprocess.extract(self.os_slide, x, y, self.patch_size, is_TMA=True)
+        else:
+            tile = read_evaluation_tile(self.os_slide, x, y, self.patch_size,
+                    self.level_size, self.level)
+        self.read_count += 1
+        ndtile = utils.image.preprocess.pillow_image_to_ndarray(tile)
+        check, score = self.scorer.score(ndtile)
+        self.scores[(x, y)] = float(score[0])
+        self.read_time += time.perf_counter() - start
+        return None, bool(check[0])
+
+    def summary(self):
+        if self.is_TMA:
+            return f"{self.read_count} tiles checked at full resolution"
+        return f"{self.read_count} tiles checked at level {self.level}"
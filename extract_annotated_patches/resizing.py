@@ -0,0 +1,148 @@
+"""Produce the patches of every size in resize_sizes from an extracted patch.
+"""
+import time
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+import submodule_utils.image.preprocess as preprocess
+
+RESIZE_METHODS = ['independent', 'cascade', 'pyramid']
+default_resize_method = 'independent'
+default_resize_tolerance = 2.0
+
+
+def get_pyramid_levels(os_slide, patch_size, sizes, tolerance=0.01):
+    """Find the pyramid levels of a slide whose downsample matches the downsample of a size.
+
+    Parameters
+    ----------
+    os_slide : OpenSlide
+        Slide to read from.
+
+    patch_size : int
+        Size of patches at level 0.
+
+    sizes : list of int
+        Sizes to find levels for.
+
+    tolerance : float
+        Maximum relative difference between the downsample of a level and patch_size / size.
+
+    Returns
+    -------
+    dict of int: int
+        The level to read each size from. Sizes without a matching level are left out.
+    """
+    levels = {}
+    for size in sizes:
+        if size >= patch_size:
+            continue
+        downsample = patch_size / size
+        for level, level_downsample in enumerate(os_slide.level_downsamples):
+            if level > 0 and abs(level_downsample - downsample) <= tolerance * downsample:
+                levels[size] = level
+                break
+    return levels
+
+
+class PatchResizer(object):
+    """Resizes a patch to every size in resize_sizes.
+
+    How sizes smaller than patch_size are produced depends on method:
+     - independent: resize the patch to each size.
+     - cascade: resize the patch to the largest size, then each size from the next larger one, so each resample works on a smaller image.
+     - pyramid: read sizes matching a pyramid level of the slide directly from that level, and cascade the others.
+
+    Attributes
+    ----------
+    os_slide : OpenSlide
+        Slide the patches are read from. Only used by pyramid.
+
+    patch_size : int
+        Size of the patches to resize.
+
+    method : str
+        One of 'independent', 'cascade' or 'pyramid'.
+
+    times : dict of int: float
+        Total seconds spent producing each size.
+
+    counts : dict of int: int
+        Number of patches produced for each size.
+    """
+    def __init__(self, os_slide, patch_size, method=default_resize_method):
+        if method not in RESIZE_METHODS:
+            raise NotImplementedError(f"Resize method {method} not implemented")
+        self.os_slide = os_slide
+        self.patch_size = patch_size
+        self.method = method
+        self.levels = {}
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        """Patches may be resized on several threads by PatchPipeline"""
+        self.lock = threading.Lock()
+
+    def get_level(self, size):
+        if self.method != 'pyramid' or not hasattr(self.os_slide, 'level_downsamples'):
+            """TMA images are not pyramids"""
+            return None
+        if size not in self.levels:
+            self.levels[size] = get_pyramid_levels(self.os_slide, self.patch_size,
+                    [size]).get(size)
+        return self.levels[size]
+
+    def resize(self, patch, x, y, sizes):
+        """Get the patch at each size.
+
+        Parameters
+        ----------
+        patch : PIL.Image
+            Patch of size patch_size read at x, y.
+
+        x, y : int
+            Coordinate of top left corner of the patch at level 0.
+
+        sizes : list of int
+            Sizes to produce.
+
+        Returns
+        -------
+        dict of int: PIL.Image
+            The patch at each size.
+        """
+        resized = {}
+        times = {}
+        previous = patch
+        for size in sorted(set(sizes), reverse=True):
+            start = time.perf_counter()
+            level = self.get_level(size)
+            if size == self.patch_size:
+                resized[size] = patch
+            elif level is not None:
+                resized[size] = self.os_slide.read_region((x, y), level,
+                        (size, size)).convert('RGB')
+            elif self.method == 'independent':
+                resized[size] = preprocess.resize(patch, size)
+            else:
+                resized[size] = preprocess.resize(previous, size)
+            previous = resized[size]
+            times[size] = time.perf_counter() - start
+        with self.lock:
+            for size, size_time in times.items():
+                self.times[size] += size_time
+                self.counts[size] += 1
+        return resized
+
+    def summary(self):
+        return ", ".join(f"{size}px: {self.counts[size] / max(self.times[size], 1e-9):.0f} patches/s"
+                for size in sorted(self.counts, reverse=True))
+
+
+def resize_difference(reference, resized):
+    """Get the mean absolute difference between two patches in pixel values.
+    """
+    reference = np.asarray(reference, dtype=np.float64)[..., :3]
+    resized = np.asarray(resized, dtype=np.float64)[..., :3]
+    return float(np.abs(reference - resized).mean())
@@ -0,0 +1,210 @@
+"""Schedule extraction of slides over a persistent pool of worker processes.
+"""
+import os
+import logging
+import multiprocessing as mp
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger('extract_annotated_patches')
+
+START_METHODS = ['fork', 'spawn', 'forkserver']
+
+_extractor = None
+
+
+class SlideTask(namedtuple('SlideTask', ['idx', 'method_name', 'args'])):
+    """Extraction of one slide sent to a worker process.
+
+    Only the index of the slide, the name of the extractor method and its arguments are sent per slide. The extractor itself is sent to each worker once when the worker starts.
+
+    Attributes
+    ----------
+    idx : int
+        Index of the arguments in the list of arguments of the run.
+
+    method_name : str
+        Name of the extractor method to call.
+
+    args : tuple
+        Arguments of the method. The first argument is the slide path.
+    """
+    __slots__ = ()
+
+
+def _init_worker(extractor):
+    """Set the extractor used by every task run in this worker process.
+    """
+    global _extractor
+    _extractor = extractor
+
+
+def _run_task(task):
+    try:
+        return task.idx, getattr(_extractor, task.method_name)(*task.args), True
+    except Exception:
+        logger.exception(f"Could not extract patches from {task.args[0]}")
+        return task.idx, None, False
+
+
+def _run_shard(task):
+    method_name, slide_path, items, args = task
+    return getattr(_extractor, method_name)(slide_path, items, *args)
+
+
+def shard_indices(coords, n_shards):
+    """Split coordinates into spatially contiguous shards.
+
+    Coordinates are sorted row by row and cut into n_shards bands of equal size, so each worker reads a compact region of the slide.
+
+    Parameters
+    ----------
+    coords : list of tuple
+        The x, y coordinates to split.
+
+    n_shards : int
+        Maximum number of shards.
+
+    Returns
+    -------
+    list of np.ndarray
+        The indices of coords in each non-empty shard.
+    """
+    coords = np.asarray(coords).reshape(-1, 2)
+    order = np.lexsort((coords[:, 0], coords[:, 1]))
+    return [idx for idx in np.array_split(order, n_shards) if len(idx) > 0]
+
+
+def slide_cost(slide_path):
+    """Estimate how long a slide takes to extract using the size of the slide file.
+
+    Reading file sizes does not open the slide, so the estimate is cheap even for large cohorts.
+    """
+    try:
+        return os.path.getsize(slide_path)
+    except OSError:
+        return 0
+
+
+class SlidePool(object):
+    """Pool of worker processes that extract one slide per task.
+
+    Workers stay alive for the whole run and pick up the next slide as soon as they are done, largest slides first, so one large slide does not stall the other workers.
+
+    Attributes
+    ----------
+    extractor : AnnotatedPatchesExtractor
+        Extractor whose method is called for each slide. It is sent to each worker once when the worker starts.
+
+    n_process : int
+        Number of worker processes.
+
+    start_method : str
+        Method used to start worker processes, one of 'fork', 'spawn' or 'forkserver'. Default is the default of the platform.
+    """
+    def __init__(self, extractor, n_process, start_method=None):
+        self.extractor = extractor
+        self.n_process = n_process
+        self.start_method = start_method
+
+    def imap_unordered(self, method_name, args_list):
+        """Extract slides and yield the results as the slides finish.
+
+        Parameters
+        ----------
+        method_name : str
+            Name of the extractor method to call for each slide.
+
+        args_list : list of tuple
+            Arguments of each call. The first argument is the slide path.
+
+        Yields
+        ------
+        int
+            Index of the arguments in args_list.
+
+        object
+            Return value of the method, or None if it raised an exception.
+
+        bool
+            Whether the method completed without raising an exception.
+        """
+        tasks = [SlideTask(idx, method_name, args) for idx, args in enumerate(args_list)]
+        if not tasks:
+            return
+        tasks.sort(key=lambda task: slide_cost(task.args[0]), reverse=True)
+        n_process = max(1, min(self.n_process, len(tasks)))
+        context = mp.get_context(self.start_method)
+        with context.Pool(n_process, initializer=_init_worker,
+                initargs=(self.extractor,)) as pool:
+            for result in pool.imap_unordered(_run_task, tasks, chunksize=1):
+                yield result
+
+
+class ShardPool(object):
+    """Pool of worker processes that split the tile grid of one slide into spatial shards.
+
+    Each task opens its own handle on the slide. Results are put back in the order of the items, so they do not depend on the number of shards.
+
+    Attributes
+    ----------
+    n_process : int
+        Number of worker processes.
+
+    shards_per_process : int
+        Number of shards per worker process, so that workers finishing early pick up another shard.
+
+    start_method : str
+        Method used to start worker processes, one of 'fork', 'spawn' or 'forkserver'. Default is the default of the platform.
+    """
+    def __init__(self, extractor, n_process, shards_per_process=4, start_method=None):
+        self.n_process = n_process
+        self.shards_per_process = shards_per_process
+        self.pool = mp.get_context(start_method).Pool(n_process, initializer=_init_worker,
+                initargs=(extractor,))
+
+    def map_shards(self, method_name, slide_path, items, coords, *args):
+        """Call an extractor method on the spatial shards of items.
+
+        Parameters
+        ----------
+        method_name : str
+            Name of the extractor method. It is called with slide_path, the items of a shard and args, and returns one result per item.
+
+        slide_path : str
+            Path of slide.
+
+        items : list
+            Items to split into shards.
+
+        coords : list of tuple
+            The x, y coordinate of each item.
+
+        Returns
+        -------
+        list
+            The result of each item, in the order of items.
+        """
+        results = [None] * len(items)
+        if not items:
+            return results
+        shards = shard_indices(coords, self.n_process * self.shards_per_process)
+        tasks = [(method_name, slide_path, [items[i] for i in idx], args) for idx in shards]
+        for idx, shard_results in zip(shards, self.pool.imap(_run_shard, tasks)):
+            for i, result in zip(idx, shard_results):
+                results[i] = result
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
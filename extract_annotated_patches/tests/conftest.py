@@ -11,21 +11,25 @@ from extract_annotated_patches.tests import (
 
 CLEAN_AFTER_RUN=False
 
+def remove_outputs():
+    """Remove the files and directories in the output directory, such as the _slides directory of slide coords files.
+    """
+    for file in os.listdir(OUTPUT_DIR):
+        path = os.path.join(OUTPUT_DIR, file)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
 @pytest.fixture
 def clean_output():
     """Get the directory to save test outputs. Cleans the output directory before and after each test.
     """
-    if os.path.isdir(OUTPUT_PATCH_DIR):
-        shutil.rmtree(OUTPUT_PATCH_DIR)
-    for file in os.listdir(OUTPUT_DIR):
-        os.unlink(os.path.join(OUTPUT_DIR, file))
+    remove_outputs()
     os.mkdir(OUTPUT_PATCH_DIR)
     yield None
     if CLEAN_AFTER_RUN:
-        if os.path.isdir(OUTPUT_PATCH_DIR):
-            shutil.rmtree(OUTPUT_PATCH_DIR)
-        for file in os.listdir(OUTPUT_DIR):
-            os.unlink(os.path.join(OUTPUT_DIR, file))
+        remove_outputs()
 
 @pytest.fixture(scope='module')
 def annotated_slide_names():
@@ -1,6 +1,7 @@
 import os
 import shutil
 import pytest
+import h5py
 from PIL import Image
 import numpy as np
 
@@ -226,3 +227,85 @@ def test_from_arguments_use_directory_annotation_3(clean_output, mock_data):
             patch_256 = Image.open(patch_file_256)
             assert patch_512.size == (512, 512,)
             assert patch_256.size == (256, 256,)
+
+
+def test_from_arguments_use_directory_annotation_plan(clean_output, mock_data):
+    """Planning saves the background score of each planned patch next to the slide coords file"""
+    slide_coords_location = os.path.join(OUTPUT_DIR, 'slide_coords.json')
+    args_str = f"""
+    from-arguments
+    --hd5_location {OUTPUT_DIR}
+    use-directory
+    --patch_location {OUTPUT_PATCH_DIR}
+    --slide_location {SLIDE_DIR}
+    use-annotation
+    --annotation_location {ANNOTATION_DIR}
+    --slide_coords_location {slide_coords_location}
+    --patch_size 1024
+    --plan
+    """
+    parser = extract_annotated_patches.parser.create_parser()
+    config = parser.get_args(args_str.split())
+    ape = AnnotatedPatchesExtractor(config)
+    ape.run()
+
+    scm = SlideCoordsMetadata.load(slide_coords_location)
+    for slide_id in mock_data.keys():
+        _, slide_name = slide_id.split('/')
+        scores_path = os.path.join(OUTPUT_DIR, 'slide_coords_scores', f"{slide_name}.h5")
+        assert os.path.isfile(scores_path)
+        with h5py.File(scores_path, 'r') as hf:
+            labels = [label.decode() for label in hf['scores/label'][:]]
+            coords = hf['scores/coords'][:]
+            scores = hf['scores/score'][:]
+        assert len(scores) > 0
+        assert ((scores > 0.25) & (scores <= 1)).all()
+        for label in ['Tumor', 'Stroma']:
+            planned = set(map(tuple, scm.get_slide(slide_name).get_topleft_coords(label)))
+            assert set((x, y) for (x, y), label_ in zip(coords.tolist(), labels)
+                    if label_ == label) == planned
+
+
+def test_from_arguments_use_directory_annotation_resume(clean_output, mock_data, monkeypatch):
+    """A run killed after its first slide is resumed without extracting that slide again, and the slide coords file has the coords of all slides"""
+    slide_coords_location = os.path.join(OUTPUT_DIR, 'slide_coords.json')
+    args_str = f"""
+    from-arguments
+    --hd5_location {OUTPUT_DIR}
+    --num_patch_workers 1
+    --resume
+    use-directory
+    --patch_location {OUTPUT_PATCH_DIR}
+    --slide_location {SLIDE_DIR}
+    use-annotation
+    --annotation_location {ANNOTATION_DIR}
+    --slide_coords_location {slide_coords_location}
+    --patch_size 1024
+    --resize_sizes 256
+    """
+    parser = extract_annotated_patches.parser.create_parser()
+    config = parser.get_args(args_str.split())
+
+    record = ExtractionLedger.record
+    def record_and_kill(ledger, slide_name, fingerprint, outputs):
+        record(ledger, slide_name, fingerprint, outputs)
+        raise KeyboardInterrupt
+    monkeypatch.setattr(ExtractionLedger, 'record', record_and_kill)
+    with pytest.raises(KeyboardInterrupt):
+        AnnotatedPatchesExtractor(config).run()
+    monkeypatch.undo()
+    assert not os.path.isfile(slide_coords_location)
+    ape = AnnotatedPatchesExtractor(config)
+    killed_ledger = ExtractionLedger(ape.ledger_location)
+    assert len(killed_ledger.entries) == 1
+    completed_slide_name = list(killed_ledger.entries)[0]
+    completed_hd5 = os.path.join(OUTPUT_DIR, f"{completed_slide_name}.h5")
+    mtime = os.path.getmtime(completed_hd5)
+
+    ape.run()
+    assert os.path.getmtime(completed_hd5) == mtime
+    scm = SlideCoordsMetadata.load(slide_coords_location)
+    for slide_id in mock_data.keys():
+        _, slide_name = slide_id.split('/')
+        assert scm.has_slide(slide_name)
+    assert len(ExtractionLedger(ape.ledger_location).entries) == len(mock_data)
@@ -0,0 +1,69 @@
+import os
+import pickle
+import numpy as np
+from PIL import Image
+
+from submodule_utils.metadata.annotation import GroovyAnnotation
+from extract_annotated_patches.cache import (
+        LazyLookup, load_annotation, load_raster_tissue_mask, read_annotation_labels)
+from extract_annotated_patches.tests import OUTPUT_DIR, OUTPUT_PATCH_DIR, ANNOTATION_DIR
+
+
+def load_length(slide_name, filepath):
+    return len(filepath)
+
+
+def test_lazy_lookup():
+    lookup = LazyLookup({'VOA-1932A': 'a.png', 'VOA-1002A': 'bb.png'}, load_length)
+    assert 'VOA-1932A' in lookup and 'VOA-3' not in lookup
+    assert sorted(lookup) == ['VOA-1002A', 'VOA-1932A']
+    assert lookup.cache == {}
+    assert lookup['VOA-1002A'] == 6
+    assert lookup.cache == {'VOA-1002A': 6}
+    """Only the slide accessed last is kept"""
+    assert lookup['VOA-1932A'] == 5
+    assert lookup.cache == {'VOA-1932A': 5}
+    """Loaded objects are not sent to worker processes"""
+    assert pickle.loads(pickle.dumps(lookup)).cache == {}
+
+
+def test_load_raster_tissue_mask(clean_output):
+    mask = np.zeros((10, 20), dtype=np.uint8)
+    mask[:, :10] = 255
+    mask_path = os.path.join(OUTPUT_DIR, 'VOA-1932A.png')
+    Image.fromarray(mask).save(mask_path)
+    cache_location = os.path.join(OUTPUT_PATCH_DIR, 'cache')
+    coords = np.array([[0, 0], [10000, 0], [4000, 4000]])
+    expected = load_raster_tissue_mask(mask_path, (20000, 10000)).tiles_to_tissue(coords, 1000)
+    np.testing.assert_array_equal(expected, [True, False, True])
+    for _ in range(2):
+        raster_mask = load_raster_tissue_mask(mask_path, (20000, 10000), cache_location)
+        np.testing.assert_array_equal(raster_mask.tiles_to_tissue(coords, 1000), expected)
+    assert len(os.listdir(os.path.join(cache_location, 'masks'))) == 1
+    """A changed mask is read again"""
+    mask[:] = 0
+    Image.fromarray(mask).save(mask_path)
+    os.utime(mask_path, (0, 1))
+    raster_mask = load_raster_tissue_mask(mask_path, (20000, 10000), cache_location)
+    assert not raster_mask.tiles_to_tissue(coords, 1000).any()
+
+
+def test_load_annotation(clean_output):
+    annotation_path = os.path.join(ANNOTATION_DIR, 'VOA-1932A.txt')
+    cache_location = os.path.join(OUTPUT_PATCH_DIR, 'cache')
+    expected = GroovyAnnotation(annotation_path, 1.0, 1024, False, None)
+    for _ in range(2):
+        annotation = load_annotation(annotation_path, 1.0, 1024, False, None, cache_location)
+        assert sorted(annotation.labels) == sorted(expected.labels)
+        for label in expected.labels:
+            for expected_path, path in zip(expected.paths[label], annotation.paths[label]):
+                np.testing.assert_array_equal(expected_path.vertices, path.vertices)
+    assert len(os.listdir(os.path.join(cache_location, 'annotations'))) == 1
+
+
+def test_read_annotation_labels():
+    annotation_path = os.path.join(ANNOTATION_DIR, 'VOA-1932A.txt')
+    labels = read_annotation_labels(annotation_path)
+    assert sorted(labels) == ['Stroma', 'Tumor']
+    assert sorted(labels) == sorted(GroovyAnnotation(annotation_path, 1.0, 1024, False, None).labels)
+    assert read_annotation_labels(os.path.join(ANNOTATION_DIR, 'VOA-1075A.txt')) == []
@@ -41,8 +41,8 @@ def test_from_arguments_use_directory_slide_coords_1(clean_output, mock_data):
     config = parser.get_args(args_str.split())
     ape = AnnotatedPatchesExtractor(config)
     args = ape.produce_args([slide_path])
-    slide_path, class_size_to_patch_path = args[0]
-    ape.extract_patch_by_slide_coords(slide_path, class_size_to_patch_path)
+    slide_path, class_size_to_patch_path, slide_coords = args[0]
+    ape.extract_patch_by_slide_coords(slide_path, class_size_to_patch_path, slide_coords)
 
     """Setup test data"""
     scm = SlideCoordsMetadata.load(slide_coords_location)
@@ -0,0 +1,45 @@
+import io
+import os
+import pytest
+import numpy as np
+from PIL import Image
+
+from extract_annotated_patches.encoding import PatchEncoder, PatchFileWriter
+from extract_annotated_patches.tests import OUTPUT_PATCH_DIR
+
+
+@pytest.mark.parametrize("patch_format", ['png', 'jpeg', 'webp', 'npy', 'raw'])
+def test_patch_encoder(patch_format):
+    patch = np.zeros((32, 32, 4), dtype=np.uint8)
+    patch[:, :16] = 200
+    encoder = PatchEncoder(patch_format, png_compress_level=1, jpeg_quality=95)
+    data = encoder.encode(patch)
+    if patch_format == 'raw':
+        decoded = np.frombuffer(data, dtype=np.uint8).reshape(32, 32, 3)
+    elif patch_format == 'npy':
+        decoded = np.load(io.BytesIO(data))
+    else:
+        decoded = np.array(Image.open(io.BytesIO(data)))
+    assert decoded.shape == (32, 32, 3)
+    assert np.abs(decoded.astype(int) - patch[:, :, :3]).max() <= (8 if patch_format in ['jpeg', 'webp'] else 0)
+
+
+def test_patch_encoder_unknown_format():
+    with pytest.raises(ValueError):
+        PatchEncoder('tiff')
+
+
+@pytest.mark.parametrize("n_threads", [0, 3])
+def test_patch_file_writer(clean_output, n_threads):
+    encoder = PatchEncoder('png', png_compress_level=1)
+    paths = [os.path.join(OUTPUT_PATCH_DIR, f"{i}_0.png") for i in range(10)]
+    with PatchFileWriter(encoder, n_threads=n_threads, max_pending=2) as writer:
+        for i, path in enumerate(paths):
+            writer.save(Image.new('RGB', (16, 16), (i, i, i)), path)
+            assert len(writer.pending) <= 2
+    assert writer.n_patches == 10
+    assert writer.n_bytes == sum(os.path.getsize(path) for path in paths)
+    for i, path in enumerate(paths):
+        assert (np.array(Image.open(path)) == i).all()
+    assert encoder.get_path(paths[0]) == paths[0]
+    assert PatchEncoder('npy').get_path(paths[0]) == os.path.join(OUTPUT_PATCH_DIR, "0_0.npy")
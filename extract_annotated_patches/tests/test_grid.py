@@ -0,0 +1,108 @@
+import pytest
+import numpy as np
+
+from submodule_utils.image.extract import SlideCoordsExtractor
+from extract_annotated_patches.grid import (CoordinateIndex, TileGrid, get_disk_offsets,
+        get_circular_neighbours, expand_radius)
+
+
+class Slide(object):
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+
+@pytest.mark.parametrize("slide_size,cell_size", [((1000, 600), 100), (None, None)])
+def test_coordinate_index(slide_size, cell_size):
+    index = CoordinateIndex(slide_size, cell_size)
+    coords = [(0, 0), (100, 500), (1000, 600), (50, 100), (-100, 0), (1200, 0)]
+    for x, y in coords:
+        assert not index.contains('Tumor', x, y)
+        index.add('Tumor', x, y)
+        assert index.contains('Tumor', x, y)
+    assert all(index.contains('Tumor', x, y) for x, y in coords)
+    assert not any(index.contains('Stroma', x, y) for x, y in coords)
+    assert not index.contains('Tumor', 200, 500)
+    if slide_size is not None:
+        """Only coordinates on the grid of the slide are kept in the bitmap"""
+        assert index.bitmaps['Tumor'].sum() == 3
+        assert index.sets['Tumor'] == {(50, 100), (-100, 0), (1200, 0)}
+
+
+@pytest.mark.parametrize("patch_overlap,stride,step", [(0.0, 0, 100), (0.5, 0, 50), (0.0, 50, 150)])
+def test_tile_grid(patch_overlap, stride, step):
+    grid = TileGrid.from_slide(Slide((1000, 420)), 100, patch_overlap, stride=stride)
+    assert grid.step == step
+    expected = [(x // step, y // step, x, y) for y in range(0, 321, step)
+            for x in range(0, 901, step)]
+    assert list(map(tuple, grid.tiles.tolist())) == expected
+    np.testing.assert_array_equal(grid.coords, grid.tiles[:, 2:])
+    selected = grid.select(grid.coords[:, 0] < 300)
+    assert len(selected) == sum(x < 300 for _, _, x, _ in expected)
+    assert selected.step == step
+
+
+def test_tile_grid_shuffle():
+    slide = Slide((1000, 1000))
+    grid = TileGrid.from_slide(slide, 100)
+    shuffled = TileGrid.from_slide(slide, 100, shuffle=True, seed=256)
+    assert shuffled.tiles.tolist() != grid.tiles.tolist()
+    assert sorted(shuffled.tiles.tolist()) == sorted(grid.tiles.tolist())
+    np.testing.assert_array_equal(shuffled.tiles,
+            TileGrid.from_slide(slide, 100, shuffle=True, seed=256).tiles)
+
+
+def test_tile_grid_block_order():
+    grid = TileGrid.from_slide(Slide((500, 300)), 100, block_size=2)
+    assert grid.coords[:6].tolist() == [[0, 0], [100, 0], [0, 100], [100, 100], [200, 0], [300, 0]]
+    assert grid.coords[-3:].tolist() == [[200, 200], [300, 200], [400, 200]]
+    assert sorted(grid.tiles.tolist()) == sorted(TileGrid.from_slide(Slide((500, 300)), 100).tiles.tolist())
+    shuffled = TileGrid.from_slide(Slide((500, 300)), 100, shuffle=True, seed=0, block_size=2)
+    np.testing.assert_array_equal(shuffled.tiles,
+            TileGrid.from_slide(Slide((500, 300)), 100, shuffle=True, seed=0).tiles)
+
+
+@pytest.mark.parametrize("patch_overlap,stride", [(0.0, 0), (0.5, 0), (0.0, 50)])
+def test_tile_grid_from_extractor(patch_overlap, stride):
+    """The grid selects the same patches for max_slide_patches as SlideCoordsExtractor"""
+    slide = Slide((1050, 470))
+    for shuffle in [False, True]:
+        expected = [tuple(data) for data in SlideCoordsExtractor(slide, 100, patch_overlap,
+                shuffle=shuffle, seed=256, is_TMA=False, stride=stride)]
+        grid = TileGrid.from_extractor(slide, 100, patch_overlap, stride=stride,
+                shuffle=shuffle, seed=256)
+        assert list(map(tuple, grid.tiles.tolist())) == expected
+        assert grid.coords[:10].tolist() == [[x, y] for _, _, x, y in expected[:10]]
+        assert grid.step == int((1 - patch_overlap) * 100) + stride
+
+
+def test_get_disk_offsets():
+    offsets = get_disk_offsets(1)
+    assert offsets.tolist() == [[0, -1], [-1, 0], [0, 0], [1, 0], [0, 1]]
+    assert len(get_disk_offsets(2)) == 13
+
+
+def test_get_circular_neighbours():
+    neighbours = get_circular_neighbours(1, 0, 100, 100, (1000, 300), 100)
+    assert neighbours.tolist() == [[0, 0], [0, 100], [100, 100], [0, 200]]
+    grid = TileGrid.from_slide(Slide((1000, 300)), 100)
+    np.testing.assert_array_equal(grid.get_neighbours(1, 0, 100), neighbours)
+
+
+@pytest.mark.parametrize("step", [100, 150])
+def test_expand_radius(step):
+    """Neighbours are the same, in the same order, as iterating the neighbourhood of each seed.
+
+    With a step of 150 the seeds are on two grids of the stride of 100.
+    """
+    slide_size = (1000, 800)
+    grid = TileGrid.from_slide(Slide(slide_size), 100, stride=step - 100, shuffle=True, seed=0)
+    seeds = grid.coords[:20]
+    expected = {}
+    for idx, (x, y) in enumerate(seeds.tolist()):
+        for coord in map(tuple, get_circular_neighbours(2, x, y, 100, slide_size, 100).tolist()):
+            expected.setdefault(coord, idx)
+    coords, seed_index = expand_radius(seeds, 2, 100, slide_size, 100)
+    assert list(map(tuple, coords.tolist())) == list(expected)
+    assert seed_index.tolist() == list(expected.values())
+    coords, seed_index = expand_radius(np.zeros((0, 2)), 2, 100, slide_size, 100)
+    assert len(coords) == len(seed_index) == 0
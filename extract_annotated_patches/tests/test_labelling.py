@@ -0,0 +1,168 @@
+import os
+import pytest
+import numpy as np
+from PIL import Image
+
+from submodule_utils.metadata.annotation import GroovyAnnotation
+from submodule_utils.metadata.tissue_mask import TissueMask
+import submodule_utils.image.preprocess as preprocess
+
+from extract_annotated_patches.labelling import (
+        get_tile_corners, annotation_to_labels, RasterTissueMask,
+        otsu_threshold, detect_tissue, DetectedTissueMask, BackgroundScorer)
+from extract_annotated_patches.tests import ANNOTATION_DIR, OUTPUT_DIR
+from extract_annotated_patches.tests.test_reader import PyramidSlide
+
+
+def test_get_tile_corners():
+    corners = get_tile_corners(np.array([[10, 20]]), 5)
+    np.testing.assert_array_equal(corners[0],
+            [[10, 20], [10, 25], [15, 25], [15, 20]])
+
+
+@pytest.mark.parametrize("slide_name", ['VOA-1099A', 'VOA-1932A'])
+def test_annotation_to_labels(slide_name):
+    """Labels of the whole tile grid match points_to_label on each tile.
+    """
+    patch_size = 1024
+    annotation = GroovyAnnotation(os.path.join(ANNOTATION_DIR, f"{slide_name}.txt"))
+    vertices = np.concatenate([path.vertices for paths in annotation.paths.values()
+            for path in paths])
+    x_max, y_max = vertices.max(axis=0).astype(int)
+    xs, ys = np.meshgrid(np.arange(0, x_max, patch_size), np.arange(0, y_max, patch_size))
+    coords = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    labels = annotation_to_labels(annotation, coords, patch_size)
+    assert len(labels) == len(coords)
+    assert any(labels)
+    for (x, y), corners, label in zip(coords, get_tile_corners(coords, patch_size), labels):
+        expected = annotation.points_to_label(corners)
+        assert sorted(expected) == sorted(label)
+
+
+def test_raster_tissue_mask():
+    mask = np.zeros((100, 200), dtype=np.uint8)
+    mask[:50, :100] = 255
+    raster_mask = RasterTissueMask(mask, (20000, 10000), threshold=0.4)
+    coords = np.array([[0, 0], [9900, 0], [9950, 4950], [19000, 9000]])
+    np.testing.assert_allclose(raster_mask.tissue_fraction(coords, 100),
+            [1., 1., 0.25, 0.])
+    np.testing.assert_array_equal(raster_mask.tiles_to_tissue(coords, 100),
+            [True, True, False, False])
+
+
+def test_raster_tissue_mask_png(clean_output):
+    """Tiles with tissue match points_to_label of TissueMask on the same PNG mask.
+    """
+    patch_size = 1024
+    slide_size = (30000, 20000)
+    ys, xs = np.mgrid[:200, :300]
+    distance = np.hypot(xs - 150, ys - 100)
+    """Tissue is a disk whose edge fades out, so some tiles are near the threshold"""
+    mask = np.clip((80 - distance) * 16, 0, 255).astype(np.uint8)
+    mask[20:40, 200:260] = 255
+    mask_path = os.path.join(OUTPUT_DIR, 'VOA-1932A.png')
+    Image.fromarray(mask).save(mask_path)
+    tissue_mask = TissueMask(mask_path, 0.4, patch_size, slide_size)
+    raster_mask = RasterTissueMask.from_png(mask_path, slide_size, threshold=0.4)
+    xs, ys = np.meshgrid(np.arange(0, slide_size[0] - patch_size, 700),
+            np.arange(0, slide_size[1] - patch_size, 700))
+    coords = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    is_tissue = raster_mask.tiles_to_tissue(coords, patch_size)
+    assert is_tissue.any() and not is_tissue.all()
+    expected = [bool(tissue_mask.points_to_label(corners))
+            for corners in get_tile_corners(coords, patch_size)]
+    assert is_tissue.tolist() == expected
+
+
+def test_otsu_threshold():
+    values = np.concatenate([np.full(100, 10), np.full(50, 200)]).astype(np.uint8)
+    threshold = otsu_threshold(values)
+    assert 10 <= threshold < 200
+
+
+@pytest.mark.parametrize("method", ['otsu', 'luminance'])
+def test_detect_tissue(method):
+    """Pink tissue on the left half of a white, slightly noisy slide"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(240, 256, (64, 128, 3)).astype(np.uint8)
+    image[:, :64] = (200, 120, 170)
+    expected = np.zeros((64, 128), dtype=bool)
+    expected[:, :64] = True
+    np.testing.assert_array_equal(detect_tissue(image, method), expected)
+
+
+def test_detect_tissue_blank():
+    """Otsu does not split the noise of a slide without tissue"""
+    rng = np.random.default_rng(0)
+    image = rng.integers(240, 256, (64, 64, 3)).astype(np.uint8)
+    assert not detect_tissue(image, 'otsu').any()
+
+
+def test_detected_tissue_mask():
+    image = np.full((1024, 2048, 3), 255, dtype=np.uint8)
+    image[:, :1024] = (200, 120, 170)
+    slide = PyramidSlide(image)
+    mask = DetectedTissueMask.detect(slide, method='otsu', downsample=16)
+    coords = np.array([(x, y) for y in range(0, 1024, 256) for x in range(0, 2048, 256)])
+    is_tissue = mask.tiles_to_tissue(coords, 256)
+    np.testing.assert_array_equal(is_tissue, coords[:, 0] < 1024)
+    mask.count_grid(is_tissue)
+    assert {level for level, _ in slide.reads} == {2}
+    assert mask.n_tiles == len(coords)
+    assert mask.n_skipped == len(coords) // 2
+    assert "skipped 16 of 32 tiles" in mask.summary(0.1)
+
+
+def test_background_scorer():
+    patches = np.full((3, 16, 16, 3), 255, dtype=np.uint8)
+    patches[1] = 100
+    """A quarter of the pixels are tissue, which is not more than 1 - BLANK_FRACTION"""
+    patches[2, :8, :8] = 100
+    keep, scores = BackgroundScorer().score(patches)
+    np.testing.assert_array_equal(keep, [False, True, False])
+    np.testing.assert_allclose(scores, [0., 1., 0.25])
+    patches[2, :8, :9] = 100
+    assert BackgroundScorer().score(patches[2])[0].tolist() == [True]
+
+    """Striding and chunking give the same scores on patches that are uniform over 4x4 blocks"""
+    rng = np.random.default_rng(0)
+    blocks = rng.integers(0, 256, size=(5, 4, 4, 1), dtype=np.uint8).repeat(3, axis=3)
+    patches = blocks.repeat(4, axis=1).repeat(4, axis=2)
+    keep, scores = BackgroundScorer().score(patches)
+    strided_keep, strided_scores = BackgroundScorer(stride=4, chunk_pixels=16).score(patches)
+    np.testing.assert_array_equal(strided_keep, keep)
+    np.testing.assert_allclose(strided_scores, scores)
+
+
+def test_background_scorer_check_luminance():
+    """Patches kept by the scorer match check_luminance on blank, tissue and near threshold patches.
+    """
+    patches = [np.full((64, 64, 3), value, dtype=np.uint8)
+            for value in [255, 100, 0, 205, 208, 209, 210, 211, 212, 215]]
+    patches.append(np.full((64, 64, 3), (240, 200, 230), dtype=np.uint8))
+    patches.append(np.full((64, 64, 3), (150, 230, 180), dtype=np.uint8))
+    for n_rows in [15, 16, 17, 32, 47, 48, 49]:
+        """Tissue covers fractions of the patch on either side of 1 - BLANK_FRACTION and of BLANK_FRACTION"""
+        patch = np.full((64, 64, 3), 250, dtype=np.uint8)
+        patch[:n_rows] = (200, 120, 170)
+        patches.append(patch)
+    rng = np.random.default_rng(0)
+    patches.extend(rng.integers(150, 256, size=(8, 64, 64, 3), dtype=np.uint8))
+    keep, _ = BackgroundScorer().score(np.stack(patches))
+    expected = [bool(preprocess.check_luminance(preprocess.pillow_image_to_ndarray(
+            Image.fromarray(patch)))) for patch in patches]
+    assert keep.tolist() == expected
+    assert any(expected) and not all(expected)
+
+
+@pytest.mark.parametrize("stride", [1, 4])
+def test_background_scorer_region(stride):
+    rng = np.random.default_rng(0)
+    region = rng.integers(150, 256, size=(96, 128, 4), dtype=np.uint8)
+    offsets = np.array([(0, 0), (32, 0), (48, 16), (96, 64)])
+    scorer = BackgroundScorer(stride=stride)
+    keep, scores = scorer.score_region(region, offsets, 32)
+    patches = np.stack([region[y:y + 32, x:x + 32, :3] for x, y in offsets])
+    expected_keep, expected_scores = scorer.score(patches)
+    np.testing.assert_array_equal(keep, expected_keep)
+    np.testing.assert_allclose(scores, expected_scores)
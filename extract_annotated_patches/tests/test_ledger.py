@@ -0,0 +1,34 @@
+import os
+
+from extract_annotated_patches.ledger import (
+        ExtractionLedger, make_fingerprint)
+from extract_annotated_patches.tests import OUTPUT_DIR
+
+
+def test_make_fingerprint():
+    parameters = {'patch_size': 1024, 'resize_sizes': [512, 256], 'seed': 256}
+    assert make_fingerprint(parameters) == make_fingerprint(dict(reversed(list(parameters.items()))))
+    assert make_fingerprint(parameters) != make_fingerprint({**parameters, 'seed': 1})
+
+
+def test_extraction_ledger(clean_output):
+    ledger_location = os.path.join(OUTPUT_DIR, 'ledger.jsonl')
+    output = os.path.join(OUTPUT_DIR, 'VOA-1932A.h5')
+    open(output, 'w').close()
+    ledger = ExtractionLedger(ledger_location)
+    assert not ledger.is_complete('VOA-1932A', 'a')
+    ledger.record('VOA-1932A', 'a', [output])
+    ledger.record('VOA-1099A', 'a', [os.path.join(OUTPUT_DIR, 'VOA-1099A.h5')])
+
+    """A partially written line of a killed job is skipped"""
+    with open(ledger_location, 'a') as f:
+        f.write('{"slide_name": "VOA-3088B", "finger')
+
+    ledger = ExtractionLedger(ledger_location)
+    assert ledger.is_complete('VOA-1932A', 'a')
+    assert not ledger.is_complete('VOA-1932A', 'b')
+    assert not ledger.is_complete('VOA-1099A', 'a')
+    assert not ledger.is_complete('VOA-3088B', 'a')
+
+    ledger.record('VOA-3088B', 'a', [output])
+    assert ExtractionLedger(ledger_location).is_complete('VOA-3088B', 'a')
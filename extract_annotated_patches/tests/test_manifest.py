@@ -0,0 +1,30 @@
+from extract_annotated_patches.manifest import ManifestIndex
+
+
+def make_manifest():
+    return {
+        'slide_path': ['/slides/VOA-1932A.svs', '/slides/VOA-1002A.tiff', '/other/VOA-1932A.svs'],
+        'subtype': ['CC', 'HGSC', 'EC'],
+        'annotation_path': ['/annotations/VOA-1932A.txt', '', '/annotations/other.txt'],
+    }
+
+
+def test_manifest_index():
+    manifest = ManifestIndex(make_manifest())
+    assert len(manifest) == 3
+    assert 'subtype' in manifest and 'mask_path' not in manifest
+    assert manifest.get_row('/slides/VOA-1002A.tiff') == 1
+    assert manifest.get_row('VOA-1002A') == 1
+    assert manifest.get_row('VOA-3') is None
+    assert manifest.get_subtype('/other/VOA-1932A.svs') == 'EC'
+    """Slides with the same name are found by name in the first row"""
+    assert manifest.get_subtype('VOA-1932A') == 'CC'
+    assert manifest.get_annotation_path('VOA-1932A') == '/annotations/VOA-1932A.txt'
+    assert manifest.get_mask_path('VOA-1932A') is None
+
+
+def test_manifest_column_files():
+    manifest = ManifestIndex(make_manifest())
+    assert manifest.get_column_files('annotation_path') \
+            == {'VOA-1932A': '/annotations/VOA-1932A.txt'}
+    assert manifest.get_column_files('mask_path') == {}
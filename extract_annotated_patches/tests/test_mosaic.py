@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from PIL import Image
+
+from extract_annotated_patches.mosaic import (cut_tiles, rgb_histograms, hsv_histograms,
+        MosaicClustering)
+
+
+def test_rgb_histograms():
+    """Histograms match PIL.Image.histogram of each tile.
+    """
+    tiles = np.random.RandomState(256).randint(0, 256, size=(5, 16, 16, 3)).astype(np.uint8)
+    hists = rgb_histograms(tiles)
+    assert hists.shape == (5, 768)
+    for tile, hist in zip(tiles, hists):
+        np.testing.assert_array_equal(hist, Image.fromarray(tile).histogram())
+
+
+def test_cut_tiles():
+    image = np.arange(20 * 30 * 3, dtype=np.int64).reshape(20, 30, 3).astype(np.uint8)
+    coords = np.array([[0, 0], [80, 40], [232, 152]])
+    tiles = cut_tiles(image, coords, 8, 4)
+    assert tiles.shape == (3, 4, 4, 3)
+    np.testing.assert_array_equal(tiles[0], image[0:4, 0:4])
+    np.testing.assert_array_equal(tiles[1], image[5:9, 10:14])
+    """Tiles going past the edge are padded with white"""
+    np.testing.assert_array_equal(tiles[2, :1, :1], image[19:20, 29:30])
+    assert (tiles[2, 1:] == 255).all()
+
+
+def test_hsv_histograms():
+    tiles = np.zeros((3, 4, 4, 3), dtype=np.uint8)
+    tiles[0] = (255, 0, 0)
+    tiles[1] = (0, 0, 255)
+    tiles[2] = 255
+    hists = hsv_histograms(tiles)
+    assert hists.shape == (3, 128)
+    assert (hists.sum(axis=1) == 16).all()
+    """Bins are ordered hue, then saturation, then value"""
+    assert hists[0, (0 * 4 + 3) * 4 + 3] == 16
+    assert hists[1, (5 * 4 + 3) * 4 + 3] == 16
+    assert hists[2, (0 * 4 + 0) * 4 + 3] == 16
+
+
+@pytest.mark.parametrize("clustering", ['kmeans', 'minibatch'])
+@pytest.mark.parametrize("features", ['rgb', 'hsv'])
+def test_mosaic_clustering(clustering, features):
+    random_state = np.random.RandomState(0)
+    n_tiles = 300
+    colours = np.array([(230, 120, 180), (120, 60, 160), (240, 240, 240)], dtype=np.uint8)
+    tiles = colours[np.arange(n_tiles) % 3][:, np.newaxis, np.newaxis, :].repeat(8, axis=1).repeat(8, axis=2)
+    coords = random_state.randint(0, 100, size=(n_tiles, 2)) * 1024
+    mosaic = MosaicClustering(n_tiles, 3, 0.1, clustering=clustering, features=features,
+            batch_size=64)
+    for start in range(0, n_tiles, 50):
+        mosaic.add(tiles[start:start + 50], coords[start:start + 50])
+    assert mosaic.n_tissue == n_tiles
+    selected = mosaic.select()
+    """Each colour cluster of 100 tiles gives 10 tiles"""
+    assert selected.shape == (30, 2)
+    tile_coords = set(map(tuple, coords.tolist()))
+    assert all(coord in tile_coords for coord in map(tuple, selected.tolist()))
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+
+from extract_annotated_patches.reader import SlideReader
+from extract_annotated_patches.pipeline import PatchPipeline
+from extract_annotated_patches.tests.test_reader import PyramidSlide
+
+
+def make_slide():
+    """Tiles alternate between tissue and background"""
+    image = np.full((256, 512, 3), 255, dtype=np.uint8)
+    for i in range(0, 512, 128):
+        image[:, i:i + 64] = (200, 120, 170)
+    return PyramidSlide(image)
+
+
+def extract(reader, coords, store):
+    """Extract each tissue tile, and the tile to its right as a neighbour"""
+    for x, y in coords:
+        patch, check = reader.read(x, y)
+        if not check:
+            continue
+        for x_ in [x, x + 64]:
+            patch, check = reader.read(x_, y)
+            if not check:
+                continue
+            if isinstance(reader, PatchPipeline):
+                reader.submit('Tumor', patch, x_, y, {64: f"{x_}_{y}.png"})
+            else:
+                store('Tumor', reader.resizer.resize(patch, x_, y, [64]), x_, y,
+                        {64: f"{x_}_{y}.png"})
+
+
+@pytest.mark.parametrize("resize_threads", [0, 2])
+def test_patch_pipeline(resize_threads):
+    coords = [(x, y) for y in range(0, 256, 64) for x in range(0, 512, 128)]
+    serial_reader = SlideReader(make_slide(), 64)
+    serial = []
+    extract(serial_reader, coords, lambda *args: serial.append((args[0], *args[2:4])))
+
+    slide_reader = SlideReader(make_slide(), 64)
+    stored = []
+    with PatchPipeline(slide_reader, lambda *args: stored.append((args[0], *args[2:4])), [64],
+            read_queue_depth=2, write_queue_depth=2, resize_threads=resize_threads) as pipeline:
+        pipeline.start(coords)
+        extract(pipeline, coords, None)
+    assert stored == serial
+    assert slide_reader.read_count == serial_reader.read_count
+    assert pipeline.counts['taken'] == len(coords)
+    assert pipeline.counts['write'] == len(stored)
+
+
+def test_patch_pipeline_error():
+    def store(*args):
+        raise IOError("disk full")
+
+    pipeline = PatchPipeline(SlideReader(make_slide(), 64), store, [64])
+    patch, _ = pipeline.read(0, 0)
+    pipeline.submit('Tumor', patch, 0, 0, {64: "0_0.png"})
+    with pytest.raises(IOError):
+        pipeline.close()
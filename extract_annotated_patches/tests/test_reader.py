@@ -0,0 +1,116 @@
+import pytest
+import numpy as np
+from PIL import Image
+
+from extract_annotated_patches.reader import (PlanningReader, BlockSlideReader, group_row_runs,
+        read_row_run, group_blocks, read_block, iter_block_patches)
+
+
+class PyramidSlide(object):
+    """Slide with levels downsampled 1, 4 and 16 times from an RGB array.
+    """
+    def __init__(self, image):
+        self.level_downsamples = [1., 4., 16.]
+        self.levels = [Image.fromarray(image).resize(
+                (image.shape[1] // int(downsample), image.shape[0] // int(downsample)))
+                for downsample in self.level_downsamples]
+        self.level_dimensions = [level.size for level in self.levels]
+        self.dimensions = self.level_dimensions[0]
+        self.reads = []
+
+    def get_best_level_for_downsample(self, downsample):
+        return max(level for level, level_downsample in enumerate(self.level_downsamples)
+                if level_downsample <= downsample)
+
+    def read_region(self, location, level, size):
+        self.reads.append((level, size))
+        x, y = (int(c / self.level_downsamples[level]) for c in location)
+        return self.levels[level].crop((x, y, x + size[0], y + size[1])).convert('RGBA')
+
+
+@pytest.mark.parametrize("downsample,level", [(4, 1), (20, 2)])
+def test_planning_reader(downsample, level):
+    """Left half of the slide is tissue and right half is background"""
+    image = np.full((1024, 2048, 3), 255, dtype=np.uint8)
+    image[:, :1024] = (200, 120, 170)
+    slide = PyramidSlide(image)
+    reader = PlanningReader(slide, 256, downsample=downsample)
+    checks = [reader.read(x, y) for y in range(0, 1024, 256) for x in range(0, 2048, 256)]
+    assert all(patch is None for patch, _ in checks)
+    assert [check for _, check in checks] == [x < 1024 for y in range(0, 1024, 256)
+            for x in range(0, 2048, 256)]
+    level_size = 256 // int(slide.level_downsamples[level])
+    assert set(slide.reads) == {(level, (level_size, level_size))}
+    assert reader.read_count == len(checks)
+
+
+def test_group_row_runs():
+    coords = [(512, 0), (0, 256), (0, 0), (256, 0), (1536, 0), (768, 0), (1024, 0), (128, 256)]
+    assert group_row_runs(coords, 256, max_run_length=3) == [
+            [(0, 0), (256, 0), (512, 0)], [(768, 0), (1024, 0)], [(1536, 0)],
+            [(0, 256), (128, 256)]]
+
+
+def test_read_row_run():
+    image = np.random.default_rng(0).integers(0, 256, (512, 1024, 3), dtype=np.uint8)
+    slide = PyramidSlide(image)
+    run = [(0, 256), (128, 256), (384, 256)]
+    patches = read_row_run(slide, run, 256)
+    assert slide.reads == [(0, (640, 256))]
+    assert [coord for coord, _ in patches] == run
+    for (x, y), patch in patches:
+        assert patch.mode == 'RGB'
+        np.testing.assert_array_equal(np.asarray(patch), image[y:y + 256, x:x + 256])
+
+
+def test_group_blocks():
+    coords = [(512, 0), (0, 256), (0, 0), (256, 0), (768, 256), (128, 256), (0, 512)]
+    assert group_blocks(coords, 256, block_size=2) == [
+            [(0, 0), (256, 0), (0, 256), (128, 256)], [(512, 0), (768, 256)], [(0, 512)]]
+
+
+def test_read_block():
+    image = np.random.default_rng(0).integers(0, 256, (512, 1024, 3), dtype=np.uint8)
+    slide = PyramidSlide(image)
+    coords = [(128, 0), (384, 128), (256, 256)]
+    region, origin = read_block(slide, coords, 256)
+    assert slide.reads == [(0, (512, 512))]
+    assert origin == (128, 0)
+    for (x, y), patch in iter_block_patches(region, origin, coords, 256):
+        assert np.shares_memory(patch, region)
+        np.testing.assert_array_equal(patch, image[y:y + 256, x:x + 256])
+
+
+def test_block_slide_reader():
+    """Blocks of 2x2 tiles spaced 128 pixels apart are 384 pixels wide, cut at the right edge of the slide, and 2 are kept"""
+    image = np.full((640, 832, 3), 255, dtype=np.uint8)
+    image[:, :512] = np.random.default_rng(0).integers(0, 200, (640, 512, 3), dtype=np.uint8)
+    slide = PyramidSlide(image)
+    reader = BlockSlideReader(slide, 256, 2, step=128, cache_blocks=2)
+    coords = [(0, 0), (128, 0), (0, 128), (128, 128), (384, 128), (512, 0), (512, 128),
+            (0, 384), (0, 0), (200, 100)]
+    for x, y in coords:
+        patch, check = reader.read(x, y)
+        np.testing.assert_array_equal(np.asarray(patch), image[y:y + 256, x:x + 256])
+        assert check == (x < 512)
+    assert slide.reads == [(0, (384, 384)), (0, (384, 384)), (0, (320, 384)), (0, (384, 384)),
+            (0, (384, 384)), (0, (256, 256))]
+    assert (reader.block_reads, reader.direct_reads) == (5, 1)
+    assert reader.scores[(384, 128)] == 0.5
+    assert reader.scores[(512, 0)] == 0.
+
+
+def test_block_slide_reader_unlocked_reads():
+    """Blocks are read without holding the lock of the reader, so threads read blocks at the same time"""
+    image = np.random.default_rng(0).integers(0, 200, (512, 512, 3), dtype=np.uint8)
+    slide = PyramidSlide(image)
+    reader = BlockSlideReader(slide, 128, 2, step=128)
+    read_region = slide.read_region
+    def read_region_unlocked(location, level, size):
+        assert not reader.lock.locked()
+        return read_region(location, level, size)
+    slide.read_region = read_region_unlocked
+    for x, y in [(0, 0), (128, 128), (256, 0), (0, 0)]:
+        patch, _ = reader.read_tile(x, y)
+        np.testing.assert_array_equal(np.asarray(patch), image[y:y + 128, x:x + 128])
+    assert reader.block_reads == 2
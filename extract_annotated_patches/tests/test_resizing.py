@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+from PIL import Image
+
+from extract_annotated_patches.resizing import (
+        PatchResizer, get_pyramid_levels, resize_difference, default_resize_tolerance)
+
+
+class PyramidSlide(object):
+    """Slide with levels downsampled 1, 2 and 4 times from an RGB array.
+    """
+    def __init__(self, image):
+        self.levels = [Image.fromarray(image)]
+        for downsample in [2, 4]:
+            size = image.shape[1] // downsample, image.shape[0] // downsample
+            self.levels.append(self.levels[0].resize(size, Image.LANCZOS))
+        self.level_downsamples = [1., 2., 4.]
+        self.reads = []
+
+    def read_region(self, location, level, size):
+        self.reads.append(level)
+        x, y = (int(c / self.level_downsamples[level]) for c in location)
+        return self.levels[level].crop((x, y, x + size[0], y + size[1])).convert('RGBA')
+
+
+def smooth_image(size):
+    random_state = np.random.RandomState(0)
+    noise = random_state.randint(0, 256, size=(size // 32, size // 32, 3)).astype(np.uint8)
+    return np.asarray(Image.fromarray(noise).resize((size, size), Image.BICUBIC))
+
+
+def test_get_pyramid_levels():
+    slide = PyramidSlide(smooth_image(256))
+    assert get_pyramid_levels(slide, 512, [512, 256, 128, 100]) == {256: 1, 128: 2}
+
+
+@pytest.mark.parametrize("method", ['cascade', 'pyramid'])
+def test_patch_resizer(method):
+    image = smooth_image(1024)
+    slide = PyramidSlide(image)
+    patch = Image.fromarray(image[256:768, 256:768])
+    sizes = [512, 256, 128]
+    reference = PatchResizer(slide, 512, method='independent').resize(patch, 256, 256, sizes)
+    resizer = PatchResizer(slide, 512, method=method)
+    resized = resizer.resize(patch, 256, 256, sizes)
+    assert resized[512] is patch
+    for size in sizes:
+        assert resized[size].size == (size, size)
+        assert resize_difference(reference[size], resized[size]) <= default_resize_tolerance
+    if method == 'pyramid':
+        assert sorted(slide.reads) == [1, 2]
+    else:
+        assert slide.reads == []
+    assert all(resizer.counts[size] == 1 for size in sizes)
+
+
+def test_patch_resizer_unknown_method():
+    with pytest.raises(NotImplementedError):
+        PatchResizer(None, 512, method='nearest')
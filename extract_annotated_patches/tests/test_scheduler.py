@@ -0,0 +1,48 @@
+import pickle
+import pytest
+import numpy as np
+
+from extract_annotated_patches import AnnotatedPatchesExtractor
+from extract_annotated_patches.cache import LazyLookup
+from extract_annotated_patches.scheduler import SlidePool, SlideTask, shard_indices
+
+
+class SquareExtractor(object):
+    def square(self, slide_path, value):
+        if value < 0:
+            raise ValueError(value)
+        return value * value
+
+
+@pytest.mark.parametrize("start_method", ['fork', 'spawn'])
+def test_slide_pool(start_method):
+    pool = SlidePool(SquareExtractor(), 2, start_method=start_method)
+    args_list = [('a.svs', 1), ('b.svs', -1), ('c.svs', 3)]
+    results = sorted(pool.imap_unordered('square', args_list))
+    assert results == [(0, 1, True), (1, None, False), (2, 9, True)]
+
+
+def test_shard_indices():
+    coords = [(x, y) for x in range(0, 40, 10) for y in range(0, 40, 10)]
+    shards = shard_indices(coords, 4)
+    assert len(shards) == 4
+    """Each shard is one row of the grid"""
+    for idx in shards:
+        assert len(set(coords[i][1] for i in idx)) == 1
+    assert sorted(np.concatenate(shards).tolist()) == list(range(len(coords)))
+
+
+def test_worker_context():
+    """The extractor sent to workers leaves out the attributes describing the whole cohort"""
+    extractor = object.__new__(AnnotatedPatchesExtractor)
+    extractor.patch_size = 1024
+    extractor.manifest = {'slide_path': [f"{i}.svs" for i in range(1000)]}
+    extractor.slide_paths = extractor.manifest['slide_path']
+    extractor.slide_annotation = LazyLookup({'VOA-1932A': 'VOA-1932A.txt'},
+            extractor.load_annotation)
+    worker_extractor = pickle.loads(pickle.dumps(extractor))
+    assert worker_extractor.patch_size == 1024
+    assert not hasattr(worker_extractor, 'manifest')
+    assert not hasattr(worker_extractor, 'slide_paths')
+    assert worker_extractor.slide_annotation.loader.__self__ is worker_extractor
+    assert len(pickle.dumps(SlideTask(0, 'extract_patch_by_annotation', ('a.svs', {})))) < 200
@@ -0,0 +1,110 @@
+import os
+import json
+import tarfile
+import pytest
+import h5py
+import numpy as np
+
+from extract_annotated_patches.writers import (
+        HD5PatchWriter, HD5TensorWriter, PatchTensor, hd5_compression_kwargs,
+        TarShardWriter, save_tensor_pointers, save_patch_scores)
+from extract_annotated_patches.encoding import PatchEncoder
+from extract_annotated_patches.tests import OUTPUT_DIR
+
+
+def test_hd5_compression_kwargs():
+    assert hd5_compression_kwargs('none') == {}
+    assert hd5_compression_kwargs('lzf') == {'compression': 'lzf'}
+    assert hd5_compression_kwargs('gzip', 1) == {'compression': 'gzip', 'compression_opts': 1}
+    with pytest.raises(ValueError):
+        hd5_compression_kwargs('gzip', 10)
+    with pytest.raises(ValueError):
+        hd5_compression_kwargs('zstd')
+
+
+@pytest.mark.parametrize("compression", ['none', 'lzf', 'gzip'])
+def test_hd5_patch_writer(clean_output, compression):
+    hd5_path = os.path.join(OUTPUT_DIR, 'VOA-1932A.h5')
+    writer = HD5PatchWriter(hd5_path, compression=compression,
+            batch_size=3, initial_size=2)
+    for i in range(7):
+        writer.add('Tumor', 64, np.full((64, 64, 4), i, dtype=np.uint8), i, 2*i)
+    writer.add('Stroma', 32, np.zeros((32, 32, 3), dtype=np.uint8), 5, 5)
+    writer.close()
+
+    """Reopening appends to the existing datasets"""
+    with HD5PatchWriter(hd5_path, compression=compression) as writer:
+        writer.add('Tumor', 64, np.full((64, 64, 3), 7, dtype=np.uint8), 7, 14)
+
+    with h5py.File(hd5_path, 'r') as hf:
+        assert hf['Tumor/64/patches'].shape == (8, 64, 64, 3)
+        assert hf['Tumor/64'].attrs['count'] == 8
+        np.testing.assert_array_equal(hf['Tumor/64/coords'][:],
+                [[i, 2*i] for i in range(8)])
+        for i in range(8):
+            assert (hf['Tumor/64/patches'][i] == i).all()
+        assert hf['Stroma/32/patches'].shape == (1, 32, 32, 3)
+
+
+@pytest.mark.parametrize("memmap", [False, True])
+def test_hd5_tensor_writer(clean_output, memmap):
+    hd5_path = os.path.join(OUTPUT_DIR, 'VOA-1932A.h5')
+    with HD5TensorWriter(hd5_path, 'VOA-1932A', batch_size=3, initial_size=2,
+            memmap=memmap) as writer:
+        for i in range(7):
+            label = 'Tumor' if i % 2 == 0 else 'Stroma'
+            writer.add(label, 64, np.full((64, 64, 4), i, dtype=np.uint8), i, 2*i)
+            writer.add(label, 32, np.full((32, 32, 3), i, dtype=np.uint8), i, 2*i)
+    assert writer.pointers[:4] == [(64, 0), (32, 0), (64, 1), (32, 1)]
+    """Raw files staging memmap patches are removed on close"""
+    assert not [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.raw')]
+
+    tensor = PatchTensor(hd5_path, 64)
+    assert tensor.is_memmap == memmap
+    assert len(tensor) == 7 and tensor.patches.shape == (7, 64, 64, 3)
+    np.testing.assert_array_equal(tensor.coords, [[i, 2*i] for i in range(7)])
+    assert list(tensor.label) == ['Tumor', 'Stroma'] * 3 + ['Tumor']
+    assert set(tensor.slide) == {'VOA-1932A'}
+    for i in range(7):
+        assert (tensor[i] == i).all()
+    assert (tensor[2:5][:, 0, 0, 0] == [2, 3, 4]).all()
+    tensor.close()
+
+    metadata_path = os.path.join(OUTPUT_DIR, 'metadata.h5')
+    save_tensor_pointers(metadata_path, hd5_path, writer.pointers)
+    with h5py.File(metadata_path, 'r') as hf:
+        assert hf['tensor'].attrs['path'] == 'VOA-1932A.h5'
+        np.testing.assert_array_equal(hf['tensor/index'][:2], [[64, 0], [32, 0]])
+
+
+def test_save_patch_scores(clean_output):
+    metadata_path = os.path.join(OUTPUT_DIR, 'metadata.h5')
+    save_patch_scores(metadata_path, [('Tumor', 0, 0), ('Stroma', 256, 512)], [1.0, 0.5])
+    with h5py.File(metadata_path, 'r') as hf:
+        assert [label.decode() for label in hf['scores/label'][:]] == ['Tumor', 'Stroma']
+        np.testing.assert_array_equal(hf['scores/coords'][:], [[0, 0], [256, 512]])
+        np.testing.assert_allclose(hf['scores/score'][:], [1.0, 0.5])
+    save_patch_scores(metadata_path, [], [])
+    with h5py.File(metadata_path, 'r') as hf:
+        assert hf['scores/coords'].shape == (0, 2)
+
+
+def test_tar_shard_writer(clean_output):
+    """Each raw 16x16 patch takes 1 block of header and 2 blocks of data, so shards roll every 3 patches"""
+    with TarShardWriter(OUTPUT_DIR, 'VOA-1932A', PatchEncoder('raw'),
+            max_shard_size=9 * tarfile.BLOCKSIZE) as writer:
+        for i in range(7):
+            writer.add('Tumor', 16, np.full((16, 16, 3), i, dtype=np.uint8), i, 2*i)
+    shards = sorted(f for f in os.listdir(OUTPUT_DIR) if f.endswith('.tar'))
+    assert shards == ['VOA-1932A-000000.tar', 'VOA-1932A-000001.tar', 'VOA-1932A-000002.tar']
+    with open(os.path.join(OUTPUT_DIR, 'VOA-1932A-index.jsonl')) as f:
+        index = [json.loads(line) for line in f]
+    assert len(index) == 7
+    for i, entry in enumerate(index):
+        assert entry['shard'] == shards[i // 3]
+        assert (entry['label'], entry['resize_size'], entry['x'], entry['y']) == ('Tumor', 16, i, 2*i)
+        with open(os.path.join(OUTPUT_DIR, entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            assert f.read(entry['size']) == bytes([i]) * 16 * 16 * 3
+    with tarfile.open(os.path.join(OUTPUT_DIR, shards[0])) as tar:
+        assert tar.getnames() == ['Tumor/16/0_0.raw', 'Tumor/16/1_2.raw', 'Tumor/16/2_4.raw']
@@ -0,0 +1,555 @@
+"""Writers used to store extracted patches on disk.
+"""
+import io
+import os
+import json
+import tarfile
+
+import h5py
+import numpy as np
+
+HD5_COMPRESSIONS = ['none', 'lzf', 'gzip']
+default_hd5_compression = 'gzip'
+default_hd5_compression_level = 4
+default_hd5_batch_size = 64
+HD5_LAYOUTS = ['group', 'tensor']
+default_hd5_layout = 'group'
+"""Size of tar shards in MB"""
+default_tar_shard_size = 1024
+
+
+def hd5_compression_kwargs(compression, compression_level=None):
+    """Get the keyword arguments passed to h5py.Group.create_dataset for a compression codec.
+
+    Parameters
+    ----------
+    compression : str
+        One of 'none', 'lzf' or 'gzip'.
+
+    compression_level : int
+        Level of gzip compression from 1 to 9. Ignored for the other codecs.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for create_dataset.
+    """
+    if compression is None or compression == 'none':
+        return {}
+    elif compression == 'lzf':
+        return {'compression': 'lzf'}
+    elif compression == 'gzip':
+        if compression_level is None:
+            compression_level = default_hd5_compression_level
+        if not 1 <= compression_level <= 9:
+            raise ValueError(f"gzip compression level should be between 1 and 9, got {compression_level}")
+        return {'compression': 'gzip', 'compression_opts': compression_level}
+    else:
+        raise ValueError(f"Unknown HDF5 compression {compression}. Choose from {HD5_COMPRESSIONS}")
+
+
+class PatchCollector(object):
+    """Collects patches in memory with the same add method as HD5PatchWriter.
+
+    Used by worker processes to send patches to the process that owns the HDF5 file of a slide.
+    """
+    def __init__(self):
+        self.patches = []
+
+    def add(self, label, resize_size, patch, x, y):
+        self.patches.append((label, resize_size, np.asarray(patch, dtype=np.uint8), x, y))
+
+    def pop(self):
+        """Get the collected patches and empty the collector.
+        """
+        patches, self.patches = self.patches, []
+        return patches
+
+
+class HD5PatchWriter(object):
+    """Writes the patches of one slide into a single HDF5 file.
+
+    The file is opened once and patches are buffered in memory and written in batches.
+    There is one group per label and patch size, each containing:
+     - patches : uint8 dataset of shape (N, H, W, 3)
+     - coords : int64 dataset of shape (N, 2) with the x, y coordinate of each patch
+
+    Datasets are preallocated and grown by doubling, then trimmed to the number of written patches on close.
+
+    Attributes
+    ----------
+    hd5_path : str
+        Path of HDF5 file to write patches into.
+
+    mode : str
+        Mode to open the HDF5 file with. 'a' appends to existing groups and 'w' truncates the file.
+
+    counts : dict of str: int
+        Number of patches written to each group.
+    """
+    def __init__(self, hd5_path, compression=default_hd5_compression,
+            compression_level=default_hd5_compression_level,
+            batch_size=default_hd5_batch_size, initial_size=256, mode='a'):
+        self.hd5_path = hd5_path
+        self.compression_kwargs = hd5_compression_kwargs(compression, compression_level)
+        self.batch_size = batch_size
+        self.initial_size = initial_size
+        self.counts = {}
+        self.buffers = {}
+        os.makedirs(os.path.dirname(os.path.abspath(hd5_path)), exist_ok=True)
+        self.hf = h5py.File(hd5_path, mode)
+
+    @staticmethod
+    def get_group_name(label, resize_size):
+        return f"{label}/{resize_size}"
+
+    def create_group(self, group_name, patch_shape):
+        """Create the resizable patches and coords datasets of a group, or reopen them if they exist.
+        """
+        if group_name in self.hf:
+            group = self.hf[group_name]
+            self.counts[group_name] = group.attrs['count']
+            return group
+        group = self.hf.create_group(group_name)
+        group.create_dataset('patches', shape=(self.initial_size, *patch_shape),
+                maxshape=(None, *patch_shape), dtype=np.uint8,
+                chunks=(1, *patch_shape), **self.compression_kwargs)
+        group.create_dataset('coords', shape=(self.initial_size, 2),
+                maxshape=(None, 2), dtype=np.int64)
+        group.attrs['count'] = 0
+        self.counts[group_name] = 0
+        return group
+
+    def add(self, label, resize_size, patch, x, y):
+        """Buffer a patch. The buffer is written once it reaches batch_size patches.
+
+        Parameters
+        ----------
+        label : str
+            Label of the patch.
+
+        resize_size : int
+            Size of the patch in pixels.
+
+        patch : np.ndarray or PIL.Image
+            RGB patch of shape (H, W, 3). An alpha channel is dropped.
+
+        x, y : int
+            Coordinate of top left corner of the patch.
+        """
+        patch = np.asarray(patch, dtype=np.uint8)
+        if patch.ndim == 3 and patch.shape[2] == 4:
+            patch = patch[:, :, :3]
+        group_name = self.get_group_name(label, resize_size)
+        if group_name not in self.buffers:
+            self.buffers[group_name] = ([], [])
+        patches, coords = self.buffers[group_name]
+        patches.append(patch)
+        coords.append((x, y))
+        if len(patches) >= self.batch_size:
+            self.flush_group(group_name)
+
+    def flush_group(self, group_name):
+        patches, coords = self.buffers.pop(group_name, ([], []))
+        if not patches:
+            return
+        patches = np.stack(patches)
+        group = self.create_group(group_name, patches.shape[1:])
+        start = self.counts[group_name]
+        end = start + len(patches)
+        capacity = group['patches'].shape[0]
+        if end > capacity:
+            capacity = max(end, 2 * capacity)
+            group['patches'].resize(capacity, axis=0)
+            group['coords'].resize(capacity, axis=0)
+        group['patches'][start:end] = patches
+        group['coords'][start:end] = np.array(coords, dtype=np.int64)
+        group.attrs['count'] = end
+        self.counts[group_name] = end
+
+    def flush(self):
+        """Write all buffered patches.
+        """
+        for group_name in list(self.buffers.keys()):
+            self.flush_group(group_name)
+
+    def close(self):
+        """Write all buffered patches, trim datasets to the number of written patches and close the file.
+        """
+        if self.hf is None:
+            return
+        self.flush()
+        for group_name, count in self.counts.items():
+            group = self.hf[group_name]
+            group['patches'].resize(count, axis=0)
+            group['coords'].resize(count, axis=0)
+        self.hf.close()
+        self.hf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HD5TensorWriter(object):
+    """Writes the patches of one slide into a single HDF5 file with one patch tensor per resize size, ready to be sliced by data loaders.
+
+    There is one group per resize size, each containing:
+     - patches : uint8 dataset of shape (N, S, S, 3) with the patches of every label
+     - coords : int64 dataset of shape (N, 2) with the x, y coordinate of each patch
+     - label : int16 dataset of shape (N,) with the index of the label of each patch in the labels attribute of the file
+     - slide : int16 dataset of shape (N,) with the index of the slide of each patch in the slides attribute of the file
+
+    The patches dataset is chunked one patch per chunk, so reading a random patch decompresses only that patch.
+    With memmap, patches are stored uncompressed and contiguously instead, so PatchTensor maps them into memory and slicing them does not copy. Patches are then staged in a raw file next to the HDF5 file and copied into it on close, since contiguous datasets cannot be grown.
+
+    Attributes
+    ----------
+    hd5_path : str
+        Path of HDF5 file to write patches into.
+
+    slide_name : str
+        Name of the slide whose patches are written.
+
+    counts : dict of int: int
+        Number of patches written to each resize size.
+
+    pointers : list of tuple of int
+        The resize size and row of each added patch in order.
+    """
+    def __init__(self, hd5_path, slide_name, compression=default_hd5_compression,
+            compression_level=default_hd5_compression_level,
+            batch_size=default_hd5_batch_size, initial_size=256, memmap=False):
+        self.hd5_path = hd5_path
+        self.slide_name = slide_name
+        self.memmap = memmap
+        self.compression_kwargs = {} if memmap \
+                else hd5_compression_kwargs(compression, compression_level)
+        self.batch_size = batch_size
+        self.initial_size = initial_size
+        self.labels = []
+        self.counts = {}
+        self.rows = {}
+        self.buffers = {}
+        self.patch_shapes = {}
+        self.pointers = []
+        os.makedirs(os.path.dirname(os.path.abspath(hd5_path)), exist_ok=True)
+        self.hf = h5py.File(hd5_path, 'w')
+
+    def get_raw_path(self, resize_size):
+        return f"{self.hd5_path}.{resize_size}.raw"
+
+    def create_group(self, resize_size, patch_shape):
+        """Create the resizable datasets of a resize size.
+        """
+        group = self.hf.create_group(str(resize_size))
+        if not self.memmap:
+            group.create_dataset('patches', shape=(self.initial_size, *patch_shape),
+                    maxshape=(None, *patch_shape), dtype=np.uint8,
+                    chunks=(1, *patch_shape), **self.compression_kwargs)
+        group.create_dataset('coords', shape=(self.initial_size, 2),
+                maxshape=(None, 2), dtype=np.int64)
+        group.create_dataset('label', shape=(self.initial_size,),
+                maxshape=(None,), dtype=np.int16)
+        group.create_dataset('slide', shape=(self.initial_size,),
+                maxshape=(None,), dtype=np.int16)
+        group.attrs['count'] = 0
+        self.counts[resize_size] = 0
+        self.patch_shapes[resize_size] = patch_shape
+        return group
+
+    def add(self, label, resize_size, patch, x, y):
+        """Buffer a patch. The buffer is written once it reaches batch_size patches.
+
+        Parameters
+        ----------
+        label : str
+            Label of the patch.
+
+        resize_size : int
+            Size of the patch in pixels.
+
+        patch : np.ndarray or PIL.Image
+            RGB patch of shape (H, W, 3). An alpha channel is dropped.
+
+        x, y : int
+            Coordinate of top left corner of the patch.
+        """
+        patch = np.asarray(patch, dtype=np.uint8)
+        if patch.ndim == 3 and patch.shape[2] == 4:
+            patch = patch[:, :, :3]
+        if label not in self.labels:
+            self.labels.append(label)
+        if resize_size not in self.buffers:
+            self.buffers[resize_size] = ([], [], [])
+        patches, coords, labels = self.buffers[resize_size]
+        patches.append(patch)
+        coords.append((x, y))
+        labels.append(self.labels.index(label))
+        row = self.rows.get(resize_size, 0)
+        self.rows[resize_size] = row + 1
+        self.pointers.append((resize_size, row))
+        if len(patches) >= self.batch_size:
+            self.flush_group(resize_size)
+
+    def flush_group(self, resize_size):
+        patches, coords, labels = self.buffers.pop(resize_size, ([], [], []))
+        if not patches:
+            return
+        patches = np.stack(patches)
+        if resize_size in self.counts:
+            group = self.hf[str(resize_size)]
+        else:
+            group = self.create_group(resize_size, patches.shape[1:])
+        start = self.counts[resize_size]
+        end = start + len(patches)
+        capacity = group['coords'].shape[0]
+        if end > capacity:
+            capacity = max(end, 2 * capacity)
+            for name in group:
+                group[name].resize(capacity, axis=0)
+        if self.memmap:
+            with open(self.get_raw_path(resize_size), 'ab') as f:
+                f.write(np.ascontiguousarray(patches).tobytes())
+        else:
+            group['patches'][start:end] = patches
+        group['coords'][start:end] = np.array(coords, dtype=np.int64)
+        group['label'][start:end] = np.array(labels, dtype=np.int16)
+        group['slide'][start:end] = 0
+        group.attrs['count'] = end
+        self.counts[resize_size] = end
+
+    def flush(self):
+        """Write all buffered patches.
+        """
+        for resize_size in list(self.buffers.keys()):
+            self.flush_group(resize_size)
+
+    def close(self):
+        """Write all buffered patches, trim datasets to the number of written patches and close the file.
+        """
+        if self.hf is None:
+            return
+        self.flush()
+        for resize_size, count in self.counts.items():
+            group = self.hf[str(resize_size)]
+            for name in group:
+                group[name].resize(count, axis=0)
+            if self.memmap:
+                self.copy_raw_patches(group, resize_size, count)
+        self.hf.attrs['layout'] = 'tensor'
+        self.hf.attrs['labels'] = self.labels
+        self.hf.attrs['slides'] = [self.slide_name]
+        self.hf.close()
+        self.hf = None
+
+    def copy_raw_patches(self, group, resize_size, count):
+        """Copy the patches staged in the raw file of a resize size into a contiguous dataset and remove the raw file.
+        """
+        shape = (count, *self.patch_shapes[resize_size])
+        raw_path = self.get_raw_path(resize_size)
+        raw = np.memmap(raw_path, dtype=np.uint8, mode='r', shape=shape)
+        patches = group.create_dataset('patches', shape=shape, dtype=np.uint8)
+        step = 16 * self.batch_size
+        for start in range(0, count, step):
+            patches[start:start + step] = raw[start:start + step]
+        del raw
+        os.remove(raw_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PatchTensor(object):
+    """Patches of one resize size in an HDF5 file written by HD5TensorWriter.
+
+    Uncompressed contiguous patches are mapped into memory, so slicing patches does not copy them. Otherwise patches are read from the HDF5 dataset.
+
+    Attributes
+    ----------
+    patches : np.memmap or h5py.Dataset
+        Patches of shape (N, S, S, 3).
+
+    coords : np.ndarray
+        The x, y coordinate of each patch.
+
+    label : np.ndarray
+        The label of each patch.
+
+    slide : np.ndarray
+        The name of the slide of each patch.
+    """
+    def __init__(self, hd5_path, resize_size):
+        self.hf = h5py.File(hd5_path, 'r')
+        group = self.hf[str(resize_size)]
+        labels = np.array([str(label) for label in self.hf.attrs['labels']])
+        slides = np.array([str(slide) for slide in self.hf.attrs['slides']])
+        self.coords = group['coords'][()]
+        self.label = labels[group['label'][()]]
+        self.slide = slides[group['slide'][()]]
+        dataset = group['patches']
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and dataset.compression is None and offset is not None:
+            self.patches = np.memmap(hd5_path, dtype=np.uint8, mode='r',
+                    offset=offset, shape=dataset.shape)
+        else:
+            self.patches = dataset
+
+    @property
+    def is_memmap(self):
+        return isinstance(self.patches, np.memmap)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, idx):
+        return self.patches[idx]
+
+    def close(self):
+        self.hf.close()
+
+
+def save_tensor_pointers(hd5_path, tensor_path, pointers):
+    """Save where the patch of each path saved by utils.save_hdf5 is in the tensor file written by HD5TensorWriter.
+
+    The tensor group of hd5_path gets the path of the tensor file relative to hd5_path in its path attribute, and an index dataset with the resize size and row of each patch in the same order as the saved paths.
+    """
+    with h5py.File(hd5_path, 'a') as hf:
+        if 'tensor' in hf:
+            del hf['tensor']
+        group = hf.create_group('tensor')
+        group.attrs['path'] = os.path.relpath(os.path.abspath(tensor_path),
+                os.path.dirname(os.path.abspath(hd5_path)))
+        group.create_dataset('index', data=np.array(pointers, dtype=np.int64).reshape(-1, 2))
+
+
+def save_patch_scores(hd5_path, extracted, scores):
+    """Save the background score of each extracted patch of a slide into hd5_path.
+
+    The scores group of hd5_path gets the label, coords and score datasets, with one row per extracted patch in the order it was extracted. The score is the fraction of pixels of the patch that are not blank, from BackgroundScorer.
+
+    Parameters
+    ----------
+    extracted : list of tuple
+        The label, x, y of each extracted patch.
+
+    scores : list of float
+        Score of each extracted patch.
+    """
+    with h5py.File(hd5_path, 'a') as hf:
+        if 'scores' in hf:
+            del hf['scores']
+        group = hf.create_group('scores')
+        group.create_dataset('label', data=np.array([label for label, _, _ in extracted],
+                dtype=object), dtype=h5py.string_dtype())
+        group.create_dataset('coords', data=np.array([(x, y) for _, x, y in extracted],
+                dtype=np.int64).reshape(-1, 2))
+        group.create_dataset('score', data=np.array(scores, dtype=np.float32))
+
+
+class TarShardWriter(object):
+    """Streams the encoded patches of one slide into tar shards of bounded size, readable sequentially by WebDataset-style loaders.
+
+    Shards are named <slide_name>-<shard>.tar with shards numbered from 000000. Each patch is a member named <label>/<resize_size>/<x>_<y>.<extension>, so the key of the sample is everything before the extension. A shard is written to a temporary file and renamed once full, so a complete shard is never partially written. Each slide is extracted by one process, which owns its shards, so no locks are needed.
+
+    The sidecar index <slide_name>-index.jsonl is written on close, with one line per patch giving its shard, member name, offset and size of its data in the shard, label, resize size and x, y coordinate.
+
+    Attributes
+    ----------
+    shard_location : str
+        Directory to write the shards and index into.
+
+    slide_name : str
+        Name of the slide whose patches are written.
+
+    encoder : PatchEncoder
+        Encoder of the patches.
+
+    max_shard_size : int
+        Size in bytes above which a new shard is started.
+    """
+    def __init__(self, shard_location, slide_name, encoder,
+            max_shard_size=default_tar_shard_size * 2**20):
+        self.shard_location = shard_location
+        self.slide_name = slide_name
+        self.encoder = encoder
+        self.max_shard_size = max_shard_size
+        self.shard_idx = -1
+        self.shard_names = []
+        self.index = []
+        self.tar = None
+        os.makedirs(shard_location, exist_ok=True)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.shard_location, f"{self.slide_name}-index.jsonl")
+
+    def get_shard_name(self, shard_idx):
+        return f"{self.slide_name}-{shard_idx:06d}.tar"
+
+    def open_shard(self):
+        self.close_shard()
+        self.shard_idx += 1
+        self.shard_names.append(self.get_shard_name(self.shard_idx))
+        shard_path = os.path.join(self.shard_location, self.shard_names[-1])
+        self.tar = tarfile.open(f"{shard_path}.tmp", 'w', format=tarfile.USTAR_FORMAT)
+
+    def close_shard(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        shard_path = os.path.join(self.shard_location, self.shard_names[-1])
+        os.replace(f"{shard_path}.tmp", shard_path)
+        self.tar = None
+
+    def add(self, label, resize_size, patch, x, y):
+        """Encode a patch and append it to the current shard.
+
+        Parameters
+        ----------
+        label : str
+            Label of the patch.
+
+        resize_size : int
+            Size of the patch in pixels.
+
+        patch : np.ndarray or PIL.Image
+            RGB patch of shape (H, W, 3).
+
+        x, y : int
+            Coordinate of top left corner of the patch.
+        """
+        data = self.encoder.encode(patch)
+        if self.tar is None or (self.tar.offset > 0
+                and self.tar.offset + tarfile.BLOCKSIZE + len(data) > self.max_shard_size):
+            self.open_shard()
+        name = f"{label}/{resize_size}/{x}_{y}.{self.encoder.extension}"
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        """Data is padded to the next block after its header"""
+        padding = -len(data) % tarfile.BLOCKSIZE
+        self.index.append({'shard': self.shard_names[-1], 'name': name,
+                'offset': self.tar.offset - padding - len(data), 'size': len(data),
+                'label': label, 'resize_size': resize_size, 'x': x, 'y': y})
+
+    def close(self):
+        """Close the current shard and write the sidecar index.
+        """
+        self.close_shard()
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for entry in self.index:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
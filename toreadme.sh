@@ -76,4 +76,8 @@ singularity run -B /projects/ovcare/classification -B /projects/ovcare/WSI singu
 
 1. The number of arrays should be set to value of \`num_slides / num_patch_workers\`.
 2. For fastest way, set the \`num_patch_workers=1\`, then number of arrays is \`num_slides\`.
+
+## Tile Grid and Reproducibility
+
+By default the tiles of each slide are those of \`SlideCoordsExtractor\`, in its order and with its shuffle, so running again with the same \`--seed\` and \`--max_slide_patches\` selects the same patches as previous versions. \`--tile_grid numpy\` builds the tile grid in NumPy instead, which is faster on large slides. It leaves out the tiles at the right and bottom edges that do not fit fully in the slide and shuffles tiles with NumPy, so it selects different patches for the same seed than \`--tile_grid extractor\`.
 """ >> README.md